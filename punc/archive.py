@@ -0,0 +1,289 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# Copyright 2010 Andrew Fort
+
+"""PUNC's compressed archive of every version of each target."""
+
+
+import bisect
+import difflib
+import hashlib
+import logging
+import os
+import time
+import zlib
+
+import punc.output
+
+
+# Record kinds: a keyframe holds a whole version, a delta holds the
+# changes from the previous version.
+KEYFRAME = 'K'
+DELTA = 'D'
+
+# The most lines of either version differing (after their common first
+# and last lines) which are diffed; versions differing more are stored
+# as keyframes.
+MAX_DIFF_LINES = 2000
+
+
+def encode_delta(old, new):
+    """Returns the line delta from one version to the next.
+
+    The delta is a sequence of operations: 'c <start> <end>\\n' copies
+    lines [start:end) of the old version, and 'i <size>\\n' followed by
+    size bytes inserts new text. Only the lines between those the versions
+    start and end with in common are diffed.
+
+    Args:
+      old: A string, the previous version.
+      new: A string, the new version.
+
+    Returns:
+      A string, or None if the versions differ in too many lines.
+    """
+    old_lines = old.splitlines(True)
+    new_lines = new.splitlines(True)
+    common = min(len(old_lines), len(new_lines))
+    prefix = 0
+    while prefix < common and old_lines[prefix] == new_lines[prefix]:
+        prefix += 1
+    suffix = 0
+    while (suffix < common - prefix and
+           old_lines[-suffix - 1] == new_lines[-suffix - 1]):
+        suffix += 1
+    old_end = len(old_lines) - suffix
+    new_end = len(new_lines) - suffix
+    if max(old_end, new_end) - prefix > MAX_DIFF_LINES:
+        return None
+
+    ops = []
+    if prefix:
+        ops.append('c 0 %d\n' % prefix)
+    matcher = difflib.SequenceMatcher(None, old_lines[prefix:old_end],
+                                      new_lines[prefix:new_end])
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            ops.append('c %d %d\n' % (prefix + i1, prefix + i2))
+        elif j2 > j1:
+            text = ''.join(new_lines[prefix + j1:prefix + j2])
+            ops.append('i %d\n' % len(text))
+            ops.append(text)
+    if suffix:
+        ops.append('c %d %d\n' % (old_end, len(old_lines)))
+    return ''.join(ops)
+
+
+def apply_delta(old, delta):
+    """Returns the version produced by applying a delta to the previous one.
+
+    Args:
+      old: A string, the previous version.
+      delta: A string, from encode_delta().
+    """
+    old_lines = old.splitlines(True)
+    result = []
+    pos = 0
+    while pos < len(delta):
+        end = delta.index('\n', pos)
+        op = delta[pos:end].split()
+        pos = end + 1
+        if op[0] == 'c':
+            result.extend(old_lines[int(op[1]):int(op[2])])
+        else:
+            size = int(op[1])
+            result.append(delta[pos:pos + size])
+            pos += size
+    return ''.join(result)
+
+
+class Archive(object):
+    """Every version of each target written, delta encoded and compressed.
+
+    Each target has a data file of zlib compressed records, and an index
+    file with a line for each version: its time, record kind, offset and
+    length in the data file, and content digest. Both are only appended
+    to. Every keyframe_interval-th record is a keyframe, so finding a
+    version means decompressing at most that many records. Versions too
+    different from the previous one to diff cheaply are also keyframes.
+
+    A version is only recorded when the target's content changes. The
+    latest version is also kept whole (compressed), so a new version is
+    diffed against it without replaying the records since the keyframe.
+
+    Attributes:
+      directory: A string, the archive directory.
+      base_path: A string, the directory target paths are relative to.
+      keyframe_interval: An int, the number of records per keyframe.
+      when: A float, the time of the versions recorded by add().
+    """
+
+    DATA_SUFFIX = '.z'
+    INDEX_SUFFIX = '.idx'
+    LATEST_SUFFIX = '.last'
+
+    def __init__(self, directory, base_path, keyframe_interval=10,
+                 when=None):
+        self.directory = directory
+        self.base_path = base_path
+        self.keyframe_interval = max(int(keyframe_interval), 1)
+        if when is None:
+            when = time.time()
+        self.when = when
+
+    def __repr__(self):
+        return ('%s(%r, %r, keyframe_interval=%r)' %
+                (self.__class__.__name__, self.directory, self.base_path,
+                 self.keyframe_interval))
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def index(self, name):
+        """Returns the index of a target.
+
+        Args:
+          name: A string, the target path relative to base_path.
+
+        Returns:
+          A list of tuples (time, kind, offset, length, digest), oldest
+          first.
+        """
+        path = self._path(name) + self.INDEX_SUFFIX
+        if not os.path.exists(path):
+            return []
+        entries = []
+        f = open(path)
+        try:
+            for line in f:
+                fields = line.split()
+                if len(fields) != 5:
+                    # An interrupted write.
+                    continue
+                entries.append((float(fields[0]), fields[1], int(fields[2]),
+                                int(fields[3]), fields[4]))
+        finally:
+            f.close()
+        return entries
+
+    def _read(self, name, entries, i):
+        """Returns version i of a target, from the preceding keyframe."""
+        start = i
+        while entries[start][1] != KEYFRAME:
+            start -= 1
+        content = ''
+        f = open(self._path(name) + self.DATA_SUFFIX, 'rb')
+        try:
+            for _, kind, offset, length, _ in entries[start:i + 1]:
+                f.seek(offset)
+                record = zlib.decompress(f.read(length))
+                if kind == KEYFRAME:
+                    content = record
+                else:
+                    content = apply_delta(content, record)
+        finally:
+            f.close()
+        return content
+
+    def _latest(self, name, entries):
+        """Returns the latest version of a target."""
+        try:
+            f = open(self._path(name) + self.LATEST_SUFFIX, 'rb')
+            try:
+                content = zlib.decompress(f.read())
+            finally:
+                f.close()
+            if hashlib.sha1(content).hexdigest() == entries[-1][4]:
+                return content
+        except (OSError, IOError, zlib.error):
+            pass
+        # Missing, or not updated after the last record was written.
+        return self._read(name, entries, len(entries) - 1)
+
+    def get(self, name, when=None):
+        """Returns the version of a target current at a time.
+
+        Args:
+          name: A string, the target path relative to base_path.
+          when: A float, the time; None for the latest version.
+
+        Returns:
+          A string, or None if the target had no version at that time.
+        """
+        entries = self.index(name)
+        if when is None:
+            i = len(entries)
+        else:
+            i = bisect.bisect_right([e[0] for e in entries], when)
+        if not i:
+            return None
+        return self._read(name, entries, i - 1)
+
+    def add(self, path, digest, data):
+        """Records a version of a target file, if its content has changed.
+
+        Args:
+          path: A string, the target file's path.
+          digest: A string, the sha1 hex digest of data.
+          data: A string, the target's content.
+
+        Returns:
+          A boolean, True if a version was recorded.
+        """
+        name = os.path.relpath(path, self.base_path)
+        try:
+            entries = self.index(name)
+            if entries and entries[-1][4] == digest:
+                return False
+            since = 0
+            for entry in reversed(entries):
+                since += 1
+                if entry[1] == KEYFRAME:
+                    break
+            kind, record = KEYFRAME, data
+            if entries and since < self.keyframe_interval:
+                delta = encode_delta(self._latest(name, entries), data)
+                if delta is not None and len(delta) < len(data) / 2:
+                    kind, record = DELTA, delta
+            record = zlib.compress(record)
+
+            data_path = self._path(name) + self.DATA_SUFFIX
+            punc.output.make_dirs(os.path.dirname(data_path))
+            f = open(data_path, 'ab')
+            try:
+                f.seek(0, os.SEEK_END)
+                offset = f.tell()
+                f.write(record)
+            finally:
+                f.close()
+            f = open(self._path(name) + self.INDEX_SUFFIX, 'a')
+            try:
+                f.write('%.6f %s %d %d %s\n' % (self.when, kind, offset,
+                                                len(record), digest))
+            finally:
+                f.close()
+            latest_path = self._path(name) + self.LATEST_SUFFIX
+            f = open(latest_path + '.tmp', 'wb')
+            try:
+                if kind == KEYFRAME:
+                    f.write(record)
+                else:
+                    f.write(zlib.compress(data))
+            finally:
+                f.close()
+            os.rename(latest_path + '.tmp', latest_path)
+        except (OSError, IOError, zlib.error), e:
+            logging.error('Could not archive %r. %s: %s',
+                          path, e.__class__.__name__, str(e))
+            return False
+        return True
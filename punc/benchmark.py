@@ -0,0 +1,362 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# Copyright 2010 Andrew Fort
+
+"""PUNC's parser benchmark.
+
+Times every parser of every ruleset on synthetic device outputs of each
+size, reporting lines per second and peak memory, e.g.:
+
+  python -m punc.benchmark --sizes 1000,100000 --output bench.json
+
+Results may be compared to those of an earlier benchmark with --compare,
+which exits non-zero if any parser has slowed by more than --tolerance.
+"""
+
+
+import json
+import logging
+import multiprocessing
+import optparse
+import platform
+import random
+import resource
+import sys
+import time
+
+import punc.parser
+import punc.ruleset_factory
+
+
+DEFAULT_SIZES = (1000, 10000, 100000, 1000000)
+DEFAULT_REPEAT = 3
+DEFAULT_TOLERANCE = 0.2
+DEFAULT_SEED = 2010
+
+# Lines removed by the parsers of each ruleset, mixed into its output.
+NOISE = {
+    'cisco': ('Building configuration...',
+              'Current configuration : 123456 bytes',
+              'ntp clock-period 17179869',
+              'Using 12345 out of 524288 bytes'),
+    'nos': ('Building configuration...',
+            'Current configuration : 123456 bytes'),
+    'nortel_bay': ('Building configuration...',
+                   'Current configuration : 123456 bytes'),
+    'telco': ('Building the configuration ...',
+              'Current configuration: 123456 bytes'),
+    'juniper': ('## Last commit: 2010-06-01 10:00:00 EST by rancid',),
+    'netscreen': ('Total Config size 123456:',),
+    'nortel_esr': ('Preparing to Display Configuration...',
+                   '# TUE JUN 01 10:00:00 2010'),
+    'nortel_esu': ('Command: show configuration',
+                   'Using 12345 out of 524288 bytes'),
+    'timetra': ('# TiMOS-B-7.0.R6 both/hops ALCATEL SR 7750',
+                '# Built on Thu Mar 4 10:00:00 PST 2010',
+                '# Generated TUE JUN 01 10:00:00 2010 UTC',
+                '# Finished TUE JUN 01 10:00:01 2010 UTC'),
+    'arbor': ('Boot time: Tue Jun 1 10:00:00 2010',
+              'Load averages: 0.10 0.20 0.30'),
+    }
+
+
+def _address(rnd):
+    return '10.%d.%d.%d' % (rnd.randint(0, 255), rnd.randint(0, 255),
+                            rnd.randint(1, 254))
+
+
+def _ios_block(rnd, i):
+    """An IOS style interface or access list block."""
+    if rnd.random() < 0.2:
+        lines = ['ip access-list extended ACL-%d' % i]
+        for _ in xrange(rnd.randint(5, 50)):
+            lines.append(' permit tcp host %s host %s eq %d' %
+                         (_address(rnd), _address(rnd), rnd.randint(1, 65535)))
+        return lines + ['!']
+    return ['interface GigabitEthernet%d/%d' % (i / 48, i % 48),
+            ' description link %d to %s' % (i, _address(rnd)),
+            ' ip address %s 255.255.255.0' % _address(rnd),
+            ' no ip redirects',
+            ' no shutdown',
+            '!']
+
+
+def _junos_block(rnd, i):
+    """A Junos style hierarchical interface block."""
+    return ['    ge-%d/0/%d {' % (i / 48, i % 48),
+            '        description "link %d";' % i,
+            '        unit 0 {',
+            '            family inet {',
+            '                address %s/24;' % _address(rnd),
+            '            }',
+            '        }',
+            '    }']
+
+
+def _set_block(rnd, i):
+    """A flat 'set' command style block."""
+    return ['set interface ethernet%d/%d ip %s/24' % (i / 48, i % 48,
+                                                      _address(rnd)),
+            'set interface ethernet%d/%d description "link %d"' % (
+                i / 48, i % 48, i),
+            'set interface ethernet%d/%d manage ping' % (i / 48, i % 48)]
+
+
+def _timos_block(rnd, i):
+    """A TiMOS style indented port block."""
+    return ['        port %d/1/%d' % (i / 48, i % 48),
+            '            description "link %d to %s"' % (i, _address(rnd)),
+            '            ethernet',
+            '            exit',
+            '            no shutdown',
+            '        exit']
+
+
+STYLES = {'juniper': _junos_block,
+          'netscreen': _set_block,
+          'nortel_esr': _set_block,
+          'nortel_esu': _set_block,
+          'omniswitch': _set_block,
+          'arbor': _set_block,
+          'timetra': _timos_block,
+          }
+
+
+def corpus(ruleset_name, lines, seed=DEFAULT_SEED):
+    """Returns synthetic output of a device of the ruleset.
+
+    The output is made of configuration blocks in the style of the vendor,
+    with blank lines and the lines the ruleset's parsers drop mixed in.
+
+    Args:
+      ruleset_name: A string, the ruleset name.
+      lines: An int, the number of lines.
+      seed: An int, the random seed; the same seed gives the same output.
+
+    Returns:
+      A string.
+    """
+    rnd = random.Random(seed)
+    block = STYLES.get(ruleset_name, _ios_block)
+    noise = NOISE.get(ruleset_name, ())
+    result = list(noise)
+    i = 0
+    while len(result) < lines:
+        result.extend(block(rnd, i))
+        i += 1
+        if rnd.random() < 0.05:
+            result.append('')
+        if noise and rnd.random() < 0.01:
+            result.append(rnd.choice(noise))
+    del result[lines:]
+    return '\n'.join(result) + '\n'
+
+
+def parsers(ruleset_class):
+    """Returns the distinct parser classes of a ruleset, in order."""
+    ruleset = ruleset_class()
+    actions = []
+    for rule in ruleset.rules():
+        actions.extend(rule.actions)
+    fingerprint = ruleset.fingerprint()
+    if fingerprint is not None:
+        actions.append(fingerprint)
+    result = []
+    for action in actions:
+        if action.parser is not None and action.parser not in result:
+            result.append(action.parser)
+    return result
+
+
+def _max_rss_kb():
+    # ru_maxrss is in kilobytes on Linux, but bytes on Mac OS X.
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        max_rss /= 1024
+    return max_rss
+
+
+def _time_parser(parser, data, repeat):
+    """Returns (best time in seconds, peak memory increase in KB)."""
+    best = None
+    start_rss = _max_rss_kb()
+    for _ in xrange(repeat):
+        start = time.time()
+        try:
+            parser(data).parse()
+        except punc.parser.Error:
+            pass
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, max(_max_rss_kb() - start_rss, 0)
+
+
+def _time_parser_child(queue, parser, data, repeat):
+    queue.put(_time_parser(parser, data, repeat))
+
+
+def measure(parser, data, repeat=DEFAULT_REPEAT, isolate=True):
+    """Times a parser on some data.
+
+    Args:
+      parser: A punc.parser.Parser subclass.
+      data: A string, the input.
+      repeat: An int, the number of times to parse the data.
+      isolate: A boolean. If True, parse in a new process, so its peak
+        memory use is that of the parser alone.
+
+    Returns:
+      A tuple (best time in seconds, peak memory increase in KB).
+    """
+    if not isolate:
+        return _time_parser(parser, data, repeat)
+    queue = multiprocessing.Queue()
+    child = multiprocessing.Process(target=_time_parser_child,
+                                    args=(queue, parser, data, repeat))
+    child.start()
+    try:
+        return queue.get()
+    finally:
+        child.join()
+
+
+def run(ruleset_names=None, sizes=DEFAULT_SIZES, repeat=DEFAULT_REPEAT,
+        isolate=True):
+    """Benchmarks the parsers of the rulesets.
+
+    Args:
+      ruleset_names: A list of ruleset names, or None for all rulesets.
+      sizes: A list of ints, the input sizes in lines.
+      repeat: An int, the number of times each input is parsed.
+      isolate: A boolean, see measure().
+
+    Returns:
+      A list of result dicts.
+    """
+    results = []
+    for ruleset_class in punc.ruleset_factory.RULESETS:
+        if ruleset_names and ruleset_class.name not in ruleset_names:
+            continue
+        for size in sizes:
+            data = corpus(ruleset_class.name, size)
+            for parser in parsers(ruleset_class):
+                seconds, memory_kb = measure(parser, data, repeat=repeat,
+                                             isolate=isolate)
+                result = {'ruleset': ruleset_class.name,
+                          'parser': '%s.%s' % (parser.__module__,
+                                               parser.__name__),
+                          'lines': size,
+                          'bytes': len(data),
+                          'seconds': seconds,
+                          'lines_per_second': size / max(seconds, 1e-9),
+                          'peak_memory_kb': memory_kb}
+                logging.info('%(parser)s %(lines)d lines: '
+                             '%(lines_per_second).0f lines/s, '
+                             '%(peak_memory_kb)d KB', result)
+                results.append(result)
+    return results
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Returns the results slower than the baseline by more than tolerance.
+
+    Args:
+      results: A list of result dicts, as from run().
+      baseline: A list of result dicts from an earlier run.
+      tolerance: A float, the fraction of throughput which may be lost.
+
+    Returns:
+      A list of tuples (result, baseline result).
+    """
+    previous = {}
+    for result in baseline:
+        previous[(result['parser'], result['lines'])] = result
+    regressions = []
+    for result in results:
+        before = previous.get((result['parser'], result['lines']))
+        if before is None:
+            continue
+        if (result['lines_per_second'] <
+            before['lines_per_second'] * (1 - tolerance)):
+            regressions.append((result, before))
+    return regressions
+
+
+def get_options(argv=None):
+    p = optparse.OptionParser()
+    p.add_option('--ruleset', dest='rulesets', action='append', default=[],
+                 help='Benchmark only this ruleset (may be repeated)')
+    p.add_option('--sizes', dest='sizes',
+                 default=','.join([str(s) for s in DEFAULT_SIZES]),
+                 help='Comma separated input sizes, in lines')
+    p.add_option('--repeat', dest='repeat', type='int',
+                 default=DEFAULT_REPEAT,
+                 help='Parse each input this many times, keeping the best')
+    p.add_option('--output', dest='output', default=None,
+                 help='Write the results to this JSON file')
+    p.add_option('--compare', dest='compare', default=None,
+                 help='Compare to the results in this JSON file')
+    p.add_option('--tolerance', dest='tolerance', type='float',
+                 default=DEFAULT_TOLERANCE,
+                 help='Fraction of throughput which may be lost')
+    p.add_option('--no-isolate', action='store_false', dest='isolate',
+                 default=True,
+                 help='Parse in this process (no peak memory figures)')
+    return p.parse_args(argv)
+
+
+def main(argv=None):
+    options, _ = get_options(argv)
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    try:
+        sizes = [int(s) for s in options.sizes.split(',') if s]
+    except ValueError:
+        logging.error('Invalid --sizes %r', options.sizes)
+        return 2
+    unknown = [r for r in options.rulesets
+               if r not in punc.ruleset_factory.rulesets]
+    if unknown:
+        logging.error('Unknown rulesets: %s', ', '.join(unknown))
+        return 2
+
+    results = run(options.rulesets, sizes, repeat=options.repeat,
+                  isolate=options.isolate)
+    if options.output:
+        f = open(options.output, 'w')
+        try:
+            json.dump({'python': platform.python_version(),
+                       'platform': platform.platform(),
+                       'time': time.time(),
+                       'results': results}, f, indent=1, sort_keys=True)
+        finally:
+            f.close()
+    if options.compare:
+        f = open(options.compare)
+        try:
+            baseline = json.load(f)['results']
+        finally:
+            f.close()
+        regressions = compare(results, baseline, options.tolerance)
+        for result, before in regressions:
+            logging.error('REGRESSION %s %d lines: %.0f lines/s (was %.0f)',
+                          result['parser'], result['lines'],
+                          result['lines_per_second'],
+                          before['lines_per_second'])
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,234 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# Copyright 2010 Andrew Fort
+
+"""PUNC's content-addressed store of output snapshots."""
+
+
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import punc.output
+
+
+class BlobStore(object):
+    """Target contents stored once each, under their digest.
+
+    Each target file written is copied to objects/<digest>, unless content
+    with the same digest is already stored (e.g., identical configurations
+    of several devices, or a device unchanged since an earlier run). Each
+    run saves a manifest, mapping the path of each target (relative to
+    base_path) to its digest: the targets it wrote, and those of the
+    previous manifest still in the tree but not written (e.g., devices
+    whose collection failed). A run's snapshot of the whole tree may be
+    materialised as a tree of hard links to the blobs, which are read-only.
+
+    Targets may be added from several threads at once.
+
+    Attributes:
+      directory: A string, the store directory.
+      base_path: A string, the directory manifest paths are relative to.
+      manifest: A dict, the targets written in this run.
+      added: An int, the number of blobs added in this run.
+    """
+
+    OBJECTS = 'objects'
+    MANIFESTS = 'manifests'
+
+    def __init__(self, directory, base_path):
+        self.directory = directory
+        self.base_path = base_path
+        self.manifest = {}
+        self.added = 0
+        # The latest saved manifest, once loaded by previous_digest.
+        self._previous = None
+        # Guards manifest, added and _previous.
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return ('%s(%r, %r)' % (self.__class__.__name__, self.directory,
+                                self.base_path))
+
+    def object_path(self, digest):
+        """Returns the path of the blob with a digest."""
+        return os.path.join(self.directory, self.OBJECTS, digest[:2],
+                            digest[2:])
+
+    def _manifest_path(self, name):
+        return os.path.join(self.directory, self.MANIFESTS, name + '.json')
+
+    def add(self, path, digest):
+        """Adds a written target file to the store and this run's manifest.
+
+        Args:
+          path: A string, the target file's path.
+          digest: A string, the sha1 hex digest of the file's content.
+        """
+        object_path = self.object_path(digest)
+        added = 0
+        if not os.path.exists(object_path):
+            tmp_path = None
+            try:
+                dirname = os.path.dirname(object_path)
+                punc.output.make_dirs(dirname)
+                # Each add copies to a file of its own; should the same
+                # content be added concurrently, the last rename wins.
+                fd, tmp_path = tempfile.mkstemp(
+                    dir=dirname, prefix='.%s.' % digest[2:], suffix='.tmp')
+                os.close(fd)
+                shutil.copyfile(path, tmp_path)
+                os.chmod(tmp_path, 0444)
+                os.rename(tmp_path, object_path)
+            except (OSError, IOError), e:
+                logging.error('Could not store %r. %s: %s',
+                              path, e.__class__.__name__, str(e))
+                if tmp_path is not None and os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                return
+            added = 1
+        self._lock.acquire()
+        try:
+            self.added += added
+            self.manifest[os.path.relpath(path, self.base_path)] = digest
+        finally:
+            self._lock.release()
+
+    def previous_digest(self, path):
+        """Returns a target's digest in the latest saved manifest, or None.
+
+        Args:
+          path: A string, the target file's path.
+        """
+        self._lock.acquire()
+        try:
+            if self._previous is None:
+                self._previous = {}
+                previous = self.manifests()
+                if previous:
+                    try:
+                        self._previous = self.load_manifest(previous[-1])
+                    except (OSError, IOError, ValueError), e:
+                        logging.warning('Could not read manifest %r. %s: %s',
+                                        previous[-1], e.__class__.__name__,
+                                        str(e))
+            return self._previous.get(os.path.relpath(path, self.base_path))
+        finally:
+            self._lock.release()
+
+    def _new_manifest_name(self):
+        """Returns an unused manifest name, from the UTC time."""
+        now = time.time()
+        name = '%s.%06d' % (time.strftime('%Y%m%d-%H%M%S', time.gmtime(now)),
+                            int((now % 1) * 1000000))
+        unique = name
+        i = 0
+        while os.path.exists(self._manifest_path(unique)):
+            i += 1
+            unique = '%s-%d' % (name, i)
+        return unique
+
+    def save_manifest(self, name=None):
+        """Atomically writes this run's manifest, if any targets were added.
+
+        Targets of the previous manifest not written in this run are
+        carried forward, if they are still in the tree.
+
+        Args:
+          name: A string, the manifest name. Defaults to the UTC time.
+
+        Returns:
+          A string, the manifest name, or None if it was not written.
+        """
+        if not self.manifest:
+            return None
+        manifest = {}
+        previous = self.manifests()
+        if previous:
+            try:
+                manifest = self.load_manifest(previous[-1])
+            except (OSError, IOError, ValueError), e:
+                logging.warning('Could not read manifest %r. %s: %s',
+                                previous[-1], e.__class__.__name__, str(e))
+            for path in manifest.keys():
+                if (path not in self.manifest and not
+                    os.path.exists(os.path.join(self.base_path, path))):
+                    del manifest[path]
+        manifest.update(self.manifest)
+        if name is None:
+            name = self._new_manifest_name()
+        path = self._manifest_path(name)
+        try:
+            dirname = os.path.dirname(path)
+            if not os.path.exists(dirname):
+                os.makedirs(dirname)
+            f = open(path + '.tmp', 'w')
+            try:
+                json.dump(manifest, f, indent=1, sort_keys=True)
+            finally:
+                f.close()
+            os.rename(path + '.tmp', path)
+        except (OSError, IOError), e:
+            logging.error('Could not write manifest %r. %s: %s',
+                          path, e.__class__.__name__, str(e))
+            return None
+        logging.debug('Saved manifest %s: %d targets (%d written), '
+                      '%d new blobs', name, len(manifest), len(self.manifest),
+                      self.added)
+        return name
+
+    def manifests(self):
+        """Returns the names of the saved manifests, oldest first."""
+        path = os.path.join(self.directory, self.MANIFESTS)
+        if not os.path.exists(path):
+            return []
+        return sorted([f[:-len('.json')] for f in os.listdir(path)
+                       if f.endswith('.json')])
+
+    def load_manifest(self, name):
+        """Returns a saved manifest, a dict of target path to digest."""
+        f = open(self._manifest_path(name))
+        try:
+            return json.load(f)
+        finally:
+            f.close()
+
+    def materialize(self, name, dest):
+        """Creates the target tree of a saved manifest.
+
+        Targets are hard links to the blobs where possible, else copies.
+
+        Args:
+          name: A string, the manifest name.
+          dest: A string, the directory to create the tree in.
+
+        Returns:
+          An int, the number of targets created.
+        """
+        manifest = self.load_manifest(name)
+        for path, digest in sorted(manifest.iteritems()):
+            target_path = os.path.join(dest, path)
+            dirname = os.path.dirname(target_path)
+            if not os.path.exists(dirname):
+                os.makedirs(dirname)
+            if os.path.exists(target_path):
+                os.remove(target_path)
+            try:
+                os.link(self.object_path(digest), target_path)
+            except (OSError, AttributeError):
+                shutil.copyfile(self.object_path(digest), target_path)
+        return len(manifest)
@@ -15,17 +15,118 @@
 """PUNC's command/data collector."""
 
 import collections
+import copy
 import logging
+import multiprocessing.pool
 import operator
 import os
 import time
 import threading
 
+import eventlet
+import eventlet.tpool
 import notch.client
 
+import punc.deadline
+import punc.history
+import punc.journal
 import punc.model
+import punc.output
+import punc.parse_pool
 import punc.parser
+import punc.result_cache
+import punc.retry
 import punc.ruleset_factory
+import punc.schedule
+
+
+class DeviceRequests(object):
+    """The request chains for a device.
+
+    Each chain is a sequence of requests which must be sent one after the
+    other; separate chains may have requests in flight concurrently, up to
+    max_in_flight requests for the device.
+
+    An optional probe request is sent alone, before any of the chains. It
+    is not counted or iterated over with the chains.
+    """
+
+    def __init__(self, chains, max_in_flight=1, probe=None):
+        """Initialiser.
+
+        Args:
+          chains: A list of lists of notch.client.Request objects, as from
+            model.Ruleset.request_chains().
+          max_in_flight: An int, the maximum requests in flight at once.
+          probe: A notch.client.Request object or None, the fingerprint
+            request (see model.Ruleset.fingerprint).
+        """
+        self.chains = [collections.deque(chain) for chain in chains if chain]
+        self.max_in_flight = max(max_in_flight or 1, 1)
+        self.probe = probe
+        # Request -> index of the chain it was sent from.
+        self._in_flight = {}
+
+    def __len__(self):
+        return sum([len(chain) for chain in self.chains])
+
+    def __iter__(self):
+        for chain in self.chains:
+            for request in chain:
+                yield request
+
+    def ready(self):
+        """Returns True if another request may be sent now."""
+        if self.probe is not None:
+            return self.probe not in self._in_flight
+        return self._next_chain() is not None
+
+    def _next_chain(self):
+        if self.probe is not None:
+            return None
+        if len(self._in_flight) >= self.max_in_flight:
+            return None
+        busy = self._in_flight.values()
+        for i, chain in enumerate(self.chains):
+            if chain and i not in busy:
+                return i
+        return None
+
+    def next_request(self):
+        """Returns the next request to send, or None if none is ready."""
+        if self.probe is not None:
+            if self.probe in self._in_flight:
+                return None
+            self._in_flight[self.probe] = None
+            return self.probe
+        i = self._next_chain()
+        if i is None:
+            return None
+        request = self.chains[i].popleft()
+        self._in_flight[request] = i
+        return request
+
+    def done(self, request):
+        """Notes that a request sent from one of the chains is complete."""
+        self._in_flight.pop(request, None)
+        if request is self.probe:
+            self.probe = None
+
+    def replace(self, request, retry):
+        """Keeps a request's chain busy while a retry of it is pending."""
+        self._in_flight[retry] = self._in_flight.pop(request)
+
+    def clear(self):
+        """Removes and returns all requests not yet sent.
+
+        An unsent probe is dropped, but not returned.
+        """
+        requests = list(self)
+        for chain in self.chains:
+            chain.clear()
+        if self.probe is not None and self.probe not in self._in_flight:
+            self.probe = None
+        return requests
 
 
 class Collection(object):
@@ -35,7 +136,10 @@ class Collection(object):
     DEVICE_IDLE_TIMEOUT_SAFETY_FACTOR = 0.8
 
     def __init__(self, recipe, base_path, notch_client,
-                 command_timeout, collection_timeout):
+                 command_timeout, collection_timeout, scheduler=None,
+                 deadlines=None, history=None, retry=None,
+                 fingerprints=None, parse_pool=None, journal=None,
+                 result_cache=None):
         """Initialiser.
 
         Args:
@@ -44,18 +148,75 @@ class Collection(object):
           notch_client: A notch.client.Connection object, the Notch connection.
           command_timeout: A float, the per-command timeout in seconds.
           collection_timeout: A float, the collection timeout in seconds.
+          scheduler: A schedule.Scheduler object shared by all collections
+            in the run. If None, the collection uses its own unbounded
+            scheduler.
+          deadlines: A deadline.DeadlineEngine object enforcing the command
+            and collection timeouts. If None, the collection uses its own
+            engine, which only enforces timeouts if check() is called.
+          history: A history.DurationHistory object. Devices which were
+            slowest in previous runs are started first, and durations from
+            this run are recorded to it.
+          retry: A retry.RetryPolicy object shared by all collections in the
+            run. If None, failed requests are not retried.
+          fingerprints: A fingerprint.FingerprintStore object. If not None,
+            devices whose ruleset has a fingerprint are probed first, and
+            skipped if unchanged since their last successful collection.
+          parse_pool: A parse_pool.ParsePool object shared by all
+            collections in the run. If None, results are parsed inline.
+          journal: A journal.Journal object. If not None, completed targets
+            are recorded to it, and devices whose targets were all completed
+            by a previous (interrupted) run are not collected again.
+          result_cache: A result_cache.ResultCache object. If not None,
+            results identical to those of the last run are not parsed
+            again; the cached parsed output is used instead.
         """
         self.recipe = recipe
         self.base_path = base_path
         self.command_timeout = command_timeout
         self.collection_timeout = collection_timeout
         self.results = {}
+        # Callables called with (collection, target) once all of a
+        # device's results for the target are final.
+        self.target_listeners = []
         self.num_resp_target = 0
         self.num_resp_received = 0
+        # Devices skipped as unchanged since the last collection.
+        self.skipped = set()
+        # Devices restored from the journal of an interrupted run.
+        self.resumed = set()
+        self._journal = journal
         self._nc = notch_client
+        self._scheduler = scheduler
+        if deadlines is None:
+            deadlines = punc.deadline.DeadlineEngine()
+        self._deadlines = deadlines
+        if history is None:
+            history = punc.history.DurationHistory()
+        self._history = history
+        if retry is None:
+            retry = punc.retry.RetryPolicy()
+        self._retry = retry
+        # Retried request -> attempt number (first attempts are absent).
+        self._attempts = {}
+        # Device -> list of (time due, request) waiting to be retried.
+        self._retries = {}
+        self._fingerprints = fingerprints
+        if parse_pool is None:
+            parse_pool = punc.parse_pool.ParsePool()
+        self._parse_pool = parse_pool
+        self._result_cache = result_cache
+        # Outstanding fingerprint probe request -> device
+        self._probes = {}
+        # Device -> fingerprint, for devices collected in full.
+        self._probed = {}
+        # Request -> time sent
+        self._sent_at = {}
         self._target_cache = punc.model.TargetCache()
-        # Per device request deque
+        # Per device DeviceRequests
         self._device_requests = {}
+        # (device, target key) -> number of results not yet final
+        self._target_pending = {}
 
     def __repr__(self):
         return ('%s(recipe=%s, base_path=%s, command_timeout=%d, '
@@ -68,8 +229,15 @@ class Collection(object):
     def name(self):
         return self.recipe.name
 
-    def start(self):
-        """Starts the collection."""
+    def _prepare(self, max_in_flight=1):
+        """Builds the per-device requests of the collection.
+
+        Args:
+          max_in_flight: An int, the in-flight request limit per device.
+
+        Returns:
+          A boolean, False if the recipe's ruleset does not exist.
+        """
         try:
             ruleset = punc.ruleset_factory.get_ruleset(self.recipe.ruleset)
             self._ruleset = ruleset
@@ -77,29 +245,261 @@ class Collection(object):
         except KeyError, exc:
             logging.error('[%s] Problem: No ruleset with name %s for %s',
                           self.recipe.name, exc, self.recipe)
-            return
+            return False
+
+        if self._journal is not None:
+            for device in self.recipe.devices:
+                self._resume_device(device)
+            if self.resumed:
+                logging.info('[%s] %d devices completed by the previous run',
+                             self.recipe.name, len(self.resumed))
+                self.recipe.devices = set(self.recipe.devices) - self.resumed
 
         self._start = time.time()
         logging.info('[%s] collection started for %d devices',
                      self.recipe.name, len(self.recipe.devices))
 
-        # Generate the per-device request deques
+        # Generate the per-device request chains
         for device in self.recipe.devices:
-            self._device_requests[device] = collections.deque(
-                ruleset.requests(device))
+            probe = None
+            if self._fingerprints is not None:
+                probe = ruleset.fingerprint_request(device)
+                if probe is not None:
+                    self._probes[probe] = device
+            self._device_requests[device] = DeviceRequests(
+                ruleset.request_chains(device),
+                max_in_flight=max_in_flight, probe=probe)
             self.num_resp_target += len(self._device_requests[device])
+            for request in self._device_requests[device]:
+                key = (device, self._target_key(request.callback_args[2]))
+                self._target_pending[key] = (
+                    self._target_pending.get(key, 0) + 1)
+        return True
+
+    def start(self):
+        """Starts the collection."""
+        if self._scheduler is None:
+            self._scheduler = punc.schedule.Scheduler()
+            owns_scheduler = True
+        else:
+            owns_scheduler = False
+
+        if not self._prepare(self._scheduler.max_requests_per_device):
+            return
+        self._deadlines.start_collection(self, self.collection_timeout)
 
-        # Send the first request to kick things off, the callback
-        # continues the chain for the device.
+        # Queue the devices with the scheduler, which sends the first
+        # request as a slot is free. The callback continues the chain
+        # for the device.
+        priorities = self._device_priorities()
         for device in self.recipe.devices:
-            self._send_next_request(device)
+            self._scheduler.add_device(self, device,
+                                       priority=priorities[device])
+        if owns_scheduler:
+            self._scheduler.dispatch()
+
+    def _target_instance(self, device_name, target):
+        """Returns the model.Target instance of a device's target."""
+        target = target or self._ruleset.target
+        target_inst = self._target_cache.get(
+            self, device_name, target.file_prefix,
+            target.file_suffix, target.file_mode)
+        target_inst.base_path = self.base_path
+        target_inst.header = self._ruleset.header
+        return target_inst
+
+    def _resume_device(self, device_name):
+        """Restores a device's results from the journal, if complete.
+
+        Returns:
+          A boolean, True if every target of the device was journaled.
+        """
+        restored = {}
+        for request in self._ruleset.requests(device_name):
+            target_inst = self._target_instance(device_name,
+                                                request.callback_args[2])
+            if target_inst in restored:
+                continue
+            results = self._journal.results(target_inst.name)
+            if results is None:
+                return False
+            restored[target_inst] = []
+            for result in results:
+                restored[target_inst].append(punc.model.Result(
+                    request.callback_args[0], request, result['key'],
+                    output=result['output'], status=result['status'],
+                    error=result['error']))
+        self.results.update(restored)
+        self.resumed.add(device_name)
+        return True
+
+    def _journal_target(self, device_name, target_inst):
+        """Records a device's completed target, if it succeeded."""
+        results = self.results.get(target_inst, [])
+        for result in results:
+            if result.failed():
+                return
+        self._journal.record(self.name, device_name, target_inst.name,
+                             results)
+
+    def _target_key(self, target):
+        """Returns the TargetCache key attributes of a rule's target."""
+        target = target or self._ruleset.target
+        return (target.file_prefix, target.file_suffix, target.file_mode)
+
+    def _action_name(self, request):
+        """Returns the duration history key of a request's action."""
+        return self._history.action_name(self._ruleset.name,
+                                         request.callback_args[1])
+
+    def _device_priorities(self):
+        """Returns scheduler priorities starting the slowest devices first.
+
+        Devices without history are given the mean expected duration of the
+        devices with history, so they are neither started first nor last.
+        """
+        expected = {}
+        for device, requests in self._device_requests.iteritems():
+            expected[device] = self._history.expected(
+                device, [self._action_name(r) for r in requests])
+        known = [e for e in expected.itervalues() if e is not None]
+        if known:
+            default = sum(known) / len(known)
+        else:
+            default = 0.0
+        priorities = {}
+        for device, duration in expected.iteritems():
+            if duration is None:
+                duration = default
+            priorities[device] = -duration
+        return priorities
+
+    def _record_duration(self, request):
+        """Records the duration of a completed or abandoned request."""
+        sent_at = self._sent_at.pop(request, None)
+        if sent_at is not None:
+            self._history.record(request.arguments.get('device_name'),
+                                 self._action_name(request),
+                                 max(time.time() - sent_at, 0))
+
+    def send_next_request(self, device):
+        """Sends the next request for a device, if any.
+
+        Returns:
+          A boolean, True if a request was sent.
+        """
+        requests = self._device_requests[device]
+        request = self._next_retry(device)
+        if request is None:
+            request = requests.next_request()
+            if request is None:
+                return False
+            self._retry.budget.request_sent()
+        self._deadlines.start_request(self, request, self.command_timeout)
+        self._sent_at[request] = time.time()
+        self._nc.exec_request(request, callback=self._notch_callback)
+        logging.debug('REQUEST_SENT %r', request)
+        if requests.ready():
+            # Independent rules may run concurrently on the device.
+            self._scheduler.device_ready(self, device)
+        return True
+
+    def _next_retry(self, device):
+        """Returns a request for the device due to be retried, or None."""
+        waiting = self._retries.get(device)
+        if not waiting:
+            return None
+        now = time.time()
+        for i, (due, request) in enumerate(waiting):
+            if due <= now:
+                del waiting[i]
+                return request
+        return None
 
-    def _send_next_request(self, device):
-        """Sends the next request for a device, if any."""
-        if self._device_requests[device]:
-            request = self._device_requests[device].popleft()
-            self._nc.exec_request(request, callback=self._notch_callback)
-            logging.debug('REQUEST_SENT %r', request)
+    def _parse_fingerprint(self, r):
+        """Returns the fingerprint from a probe response, or None."""
+        if r.error is not None or r.result is None:
+            return None
+        action = r.callback_args[1]
+        try:
+            if action.parser is not None:
+                output = action.parser(r.result).parse()
+            else:
+                output = r.result
+        except punc.parser.Error, e:
+            logging.debug('FINGERPRINT_ERROR %s %s',
+                          r.arguments.get('device_name'), e)
+            return None
+        return output.strip() or None
+
+    def _targets_exist(self, device_name, requests):
+        """Returns True if the device's targets exist from a previous run."""
+        for request in requests:
+            target_inst = self._target_instance(device_name,
+                                                request.callback_args[2])
+            if not os.path.exists(target_inst.name):
+                return False
+        return True
+
+    def _probe_complete(self, r):
+        """Handles a fingerprint probe response.
+
+        If the device is unchanged since its last successful collection,
+        its other requests are dropped, leaving its targets untouched.
+        """
+        device_name = self._probes.pop(r)
+        fingerprint = self._parse_fingerprint(r)
+        requests = self._device_requests[device_name]
+        if (self._fingerprints.matches(device_name, self._ruleset.name,
+                                       fingerprint) and
+            self._targets_exist(device_name, requests)):
+            logging.debug('UNCHANGED %s %r', device_name, fingerprint)
+            self.skipped.add(device_name)
+            for request in requests.clear():
+                self.num_resp_received += 1
+                self._target_pending.pop(
+                    (device_name, self._target_key(request.callback_args[2])),
+                    None)
+            self._check_finished()
+        elif fingerprint is not None:
+            self._probed[device_name] = fingerprint
+
+    def update_fingerprints(self):
+        """Stores the fingerprints of devices collected without errors."""
+        if self._fingerprints is None:
+            return
+        failed = set(self.devices_with_errors())
+        for device_name, fingerprint in self._probed.iteritems():
+            if device_name not in failed:
+                self._fingerprints.set(device_name, self._ruleset.name,
+                                       fingerprint)
+
+    def _retry_request(self, r):
+        """Schedules a failed request to be sent again, if allowed.
+
+        Returns:
+          A boolean, True if the request will be retried.
+        """
+        attempt = self._attempts.pop(r, 1)
+        if not self._retry.should_retry(r.error, attempt):
+            return False
+        device_name = r.arguments.get('device_name')
+        delay = self._retry.delay(attempt)
+        logging.info('[%s] Retrying request to %s in %.1fs after attempt %d '
+                     'failed: %s', self.recipe.name, device_name, delay,
+                     attempt, r.error)
+        retry = copy.copy(r)
+        retry.result = None
+        retry.error = None
+        self._attempts[retry] = attempt + 1
+        self._sent_at.pop(r, None)
+        self._device_requests[device_name].replace(r, retry)
+        self._retries.setdefault(device_name, []).append(
+            (time.time() + delay, retry))
+        # Free our slot for the backoff period.
+        self._scheduler.device_ready(self, device_name, delay=delay)
+        self._scheduler.request_done(self)
+        return True
 
     def _get_error_status(self, rule):
         """Returns the rule status for of an errored result."""
@@ -116,69 +516,247 @@ class Collection(object):
                 status = punc.model.Result.STATUS_ERROR
         return status
 
-    def _get_error_status_and_result(self, r, action):
-        """Produces status and result from parser."""
-        device_name = r.arguments.get('device_name')
-        status = punc.model.Result.STATUS_PENDING
+    def _get_timeout_status(self, rule):
+        """Returns the rule status for a timed out request."""
+        status = self._get_error_status(rule)
+        if status == punc.model.Result.STATUS_ERROR:
+            status = punc.model.Result.STATUS_TIMEOUT
+        return status
+
+    def _cached_result(self, r, action):
+        """Looks up a successful result in the result cache.
+
+        Returns:
+          A tuple (digest, cached): the digest of the raw result (None if
+          it is not cached), and the cached (status, output) or None.
+        """
+        if (self._result_cache is None or action.parser is None or
+            not isinstance(r.result, str)):
+            return None, None
+        digest = punc.result_cache.digest(r.result)
+        return digest, self._result_cache.get(
+            r.arguments.get('device_name'), self._action_name(r),
+            action.parser.version(), digest)
+
+    def _cache_result(self, r, action, digest, status, output):
+        """Caches the parsed output of a result looked up by _cached_result."""
+        if digest is None or status not in (punc.model.Result.STATUS_OK,
+                                            punc.model.Result.STATUS_IGNORE):
+            return
+        self._result_cache.put(r.arguments.get('device_name'),
+                               self._action_name(r), action.parser.version(),
+                               digest, status, output)
+
+    def _parse_result(self, r, rule, action, target):
+        """Parses a successful result, then records it.
+
+        Large results are parsed off the eventlet hub, so the result is
+        recorded (and the device's next request sent) asynchronously.
+        Results unchanged since the last run are taken from the result
+        cache instead; the cache's files are read and written in a thread,
+        also off the hub.
+        """
+        if self._result_cache is None:
+            self._parse_uncached(r, rule, action, target, None)
+        else:
+            eventlet.spawn_n(self._parse_cached, r, rule, action, target)
+
+    def _parse_cached(self, r, rule, action, target):
+        """Looks up a result in the result cache, else parses it."""
         try:
-            if action.parser is not None:
-                output = action.parser(r.result).parse()
-            else:
-                output = r.result[:]
-            logging.debug('ACTION %s %s', device_name, action)
-            status = punc.model.Result.STATUS_OK
-        except punc.parser.SkipResult, e:
-            status = punc.model.Result.STATUS_IGNORE
-            output = None
-        except punc.parser.DeviceReportedError, e:
-            status = punc.model.Result.STATUS_ERROR
-            output = None
-        return status, output
+            digest, cached = eventlet.tpool.execute(self._cached_result, r,
+                                                    action)
+        except Exception:
+            logging.exception('Could not look up %r in the result cache', r)
+            digest, cached = None, None
+        if cached is None:
+            self._parse_uncached(r, rule, action, target, digest)
+            return
+        try:
+            self._add_result(r, rule, action, target, cached[0],
+                             output=cached[1], cached=True)
+        finally:
+            self._request_complete(r)
+
+    def _parse_uncached(self, r, rule, action, target, digest):
+        """Parses a result, caching the parse if digest is not None."""
+
+        def parsed(status, output):
+            try:
+                if status == punc.model.Result.STATUS_OK:
+                    logging.debug('ACTION %s %s',
+                                  r.arguments.get('device_name'), action)
+                try:
+                    if digest is not None:
+                        eventlet.tpool.execute(self._cache_result, r, action,
+                                               digest, status, output)
+                finally:
+                    self._add_result(r, rule, action, target, status,
+                                     output=output)
+            finally:
+                self._request_complete(r)
+
+        self._parse_pool.submit(action.parser, r.result, parsed)
 
     def _notch_callback(self, r, *args, **unused_kwargs):
         """Notch request callback."""
-        self.num_resp_received += 1
         logging.debug('REQUEST_CALLBACK %r', r)
+        if not self._deadlines.end_request(r):
+            # We gave up on this request when it timed out.
+            logging.debug('REQUEST_ABANDONED %r', r)
+            return
+        if r in self._probes:
+            self._record_duration(r)
+            self._probe_complete(r)
+            self._request_complete(r)
+            return
+        if r.error is not None and self._retry_request(r):
+            return
+        self._record_duration(r)
         rule, action, target = args
+        if r.error is None:
+            self._parse_result(r, rule, action, target)
+            return
+        status = punc.model.Result.STATUS_PENDING
+        try:
+            status = self._get_error_status(rule)
+        finally:
+            self._add_result(r, rule, action, target, status)
+            self._request_complete(r)
+
+    def _add_result(self, r, rule, action, target, status, output=None,
+                    error=None, cached=False):
+        """Records the final result of a request.
+
+        Args:
+          cached: A boolean, True if the output was taken from the result
+            cache.
+        """
+        self.num_resp_received += 1
         target = target or self._ruleset.target
         device_name = r.arguments.get('device_name')
+        target_inst = self._target_instance(device_name, target)
 
-        target_inst = self._target_cache.get(
-            self, device_name, target.file_prefix,
-            target.file_suffix, target.file_mode)
-        target_inst.base_path = self.base_path
-        target_inst.header = self._ruleset.header
+        rule.finish(status)
+        result = punc.model.Result(rule, r, action.key,
+                                   output=output, status=status, error=error,
+                                   cached=cached)
+        logging.debug('RESULT %s %s', device_name, result)
 
-        status = punc.model.Result.STATUS_PENDING
-        output = None
-        try:
-            if r.error is not None:
-                status = self._get_error_status(rule)
-            else:
-                status, output = self._get_error_status_and_result(r, action)
-        finally:
-            rule.finish(status)
-            result = punc.model.Result(rule, r, action.key,
-                                       output=output, status=status)
-            logging.debug('RESULT %s %s', r.arguments.get('device_name'),
-                          result)
-
-            # Write the result to memory if we care about it.
-            if status != punc.model.Result.STATUS_IGNORE:
-                if target_inst in self.results:
-                    self.results[target_inst].append(result)
-                else:
-                    self.results[target_inst] = [result]
-
-            # Are we there, yet?
-            if self.finished():
-                elapsed = max(time.time() - self._start, 0)
-                logging.info('[%s] Completed collection in %.1fs',
-                             self.recipe.name, elapsed)
+        # Write the result to memory if we care about it.
+        if status != punc.model.Result.STATUS_IGNORE:
+            if target_inst in self.results:
+                self.results[target_inst].append(result)
             else:
-                # Send the next request.
-                self._send_next_request(device_name)
-                
+                self.results[target_inst] = [result]
+
+        # Is the target complete for this device?
+        key = (device_name, self._target_key(target))
+        self._target_pending[key] -= 1
+        if not self._target_pending[key]:
+            del self._target_pending[key]
+            if self._result_cache is not None:
+                self._forget_unwritten(device_name, target_inst)
+            if self._journal is not None:
+                self._journal_target(device_name, target_inst)
+            for listener in self.target_listeners:
+                listener(self, target_inst)
+
+        self._check_finished()
+
+    def _forget_unwritten(self, device_name, target_inst):
+        """Forgets the cached results of a target which will not be written.
+
+        A target is not written unless all of its results succeeded. Its
+        results are parsed again in the next run, so the Collator does not
+        take the target's existing file to be the cached results' output.
+        """
+        results = self.results.get(target_inst, [])
+        for result in results:
+            if result.failed():
+                break
+        else:
+            return
+        for result in results:
+            self._result_cache.discard(device_name,
+                                       self._action_name(result.result))
+
+    def _check_finished(self):
+        """Logs the completion of the collection, if it has finished."""
+        # Are we there, yet?
+        if self.finished():
+            self._deadlines.end_collection(self)
+            elapsed = max(time.time() - self._start, 0)
+            logging.info('[%s] Completed collection in %.1fs',
+                         self.recipe.name, elapsed)
+
+    def _request_complete(self, request):
+        """Frees the request's slot and sends whatever is next."""
+        device_name = request.arguments.get('device_name')
+        requests = self._device_requests[device_name]
+        requests.done(request)
+        self._attempts.pop(request, None)
+        if requests.ready():
+            # The device's next request goes ahead of unstarted devices.
+            self._scheduler.device_ready(self, device_name)
+        self._scheduler.request_done(self)
+
+    def request_timed_out(self, request):
+        """Abandons an outstanding request which overran command_timeout."""
+        device_name = request.arguments.get('device_name')
+        logging.warning('[%s] Request to %s timed out after %.1fs',
+                        self.recipe.name, device_name, self.command_timeout)
+        self._record_duration(request)
+        if request in self._probes:
+            # Collect the device in full.
+            self._probe_complete(request)
+        else:
+            rule, action, target = request.callback_args
+            self._add_result(request, rule, action, target,
+                             self._get_timeout_status(rule),
+                             error='Timeout: no response within %.1fs' %
+                             self.command_timeout)
+        self._request_complete(request)
+
+    def timed_out(self):
+        """Abandons all requests of a collection overrunning its timeout.
+
+        Requests not yet sent and those still outstanding are recorded as
+        timed out, and the scheduler drops the collection's devices waiting
+        to send (e.g., retries waiting for their backoff), so the rest of
+        the run can complete.
+        """
+        error = ('Timeout: collection did not complete within %.1fs' %
+                 self.collection_timeout)
+        if self._scheduler is not None:
+            self._scheduler.drop_collection(self)
+        for requests in self._device_requests.itervalues():
+            for request in requests.clear():
+                rule, action, target = request.callback_args
+                self._add_result(request, rule, action, target,
+                                 self._get_timeout_status(rule), error=error)
+        for device_name, waiting in self._retries.iteritems():
+            while waiting:
+                _, request = waiting.pop(0)
+                self._device_requests[device_name].done(request)
+                rule, action, target = request.callback_args
+                self._add_result(request, rule, action, target,
+                                 self._get_timeout_status(rule), error=error)
+        for request in self._deadlines.outstanding(self):
+            self._deadlines.end_request(request)
+            self._record_duration(request)
+            self._device_requests[request.arguments.get('device_name')].done(
+                request)
+            if self._probes.pop(request, None) is None:
+                rule, action, target = request.callback_args
+                self._add_result(request, rule, action, target,
+                                 self._get_timeout_status(rule), error=error)
+            self._scheduler.request_done(self)
+
+    def release(self, target):
+        """Releases the results of a target once they have been written."""
+        self.results.pop(target, None)
+
     def finished(self):
         """Returns True if this Collection is finished."""
         return bool(self.num_resp_received == self.num_resp_target)
@@ -188,7 +766,7 @@ class Collection(object):
         devices = set()
         for results in self.results.itervalues():
             for result in results:
-                if result.status == punc.model.Result.STATUS_ERROR:
+                if result.failed():
                     devices.add(result.device_name())
         return sorted(devices)
 
@@ -197,7 +775,7 @@ class Collection(object):
         errs = {}
         for results in self.results.itervalues():
             for result in results:
-                if result.status == punc.model.Result.STATUS_ERROR:
+                if result.failed():
                     err_msg = result.error_message()
                     if err_msg is not None:
                         name = result.device_name()
@@ -211,24 +789,100 @@ class Collection(object):
 class Collator(object):
     """Collects and orders Collection data, then writes it.
 
-    collate and get_file_object are not thread safe.
+    In streaming mode, each device's target is written as soon as all of
+    its results are final, and the results are then released from the
+    collection, so memory use follows concurrency rather than fleet size.
+    Where several collections write to the same file, their sections then
+    appear in order of completion rather than collection order.
+
+    Target files are replaced atomically when closed, and left untouched
+    if their content has not changed (see punc.output.OutputFile). A file
+    collate() writes whose results were all taken from the result cache is
+    not even read: it is left as it is if it exists with the size of the
+    output, unless it is archived or the blob store has no digest for it
+    (the result cache forgets the results of targets not written). With a
+    blob store, each file written is also added to it, and collate() saves
+    the run's manifest. With an archive, each file's content is recorded
+    as it is written, without reading the file back, in a thread of its
+    own (so streamed targets are not archived on the eventlet hub);
+    collate() waits for the archive to be written.
+
+    With threads, collate() writes files in a pool of that many threads,
+    for storage where each file operation has a high latency. The results
+    of each file are written by one thread, in the same order as when
+    writing serially. Streamed targets are always written serially.
+
+    collate and target_complete must not be called concurrently.
+
+    Attributes:
+      unchanged: An int, the number of files closed with unchanged content.
+      written: A list of strings, the paths of the files written (whether
+        or not their content changed).
     """
 
-    def __init__(self):
+    def __init__(self, stream=False, blob_store=None, archive=None,
+                 threads=0):
+        """Initialiser.
+
+        Args:
+          stream: A boolean. If True, write targets as they complete. Any
+            targets not yet written are written by collate().
+          blob_store: A punc.blob_store.BlobStore, or None.
+          archive: A punc.archive.Archive, or None.
+          threads: An int, the number of threads collate() writes files in.
+            With fewer than two, files are written serially.
+        """
+        self.stream = stream
+        self.blob_store = blob_store
+        self.archive = archive
+        self._archive_pool = None
+        self.threads = threads
         self._collections = []
         self._file_objects = {}
         self._started_files = set()
+        # Directories known to exist.
+        self._paths = set()
+        # Guards the above and the shared state of _close_files.
+        self._lock = threading.Lock()
+        self.unchanged = 0
+        self.written = []
 
     def add_collection(self, collection):
+        """Adds a collection; call before the collection is started."""
         self._collections.append(collection)
+        if self.stream:
+            collection.target_listeners.append(self.target_complete)
+
+    def _create_base_path(self, target):
+        """Creates a target's directory, unless already created or seen."""
+        if target.base_path in self._paths:
+            return
+        punc.output.make_dirs(target.base_path, mode=0755)
+        self._lock.acquire()
+        try:
+            self._paths.add(target.base_path)
+        finally:
+            self._lock.release()
 
     def get_file_object(self, target):
         filename = target.name
-        file_obj = self._file_objects.get(filename)
-        if file_obj is None:
-            target.create_base_path()
-            file_obj = open(filename, 'w' + target.file_mode)
-            self._file_objects[filename] = file_obj
+        self._lock.acquire()
+        try:
+            file_obj = self._file_objects.get(filename)
+            append = filename in self._started_files
+        finally:
+            self._lock.release()
+        if file_obj is None or file_obj.closed:
+            self._create_base_path(target)
+            # Streamed output from another collection is added to.
+            file_obj = punc.output.OutputFile(
+                filename, 'w' + target.file_mode, append=append,
+                keep=self.archive is not None)
+            self._lock.acquire()
+            try:
+                self._file_objects[filename] = file_obj
+            finally:
+                self._lock.release()
         return file_obj
 
     def _targets_not_to_write(self):
@@ -237,47 +891,185 @@ class Collator(object):
         for c in self._collections:
             for target, results in c.results.iteritems():
                 for r in results:
-                    if r.status == punc.model.Result.STATUS_ERROR:
+                    if r.failed():
                         logging.debug('ERROR_NO_OUTPUT %s %s',
                                       c, r.device_name())
                         t.add((c, target))
         return t
 
+    def _write_target(self, target, results):
+        """Writes a target's results in key order.
+
+        Returns:
+          The file object written to, or None if no results were written.
+        """
+        if not len(results):
+            return None
+        target_file = self.get_file_object(target)
+        self._lock.acquire()
+        try:
+            new = target_file.name not in self._started_files
+            self._started_files.add(target_file.name)
+        finally:
+            self._lock.release()
+        if new:
+            logging.debug('OUTPUT_FILE_NEW %s', target_file.name)
+            if target.header:
+                target_file.write(target.header)
+
+        for result in sorted(results, key=operator.attrgetter('key')):
+            if result.output is not None:
+                logging.debug('OUTPUT %s: %r [%d bytes]',
+                              target_file.name, result.key,
+                              len(result.output))
+                target_file.write(result.output)
+        return target_file
+
+    def target_complete(self, collection, target):
+        """Writes and releases a device's completed target (streaming)."""
+        results = collection.results.get(target)
+        if not results:
+            return
+        for r in results:
+            if r.failed():
+                # Keep the results for the error report.
+                logging.debug('ERROR_NO_OUTPUT %s %s',
+                              collection, r.device_name())
+                return
+        self._write_file([(target, results)])
+        collection.release(target)
+
     def collate(self):
         """Collates and writes the outputs to disk."""
-        files_seen = set()
         dont_write = self._targets_not_to_write()
+        # The targets of each file, in collection order.
+        filenames = []
+        file_targets = {}
         for c in self._collections:
             for target, results in c.results.iteritems():
                 if (c, target) in dont_write:
                     # Skip targets where not all of the rules succeeded.
                     continue
+                if not len(results):
+                    continue
+                if target.name not in file_targets:
+                    filenames.append(target.name)
+                    file_targets[target.name] = []
+                file_targets[target.name].append((target, results))
+        jobs = [file_targets[filename] for filename in filenames]
+        if self.threads > 1 and len(jobs) > 1:
+            pool = multiprocessing.pool.ThreadPool(min(self.threads,
+                                                       len(jobs)))
+            try:
+                files_seen = pool.map(self._collate_file, jobs)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            files_seen = [self._collate_file(job) for job in jobs]
+        logging.debug('Wrote %d output files (%d unchanged in total)',
+                      len([f for f in files_seen if f is not None]),
+                      self.unchanged)
+        if self.blob_store is not None:
+            self.blob_store.save_manifest()
+        if self._archive_pool is not None:
+            self._archive_pool.close()
+            self._archive_pool.join()
+            self._archive_pool = None
 
-                if len(results):
-                    target_file = self.get_file_object(target)
-                    if target_file.name not in self._started_files:
-                        logging.debug('OUTPUT_FILE_NEW %s', target_file.name)
-                        self._started_files.add(target_file.name)
-                        if target.header:
-                            target_file.write(target.header)
-
-                    for result in sorted(
-                        results, key=operator.attrgetter('key')):
-                        if result.output is not None:
-                            files_seen.add(target_file)
-                            logging.debug('OUTPUT %s: %r [%d bytes]',
-                                          target_file.name, result.key,
-                                          len(result.output))
-                            target_file.write(result.output)
-        logging.debug('Wrote %d output files', len(files_seen))
-        # Close the files we wrote to.
-        self._close_files(files_seen)
+    def _archive_file(self, f):
+        """Records a closed file's content in the archive."""
+        try:
+            self.archive.add(f.name, f.digest, f.data)
+        except Exception:
+            logging.exception('Could not archive %r', f.name)
+
+    def _cached_file(self, targets):
+        """Returns True if a file's results were all taken from the cache.
+
+        Such a file is left as it is if it exists with the size of the
+        output, if it is not archived, and if the blob store (if any)
+        already has its digest.
+        """
+        filename = targets[0][0].name
+        if self.archive is not None or filename in self._started_files:
+            return False
+        size = len(targets[0][0].header or '')
+        for _, results in targets:
+            for result in results:
+                if not result.cached:
+                    return False
+                if result.output is not None:
+                    size += len(result.output)
+        try:
+            if os.path.getsize(filename) != size:
+                return False
+        except OSError:
+            return False
+        return (self.blob_store is None or
+                self.blob_store.previous_digest(filename) is not None)
+
+    def _collate_file(self, targets):
+        """Writes and closes a file of the targets given, unless cached.
+
+        Returns:
+          The file object written to, or None if the file was left as it is.
+        """
+        if not self._cached_file(targets):
+            return self._write_file(targets)
+        filename = targets[0][0].name
+        logging.debug('OUTPUT_CACHED %s', filename)
+        self._lock.acquire()
+        try:
+            self.written.append(filename)
+            self.unchanged += 1
+        finally:
+            self._lock.release()
+        return None
+
+    def _write_file(self, targets):
+        """Writes and closes a file of the targets given.
+
+        Args:
+          targets: A list of (target, results) tuples for the same file.
+
+        Returns:
+          The file object written to.
+        """
+        target_file = None
+        for target, results in targets:
+            target_file = self._write_target(target, results)
+        # Close the file we wrote to.
+        self._close_files([target_file])
+        self._lock.acquire()
+        try:
+            del self._file_objects[target_file.name]
+        finally:
+            self._lock.release()
+        return target_file
 
     def _close_files(self, files_seen):
         """Closes all opened files in the iterable supplied."""
         for f in files_seen:
             if not f.closed:
                 f.close()
+                self._lock.acquire()
+                try:
+                    self.written.append(f.name)
+                    if not f.changed:
+                        logging.debug('OUTPUT_UNCHANGED %s', f.name)
+                        self.unchanged += 1
+                    if self.archive is not None:
+                        # One thread archives every file, in order.
+                        if self._archive_pool is None:
+                            self._archive_pool = (
+                                multiprocessing.pool.ThreadPool(1))
+                        self._archive_pool.apply_async(self._archive_file,
+                                                       (f,))
+                finally:
+                    self._lock.release()
+                if self.blob_store is not None:
+                    self.blob_store.add(f.name, f.digest)
 
     def errors(self):
         """Returns the errors by device."""
@@ -286,7 +1078,7 @@ class Collator(object):
             for _, results in c.results.iteritems():
                 for r in results:
                     dev_name = r.device_name()
-                    if r.status == punc.model.Result.STATUS_ERROR:
+                    if r.failed():
                         if dev_name in errors:
                             errors[dev_name].add(r.error_message())
                         else:
@@ -294,6 +1086,18 @@ class Collator(object):
         return errors
 
 
+def summary_report(collections):
+    """Returns a string summary of a run's collections for logging."""
+    rep = ['PUNC Collection Summary:', '']
+    for c in collections:
+        rep.append('  %s (%s): %d devices, %d with errors, '
+                   '%d unchanged (skipped)'
+                   % (c.name, c.recipe.ruleset, len(c.recipe.devices),
+                      len(c.devices_with_errors()), len(c.skipped)))
+    rep.append('')
+    return '\n'.join(rep)
+
+
 def error_report(errors):
     """Returns a string error report useful for display or writing to disk."""
     rep = ['PUNC Collection Errors:', '']
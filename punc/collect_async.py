@@ -0,0 +1,388 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# Copyright 2010 Andrew Fort
+
+"""PUNC's asyncio collector engine.
+
+An alternative to the eventlet callback chain in punc.collect. Each device
+is a coroutine working through its request chains; in-flight limits are
+semaphores and timeouts are asyncio.wait_for, so there is no polling loop.
+Results are recorded by the same punc.collect.Collection objects, so the
+Collator, history, retry policy and change detection work as they do with
+the eventlet engine, and the two engines can be compared on the same
+recipes.
+
+Notch requests are blocking calls run in a thread pool, each thread with
+its own Notch connection (and so its own eventlet hub).
+
+This module requires trollius (the asyncio backport) and futures.
+"""
+
+
+import concurrent.futures
+import copy
+import logging
+import threading
+import time
+
+import trollius as asyncio
+from trollius import From
+
+import notch.client
+
+import punc.model
+import punc.parse_pool
+
+
+class NotchExecutor(object):
+    """Executes Notch requests synchronously with a per-thread connection.
+
+    A Notch connection belongs to the eventlet hub of the thread creating
+    it, so connections are not shared between threads; each worker thread
+    creates one connection, when it first executes a request, and reuses
+    it. The number of connections is bounded by the engine's thread pool.
+    """
+
+    def __init__(self, agents):
+        """Initialiser.
+
+        Args:
+          agents: The Notch agents, as accepted by notch.client.Connection.
+        """
+        self.agents = agents
+        self._local = threading.local()
+
+    def __call__(self, request):
+        """Executes a request, returning it with its result or error set."""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = notch.client.Connection(self.agents)
+            self._local.connection = connection
+        connection.exec_request(request)
+        return request
+
+
+class AsyncEngine(object):
+    """Runs the requests of a set of collections with asyncio.
+
+    Attributes:
+      max_requests: An int or None, the global in-flight request limit.
+      max_requests_per_collection: An int or None, the in-flight request
+        limit for each collection name.
+      max_requests_per_device: An int, the in-flight request limit for each
+        device.
+      threads: An int, the number of worker threads (and so Notch
+        connections) requests are executed in. No more requests than this
+        are ever in flight.
+      parse_threshold: An int, the result size in bytes from which results
+        are parsed in a worker process (if parse_processes is set).
+      peak_in_flight: An int, the most requests executing at once.
+    """
+
+    # Worker threads if there is no global in-flight limit.
+    UNLIMITED_THREADS = 64
+
+    def __init__(self, execute, max_requests=None,
+                 max_requests_per_collection=None, max_requests_per_device=1,
+                 threads=None, parse_processes=0, parse_threshold=262144,
+                 loop=None):
+        """Initialiser.
+
+        Args:
+          execute: A callable taking a notch.client.Request, which executes
+            it synchronously and returns it (e.g., a NotchExecutor).
+          max_requests: An int or None, the global in-flight request limit.
+          max_requests_per_collection: An int or None, the in-flight
+            request limit for each collection name.
+          max_requests_per_device: An int, the in-flight request limit for
+            each device.
+          threads: An int or None, the number of worker threads. By default,
+            twice max_requests, as requests abandoned after their timeout
+            keep their thread until Notch returns.
+          parse_processes: An int, the number of parser worker processes
+            (0 parses inline).
+          parse_threshold: An int, see Attributes.
+          loop: An asyncio event loop. Defaults to the current event loop.
+        """
+        self._execute = execute
+        self.max_requests = max_requests or None
+        self.max_requests_per_collection = max_requests_per_collection or None
+        self.max_requests_per_device = max(max_requests_per_device or 1, 1)
+        if not threads:
+            if self.max_requests:
+                threads = 2 * self.max_requests
+            else:
+                threads = self.UNLIMITED_THREADS
+        self.threads = threads
+        self.parse_threshold = parse_threshold
+        self.peak_in_flight = 0
+        # Requests executing in the worker threads, guarded by _lock.
+        self._executing = 0
+        self._lock = threading.Lock()
+        self._loop = loop or asyncio.get_event_loop()
+        self._executor = concurrent.futures.ThreadPoolExecutor(self.threads)
+        self._parse_executor = None
+        if parse_processes:
+            self._parse_executor = concurrent.futures.ProcessPoolExecutor(
+                parse_processes)
+        self._semaphore = None
+        if self.max_requests:
+            self._semaphore = asyncio.Semaphore(self.max_requests,
+                                                loop=self._loop)
+        # Collection name -> Semaphore
+        self._collection_semaphores = {}
+        # Collection -> set of requests awaiting a final result.
+        self._in_flight = {}
+
+    def __repr__(self):
+        return ('%s(max_requests=%r, max_requests_per_collection=%r, '
+                'max_requests_per_device=%d, threads=%d)' %
+                (self.__class__.__name__,
+                 self.max_requests, self.max_requests_per_collection,
+                 self.max_requests_per_device, self.threads))
+
+    def run(self, collections):
+        """Runs the collections to completion."""
+        self._loop.run_until_complete(self.collect(collections))
+        logging.info('asyncio engine: at most %d requests in flight '
+                     '(max_requests=%r, threads=%d)', self.peak_in_flight,
+                     self.max_requests, self.threads)
+
+    def close(self):
+        """Stops the worker threads and processes once they are idle."""
+        self._executor.shutdown(wait=False)
+        if self._parse_executor is not None:
+            self._parse_executor.shutdown()
+
+    @asyncio.coroutine
+    def collect(self, collections):
+        """Coroutine collecting from the collections concurrently."""
+        tasks = []
+        for collection in collections:
+            if not collection._prepare(self.max_requests_per_device):
+                continue
+            if (self.max_requests_per_collection and
+                collection.name not in self._collection_semaphores):
+                self._collection_semaphores[collection.name] = (
+                    asyncio.Semaphore(self.max_requests_per_collection,
+                                      loop=self._loop))
+            self._in_flight[collection] = set()
+            tasks.append(asyncio.ensure_future(
+                self._run_collection(collection), loop=self._loop))
+        if tasks:
+            yield From(asyncio.wait(tasks, loop=self._loop))
+
+    @asyncio.coroutine
+    def _run_collection(self, collection):
+        # Devices which were slowest in previous runs start first.
+        priorities = collection._device_priorities()
+        devices = sorted(collection.recipe.devices,
+                         key=lambda d: priorities[d])
+        tasks = [self._run_device(collection, d) for d in devices]
+        try:
+            yield From(asyncio.wait_for(
+                asyncio.gather(*tasks, loop=self._loop),
+                collection.collection_timeout or None, loop=self._loop))
+        except asyncio.TimeoutError:
+            logging.warning('[%s] Collection timed out', collection.name)
+            self._timed_out(collection)
+        self._in_flight.pop(collection, None)
+
+    def _timed_out(self, collection):
+        """Records the unfinished requests of a collection as timed out."""
+        error = ('Timeout: collection did not complete within %.1fs' %
+                 collection.collection_timeout)
+        unfinished = list(self._in_flight.pop(collection, ()))
+        for requests in collection._device_requests.itervalues():
+            unfinished.extend(requests.clear())
+        for request in unfinished:
+            if collection._probes.pop(request, None) is not None:
+                continue
+            collection._record_duration(request)
+            rule, action, target = request.callback_args
+            collection._add_result(request, rule, action, target,
+                                   collection._get_timeout_status(rule),
+                                   error=error)
+
+    @asyncio.coroutine
+    def _run_device(self, collection, device):
+        requests = collection._device_requests[device]
+        if requests.probe is not None:
+            probe = requests.next_request()
+            yield From(self._run_request(collection, probe))
+        workers = [self._run_chains(collection, requests)
+                   for _ in xrange(requests.max_in_flight)]
+        yield From(asyncio.gather(*workers, loop=self._loop))
+
+    @asyncio.coroutine
+    def _run_chains(self, collection, requests):
+        # Stops once every remaining chain is being sent by another worker.
+        while True:
+            request = requests.next_request()
+            if request is None:
+                break
+            yield From(self._run_request(collection, request))
+
+    @asyncio.coroutine
+    def _run_request(self, collection, request):
+        """Sends a request (retrying if allowed) and records its result."""
+        in_flight = self._in_flight[collection]
+        in_flight.add(request)
+        collection._retry.budget.request_sent()
+        attempt = 1
+        r = request
+        while True:
+            try:
+                r = yield From(self._send(collection, r))
+            except asyncio.TimeoutError:
+                self._request_timed_out(collection, request, r)
+                break
+            if r.error is None or not collection._retry.should_retry(
+                r.error, attempt):
+                yield From(self._request_complete(collection, request, r))
+                break
+            delay = collection._retry.delay(attempt)
+            logging.info('[%s] Retrying request to %s in %.1fs after attempt '
+                         '%d failed: %s', collection.name,
+                         request.arguments.get('device_name'), delay,
+                         attempt, r.error)
+            collection._sent_at.pop(r, None)
+            yield From(asyncio.sleep(delay, loop=self._loop))
+            r = copy.copy(request)
+            r.result = None
+            r.error = None
+            attempt += 1
+        in_flight.discard(request)
+        collection._device_requests[
+            request.arguments.get('device_name')].done(request)
+
+    @asyncio.coroutine
+    def _send(self, collection, request):
+        """Sends a request within the in-flight limits and its timeout."""
+        semaphores = [self._collection_semaphores.get(collection.name),
+                      self._semaphore]
+        semaphores = [s for s in semaphores if s is not None]
+        acquired = []
+        try:
+            for semaphore in semaphores:
+                yield From(semaphore.acquire())
+                acquired.append(semaphore)
+            collection._sent_at[request] = time.time()
+            logging.debug('REQUEST_SENT %r', request)
+            future = self._loop.run_in_executor(self._executor,
+                                                self._execute_counted, request)
+            r = yield From(asyncio.wait_for(
+                future, collection.command_timeout or None, loop=self._loop))
+        finally:
+            for semaphore in acquired:
+                semaphore.release()
+        raise asyncio.Return(r)
+
+    def _execute_counted(self, request):
+        """Executes a request in a worker thread, counting those executing.
+
+        Requests abandoned after their timeout are counted until Notch
+        returns.
+        """
+        self._lock.acquire()
+        try:
+            self._executing += 1
+            self.peak_in_flight = max(self.peak_in_flight, self._executing)
+        finally:
+            self._lock.release()
+        try:
+            return self._execute(request)
+        finally:
+            self._lock.acquire()
+            try:
+                self._executing -= 1
+            finally:
+                self._lock.release()
+
+    def _add_result(self, collection, request, r, status, output=None,
+                    error=None, cached=False):
+        """Records the result of a request, unless it has been abandoned.
+
+        Args:
+          collection: The punc.collect.Collection of the request.
+          request: The notch.client.Request first sent.
+          r: The notch.client.Request of the final attempt.
+          status: An int, the punc.model.Result status.
+          output: The parsed result, if any.
+          error: A string, the error message, if any.
+          cached: A boolean, True if the output is from the result cache.
+        """
+        in_flight = self._in_flight.get(collection)
+        if in_flight is None or request not in in_flight:
+            # The collection timed out.
+            return
+        in_flight.discard(request)
+        rule, action, target = request.callback_args
+        collection._add_result(r, rule, action, target, status,
+                               output=output, error=error, cached=cached)
+
+    def _request_timed_out(self, collection, request, r):
+        device_name = request.arguments.get('device_name')
+        logging.warning('[%s] Request to %s timed out after %.1fs',
+                        collection.name, device_name,
+                        collection.command_timeout)
+        collection._record_duration(r)
+        if request in collection._probes:
+            collection._probe_complete(request)
+            return
+        rule = request.callback_args[0]
+        self._add_result(collection, request, r,
+                         collection._get_timeout_status(rule),
+                         error='Timeout: no response within %.1fs' %
+                         collection.command_timeout)
+
+    @asyncio.coroutine
+    def _request_complete(self, collection, request, r):
+        """Records the final response r to a request."""
+        logging.debug('REQUEST_CALLBACK %r', r)
+        collection._record_duration(r)
+        if request in collection._probes:
+            collection._probes[r] = collection._probes.pop(request)
+            collection._probe_complete(r)
+            return
+        rule, action, target = request.callback_args
+        if r.error is not None:
+            self._add_result(collection, request, r,
+                             collection._get_error_status(rule))
+            return
+        digest, cached = None, None
+        if collection._result_cache is not None:
+            # The result cache's files are read and written off the loop.
+            digest, cached = yield From(self._loop.run_in_executor(
+                None, collection._cached_result, r, action))
+        if cached is not None:
+            self._add_result(collection, request, r, cached[0],
+                             output=cached[1], cached=True)
+            return
+        status, output = punc.model.Result.STATUS_PENDING, None
+        try:
+            if (self._parse_executor is not None and
+                action.parser is not None and
+                len(r.result) >= self.parse_threshold):
+                status, output = yield From(self._loop.run_in_executor(
+                    self._parse_executor, punc.parse_pool.parse_result,
+                    action.parser, r.result))
+            else:
+                status, output = punc.parse_pool.parse_result(action.parser,
+                                                              r.result)
+            if digest is not None:
+                yield From(self._loop.run_in_executor(
+                    None, collection._cache_result, r, action, digest,
+                    status, output))
+        finally:
+            self._add_result(collection, request, r, status, output=output)
@@ -0,0 +1,314 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# Copyright 2010 Andrew Fort
+
+"""PUNC's long-running daemon mode."""
+
+
+import logging
+import random
+
+from eventlet.green import time
+
+
+class DeviceSchedule(object):
+    """Recurring collection times for each device.
+
+    Each device is collected once per its interval, with jitter, so the
+    load on the Notch agents is spread evenly over time. The first
+    collection of a new device is at a random point within its interval.
+
+    Devices are keyed by (collection name, device name), as a device may
+    be collected by more than one collection.
+    """
+
+    def __init__(self, jitter=0.1, clock=None):
+        """Initialiser.
+
+        Args:
+          jitter: A float [0..1], the fraction of the interval by which each
+            collection time is randomly moved earlier or later.
+          clock: A callable returning the current time in seconds. Defaults
+            to time.time.
+        """
+        self.jitter = min(max(jitter, 0.0), 1.0)
+        self._clock = clock or time.time
+        self._random = random.Random()
+        # Key -> interval in seconds
+        self._intervals = {}
+        # Key -> time due
+        self._due = {}
+        # Key -> (time first triggered, time otherwise due)
+        self._triggered = {}
+
+    def __len__(self):
+        return len(self._due)
+
+    def update(self, intervals):
+        """Sets the devices to collect.
+
+        Args:
+          intervals: A dict of (collection name, device name) tuples to
+            collection intervals in seconds. Devices not in the dict are no
+            longer collected.
+        """
+        now = self._clock()
+        for key in self._due.keys():
+            if key not in intervals:
+                del self._due[key]
+                self._triggered.pop(key, None)
+        for key, interval in intervals.iteritems():
+            if key not in self._due:
+                self._due[key] = now + self._random.random() * interval
+        self._intervals = dict(intervals)
+
+    def due(self):
+        """Returns a set of the keys due to be collected now."""
+        now = self._clock()
+        return set([k for k, due in self._due.iteritems() if due <= now])
+
+    def next_due(self):
+        """Returns the time the next device is due, or None."""
+        if not self._due:
+            return None
+        return min(self._due.itervalues())
+
+    def trigger(self, key, delay, max_delay=None):
+        """Brings forward the next collection of a device.
+
+        The device is collected delay seconds after the last trigger, so a
+        burst of triggers (e.g., several configuration commits) results in
+        a single collection. It is never collected later than it was due,
+        or than max_delay seconds after the first trigger of the burst.
+
+        Args:
+          key: A tuple (collection name, device name).
+          delay: A float, seconds to wait for further triggers.
+          max_delay: A float or None, the longest to wait after the first
+            trigger.
+
+        Returns:
+          A boolean, True if the device is known.
+        """
+        if key not in self._due:
+            return False
+        now = self._clock()
+        if key not in self._triggered:
+            self._triggered[key] = (now, self._due[key])
+        first, due = self._triggered[key]
+        if max_delay is not None:
+            due = min(due, first + max_delay)
+        self._due[key] = min(now + delay, due)
+        return True
+
+    def collected(self, key, started=None):
+        """Schedules the next collection of a device just collected.
+
+        Args:
+          key: A tuple (collection name, device name).
+          started: A float or None, the time the collection started. If the
+            device was triggered since, it is collected again as the
+            trigger is due.
+        """
+        if key not in self._due:
+            return
+        interval = self._intervals[key]
+        jitter = self.jitter * interval * (2 * self._random.random() - 1)
+        due = self._clock() + interval + jitter
+        triggered = self._triggered.pop(key, None)
+        if (triggered is not None and started is not None and
+            triggered[0] >= started):
+            self._triggered[key] = (triggered[0], due)
+        else:
+            self._due[key] = due
+
+
+class Daemon(object):
+    """Re-collects devices on their own schedules in a single process.
+
+    The Notch connection, the revision control repository, the inventory
+    of devices and other run state (request limits, history) are kept
+    between collections, rather than being set up again for every run.
+
+    Devices may also be collected early with trigger(), e.g., on
+    notification of a configuration change (see punc.trigger).
+
+    Attributes:
+      interval: A float, the default per-device collection interval in
+        seconds. Recipes may set their own 'interval'.
+      inventory_interval: A float, seconds between Notch inventory queries.
+      max_sleep: A float, the longest the daemon sleeps between checks for
+        due devices.
+      trigger_delay: A float, seconds to wait for further triggers of a
+        device before collecting it.
+      trigger_max_delay: A float, the longest to wait after the first
+        trigger of a device.
+    """
+
+    # Seconds between checks for triggered devices while sleeping.
+    SLEEP_STEP = 1.0
+
+    def __init__(self, recipe_devices, build_collections,
+                 run_collections, commit, interval=86400.0, jitter=0.1,
+                 inventory_interval=3600.0, max_sleep=60.0,
+                 trigger_delay=30.0, trigger_max_delay=300.0, clock=None):
+        """Initialiser.
+
+        Args:
+          recipe_devices: A callable returning the devices to collect, as
+            util.get_recipe_devices.
+          build_collections: A callable taking a list as returned by
+            recipe_devices (with just the due devices), returning a list of
+            collect.Collection objects.
+          run_collections: A callable taking a list of collections, which
+            runs them to completion and writes their results.
+          commit: A callable, which commits the written results.
+          interval: A float, see Attributes.
+          jitter: A float [0..1], the per-device schedule jitter.
+          inventory_interval: A float, see Attributes.
+          max_sleep: A float, see Attributes.
+          trigger_delay: A float, see Attributes.
+          trigger_max_delay: A float, see Attributes.
+          clock: A callable returning the current time in seconds. Defaults
+            to time.time.
+        """
+        self.interval = interval
+        self.inventory_interval = inventory_interval
+        self.max_sleep = max_sleep
+        self.trigger_delay = trigger_delay
+        self.trigger_max_delay = trigger_max_delay
+        self._recipe_devices = recipe_devices
+        self._build_collections = build_collections
+        self._run_collections = run_collections
+        self._commit = commit
+        self._clock = clock or time.time
+        self._schedule = DeviceSchedule(jitter=jitter, clock=self._clock)
+        self._inventory = []
+        self._inventory_at = None
+        self._stopped = False
+        self._woken = False
+
+    def __repr__(self):
+        return ('%s(interval=%r, jitter=%r, inventory_interval=%r)' %
+                (self.__class__.__name__, self.interval,
+                 self._schedule.jitter, self.inventory_interval))
+
+    def stop(self):
+        """Stops the daemon once the current collection completes."""
+        self._stopped = True
+
+    def devices(self):
+        """Returns a set of the names of the devices in the inventory."""
+        devices = set()
+        for _, _, recipe_devices in self._inventory:
+            devices.update(recipe_devices)
+        return devices
+
+    def trigger(self, device):
+        """Collects a device soon, in every collection it belongs to.
+
+        Returns:
+          A boolean, True if the device is in the inventory.
+        """
+        found = False
+        for name, _, devices in self._inventory:
+            if device in devices:
+                found |= self._schedule.trigger(
+                    (name, device), self.trigger_delay,
+                    max_delay=self.trigger_max_delay)
+        if found:
+            logging.info('Collection of %s triggered', device)
+            self._woken = True
+        return found
+
+    def refresh_inventory(self):
+        """Updates the devices to collect from Notch.
+
+        If the inventory cannot be loaded, or is empty, the devices of the
+        previous inventory remain scheduled.
+        """
+        try:
+            inventory = self._recipe_devices()
+        except Exception, e:
+            logging.warning('Could not refresh the daemon inventory; keeping '
+                            'the previous one. %s: %s',
+                            e.__class__.__name__, str(e))
+            return
+        if not [devices for _, _, devices in inventory or () if devices]:
+            logging.warning('The daemon inventory is empty; keeping the '
+                            'previous one')
+            return
+        self._inventory = inventory
+        self._inventory_at = self._clock()
+        intervals = {}
+        for name, recipe, devices in self._inventory:
+            interval = float(recipe.get('interval') or self.interval)
+            for device in devices:
+                intervals[(name, device)] = interval
+        self._schedule.update(intervals)
+        logging.info('Daemon inventory has %d devices', len(self._schedule))
+
+    def run_once(self):
+        """Collects and commits the devices now due.
+
+        Returns:
+          An int, the number of devices collected.
+        """
+        if (self._inventory_at is None or
+            self._clock() - self._inventory_at >= self.inventory_interval):
+            self.refresh_inventory()
+        due = self._schedule.due()
+        if not due:
+            return 0
+        recipe_devices = []
+        for name, recipe, devices in self._inventory:
+            due_devices = set([d for d in devices if (name, d) in due])
+            if due_devices:
+                recipe_devices.append((name, recipe, due_devices))
+        logging.info('Collecting %d due devices', len(due))
+        started = self._clock()
+        try:
+            self._run_collections(self._build_collections(recipe_devices))
+            self._commit()
+        finally:
+            # Even if the collection failed; the devices are tried again
+            # in an interval, rather than at once.
+            for key in due:
+                self._schedule.collected(key, started=started)
+        return len(due)
+
+    def _sleep(self, seconds):
+        """Sleeps, waking early if a device is triggered."""
+        self._woken = False
+        end = self._clock() + seconds
+        while not (self._woken or self._stopped):
+            remaining = end - self._clock()
+            if remaining <= 0:
+                break
+            time.sleep(min(remaining, self.SLEEP_STEP))
+
+    def run(self):
+        """Runs until stopped."""
+        logging.info('Starting %r', self)
+        while not self._stopped:
+            try:
+                self.run_once()
+            except Exception:
+                logging.exception('Daemon collection failed')
+            sleep = self.max_sleep
+            next_due = self._schedule.next_due()
+            if next_due is not None:
+                sleep = min(max(next_due - self._clock(), 0), self.max_sleep)
+            if sleep and not self._stopped:
+                self._sleep(sleep)
+        logging.info('Daemon stopped')
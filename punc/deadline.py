@@ -0,0 +1,86 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# Copyright 2010 Andrew Fort
+
+"""PUNC's request and collection deadline engine."""
+
+
+import logging
+import time
+
+
+class DeadlineEngine(object):
+    """Tracks outstanding requests and collections against their budgets.
+
+    Collections register each request as it is sent and each collection as
+    it starts. check() is called periodically by the run loop; requests and
+    collections past their deadline are handed back to their collection to
+    be abandoned (see Collection.request_timed_out and
+    Collection.timed_out).
+    """
+
+    def __init__(self, clock=None):
+        """Initialiser.
+
+        Args:
+          clock: A callable returning the current time in seconds. Defaults
+            to time.time.
+        """
+        self._clock = clock or time.time
+        # Outstanding request -> (deadline, collection)
+        self._requests = {}
+        # Collection -> deadline
+        self._collections = {}
+
+    def start_request(self, collection, request, timeout):
+        """Starts the clock on a request sent by a collection."""
+        deadline = None
+        if timeout:
+            deadline = self._clock() + timeout
+        self._requests[request] = (deadline, collection)
+
+    def end_request(self, request):
+        """Stops the clock on a request.
+
+        Returns:
+          A boolean, True if the request was outstanding; False if it was
+          unknown or has already been abandoned.
+        """
+        return self._requests.pop(request, None) is not None
+
+    def start_collection(self, collection, timeout):
+        """Starts the clock on a collection."""
+        if timeout:
+            self._collections[collection] = self._clock() + timeout
+
+    def end_collection(self, collection):
+        """Stops the clock on a collection."""
+        self._collections.pop(collection, None)
+
+    def outstanding(self, collection):
+        """Returns a list of the collection's outstanding requests."""
+        return [r for r, (_, c) in self._requests.iteritems()
+                if c is collection]
+
+    def check(self):
+        """Abandons overdue requests and collections."""
+        now = self._clock()
+        for collection, deadline in self._collections.items():
+            if deadline <= now:
+                logging.warning('[%s] Collection timed out', collection.name)
+                self.end_collection(collection)
+                collection.timed_out()
+        for request, (deadline, collection) in self._requests.items():
+            if deadline is not None and deadline <= now:
+                if self.end_request(request):
+                    collection.request_timed_out(request)
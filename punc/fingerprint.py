@@ -0,0 +1,49 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# Copyright 2010 Andrew Fort
+
+"""PUNC's store of device configuration fingerprints."""
+
+
+import punc.state
+
+
+class FingerprintStore(punc.state.StateFile):
+    """Configuration fingerprints from the last successful collection.
+
+    A fingerprint is the output of a ruleset's cheap fingerprint action
+    (e.g., the time of the last configuration change). When a device's
+    fingerprint matches the stored one, its full collection is skipped.
+
+    Attributes:
+      refresh: A boolean. If True, fingerprints never match, so every
+        device is collected in full, but new fingerprints are still stored.
+    """
+
+    def __init__(self, path=None, refresh=False):
+        super(FingerprintStore, self).__init__(path)
+        self.refresh = refresh
+
+    def get(self, device, ruleset_name):
+        """Returns the stored fingerprint of a device, or None."""
+        return self._data.get(device, {}).get(ruleset_name)
+
+    def set(self, device, ruleset_name, fingerprint):
+        """Stores the fingerprint of a successfully collected device."""
+        self._data.setdefault(device, {})[ruleset_name] = fingerprint
+
+    def matches(self, device, ruleset_name, fingerprint):
+        """Returns True if a device is unchanged since the last collection."""
+        if self.refresh or fingerprint is None:
+            return False
+        return bool(self.get(device, ruleset_name) == fingerprint)
@@ -0,0 +1,60 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# Copyright 2010 Andrew Fort
+
+"""PUNC's on-disk history of device request durations."""
+
+
+import punc.state
+
+
+class DurationHistory(punc.state.StateFile):
+    """Per-device, per-action request durations from previous runs.
+
+    Durations are kept as a moving average, so the history follows devices
+    whose configuration grows or shrinks over time. The history is used to
+    start the slowest devices first, which shortens the tail of a run.
+    """
+
+    # Weight of the newest sample in the moving average.
+    SMOOTHING = 0.5
+
+    @staticmethod
+    def action_name(ruleset_name, action):
+        """Returns the history key for an action of a ruleset."""
+        return '%s:%r' % (ruleset_name, action.key)
+
+    def record(self, device, action_name, seconds):
+        """Records the duration of an action on a device."""
+        actions = self._data.setdefault(device, {})
+        previous = actions.get(action_name)
+        if previous is None:
+            actions[action_name] = seconds
+        else:
+            actions[action_name] = (previous * (1 - self.SMOOTHING) +
+                                    seconds * self.SMOOTHING)
+
+    def expected(self, device, action_names):
+        """Returns the expected total duration of actions on a device.
+
+        Returns:
+          A float, the sum of the known durations, or None if none of the
+          actions have been seen for this device.
+        """
+        actions = self._data.get(device)
+        if not actions:
+            return None
+        known = [actions[a] for a in action_names if a in actions]
+        if not known:
+            return None
+        return sum(known)
@@ -0,0 +1,142 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# Copyright 2010 Andrew Fort
+
+"""PUNC's snapshot of the Notch device inventory."""
+
+
+import json
+import logging
+import os
+import re
+import time
+
+
+class Inventory(object):
+    """The Notch device inventory, fetched once and matched locally.
+
+    Devices are indexed by vendor (their Notch device_type), and recipe
+    regular expressions are compiled once, so any number of recipes can
+    be matched without further queries to the Notch agents.
+
+    Attributes:
+      devices: A dict of device names to Notch device info dicts.
+      fetched: A float, the time the inventory was fetched from Notch.
+    """
+
+    def __init__(self, devices, fetched=None):
+        """Initialiser.
+
+        Args:
+          devices: A dict as returned by Notch's devices_info method.
+          fetched: A float, see Attributes. Defaults to now.
+        """
+        self.devices = {}
+        self._by_vendor = {}
+        for name, info in devices.iteritems():
+            if name is None or info is None:
+                logging.warning('Inventory skipping bad device %r=%r',
+                                name, info)
+                continue
+            self.devices[name] = info
+            self._by_vendor.setdefault(info.get('device_type'),
+                                       set()).add(name)
+        if fetched is None:
+            fetched = time.time()
+        self.fetched = fetched
+        self._regexps = {}
+
+    def __repr__(self):
+        return ('%s(<%d devices>, fetched=%r)' %
+                (self.__class__.__name__, len(self.devices), self.fetched))
+
+    def __len__(self):
+        return len(self.devices)
+
+    def _compile(self, regexp):
+        if regexp not in self._regexps:
+            self._regexps[regexp] = re.compile(regexp)
+        return self._regexps[regexp]
+
+    def match(self, regexp=None, vendor=None):
+        """Returns the devices matching a recipe.
+
+        Args:
+          regexp: A string or None, a regular expression matched from the
+            start of device names. If None, all devices match.
+          vendor: A string or None. If a string, only devices of this vendor
+            match.
+
+        Returns:
+          A set of strings, the matching device names.
+        """
+        if vendor:
+            candidates = self._by_vendor.get(vendor, set())
+        else:
+            candidates = self.devices
+        if regexp is None:
+            return set(candidates)
+        regexp = self._compile(regexp)
+        return set([d for d in candidates if regexp.match(d)])
+
+    @classmethod
+    def load(cls, path, ttl):
+        """Loads an inventory cached on disk, if it is fresh.
+
+        Args:
+          path: A string, the cache file path.
+          ttl: A float, the maximum age of the cached inventory in seconds.
+
+        Returns:
+          An Inventory, or None if there is no fresh cached inventory.
+        """
+        if not os.path.exists(path):
+            return None
+        try:
+            f = open(path)
+            try:
+                data = json.load(f)
+            finally:
+                f.close()
+            fetched = float(data['fetched'])
+            devices = data['devices']
+        except (OSError, IOError, ValueError, KeyError, TypeError), e:
+            logging.warning('Ignoring unreadable inventory cache %r. %s: %s',
+                            path, e.__class__.__name__, str(e))
+            return None
+        if time.time() - fetched > ttl:
+            logging.debug('Inventory cache %r has expired', path)
+            return None
+        # JSON names are unicode; Notch device names are byte strings.
+        devices = dict([(str(name), info)
+                        for name, info in devices.iteritems()])
+        logging.debug('Using inventory cached in %r', path)
+        return cls(devices, fetched=fetched)
+
+    def save(self, path):
+        """Atomically writes the inventory to a cache file."""
+        tmp_path = path + '.tmp'
+        try:
+            dirname = os.path.dirname(path)
+            if dirname and not os.path.exists(dirname):
+                os.makedirs(dirname)
+            f = open(tmp_path, 'w')
+            try:
+                json.dump({'fetched': self.fetched,
+                           'devices': self.devices}, f)
+            finally:
+                f.close()
+            os.rename(tmp_path, path)
+        except (OSError, IOError), e:
+            logging.error('Could not write inventory cache %r. %s: %s',
+                          path, e.__class__.__name__, str(e))
@@ -0,0 +1,241 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# Copyright 2010 Andrew Fort
+
+"""PUNC's run journal, for resuming an interrupted run."""
+
+
+import hashlib
+import json
+import logging
+import multiprocessing.pool
+import os
+import shutil
+
+import punc.output
+
+
+class Journal(object):
+    """An append-only file of the targets completed during a run.
+
+    Each line is a JSON record of one device's target and its results. A
+    record is only written once all of the target's results have succeeded,
+    and each record is flushed as it is written, so the journal survives
+    the process being killed. A torn final line is ignored when loaded, and
+    removed before the journal is appended to.
+
+    Records hold the digests of the outputs, which are kept in files of
+    their own in the outputs directory (the journal path with '.outputs'
+    appended), written before the record. Outputs are only read when a
+    device's results are restored. Records are written in a thread of
+    their own, in order, so the eventlet hub does not wait for the disk;
+    close() waits for them to be written.
+
+    A new run does not overwrite the journal of an interrupted run: it is
+    kept, with its outputs, as the journal path with '.previous' appended
+    (replacing any kept before).
+
+    Attributes:
+      path: A string, the journal file path.
+      outputs_path: A string, the outputs directory path.
+    """
+
+    PREVIOUS_SUFFIX = '.previous'
+
+    def __init__(self, path):
+        self.path = path
+        self.outputs_path = path + '.outputs'
+        # Target file name -> list of result dicts
+        self._targets = {}
+        self._file = None
+        self._pool = None
+
+    def __repr__(self):
+        return '%s(path=%r)' % (self.__class__.__name__, self.path)
+
+    def __len__(self):
+        return len(self._targets)
+
+    def load(self):
+        """Loads the records of a previous run, if the journal exists."""
+        self._targets = {}
+        if not os.path.exists(self.path):
+            return
+        f = open(self.path)
+        try:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    logging.warning('Ignoring torn journal record in %r',
+                                    self.path)
+                    continue
+                self._targets[record['target']] = record['results']
+        finally:
+            f.close()
+        logging.info('Loaded %d completed targets from journal %r',
+                     len(self._targets), self.path)
+
+    def _truncate_torn_record(self):
+        """Removes a torn final line, so records are appended after it."""
+        f = open(self.path, 'r+b')
+        try:
+            f.seek(0, os.SEEK_END)
+            size = end = f.tell()
+            while end:
+                step = min(end, punc.output.READ_SIZE)
+                f.seek(end - step)
+                newline = f.read(step).rfind('\n')
+                if newline >= 0:
+                    end = end - step + newline + 1
+                    break
+                end -= step
+            if end < size:
+                logging.warning('Removing torn journal record from %r',
+                                self.path)
+                f.truncate(end)
+        finally:
+            f.close()
+
+    def _keep_previous(self):
+        """Moves the journal of an interrupted run aside."""
+        previous = Journal(self.path + self.PREVIOUS_SUFFIX)
+        logging.warning('Not resuming; the journal of the interrupted run '
+                        'is kept as %r', previous.path)
+        previous.remove()
+        os.rename(self.path, previous.path)
+        if os.path.exists(self.outputs_path):
+            os.rename(self.outputs_path, previous.outputs_path)
+
+    def open(self, resume=False):
+        """Opens the journal for writing.
+
+        Args:
+          resume: A boolean. If True, append to the journal of the previous
+            run, else start a new journal.
+        """
+        if os.path.exists(self.path):
+            if resume:
+                self._truncate_torn_record()
+            else:
+                self._keep_previous()
+        punc.output.make_dirs(self.outputs_path)
+        if not resume:
+            self._targets = {}
+            for name in os.listdir(self.outputs_path):
+                os.remove(os.path.join(self.outputs_path, name))
+        self._file = open(self.path, resume and 'a' or 'w')
+        self._pool = multiprocessing.pool.ThreadPool(1)
+
+    def _output_path(self, digest):
+        return os.path.join(self.outputs_path, digest)
+
+    def results(self, target_name):
+        """Returns the journaled results of a target, or None.
+
+        Returns:
+          A list of dicts with keys 'key', 'status', 'output' and 'error',
+          or None if the target was not journaled (or an output is missing).
+        """
+        results = self._targets.get(target_name)
+        if results is None:
+            return None
+        restored = []
+        for result in results:
+            if 'digest' not in result:
+                # A record of an older journal format.
+                return None
+            output = None
+            if result['digest'] is not None:
+                try:
+                    f = open(self._output_path(result['digest']), 'rb')
+                    try:
+                        output = f.read()
+                    finally:
+                        f.close()
+                except (OSError, IOError), e:
+                    logging.warning('Could not read journaled output of %s. '
+                                    '%s: %s', target_name,
+                                    e.__class__.__name__, str(e))
+                    return None
+            key = result['key']
+            if isinstance(key, list):
+                key = tuple(key)
+            restored.append({'key': key,
+                             'status': result['status'],
+                             'output': output,
+                             'error': result['error']})
+        return restored
+
+    def record(self, collection_name, device, target_name, results):
+        """Appends a completed target's results to the journal.
+
+        Args:
+          collection_name: A string, the collection name.
+          device: A string, the device name.
+          target_name: A string, the target's file name.
+          results: An iterable of model.Result objects.
+        """
+        if self._file is None:
+            return
+        encoded = []
+        outputs = []
+        for result in results:
+            encoded.append({'key': result.key,
+                            'status': result.status,
+                            'error': result.error_message()})
+            outputs.append(result.output)
+        self._pool.apply_async(self._write_record,
+                               ({'collection': collection_name,
+                                 'device': device,
+                                 'target': target_name,
+                                 'results': encoded}, outputs))
+
+    def _write_record(self, record, outputs):
+        """Writes a record's outputs, then the record (in the pool)."""
+        try:
+            for result, output in zip(record['results'], outputs):
+                digest = None
+                if output is not None:
+                    digest = hashlib.sha1(output).hexdigest()
+                    path = self._output_path(digest)
+                    if not os.path.exists(path):
+                        f = open(path + '.tmp', 'wb')
+                        try:
+                            f.write(output)
+                        finally:
+                            f.close()
+                        os.rename(path + '.tmp', path)
+                result['digest'] = digest
+            self._file.write(json.dumps(record) + '\n')
+            self._file.flush()
+        except Exception:
+            logging.exception('Could not journal %r', record['target'])
+
+    def close(self):
+        """Waits for the records to be written, and closes the journal."""
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def remove(self):
+        """Closes and removes the journal once the run is committed."""
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        if os.path.exists(self.outputs_path):
+            shutil.rmtree(self.outputs_path)
@@ -22,12 +22,15 @@ limited device support and an absolute minimum of command output yet.
 
 import logging
 import os
+import signal
 import sys
 
 import punc.collect
 import punc.config
+import punc.deadline
 import punc.model
 import punc.rc_hg
+import punc.shard
 import punc.util
 
 from eventlet.green import time
@@ -52,9 +55,17 @@ def determine_config_file_path(options):
         return None
 
 
-def commit_changes(repo_path, base_path):
-    """Commits changes to the Mercurial repository."""
-    repo = punc.rc_hg.MercurialRevisionControl(repo_path, base_path)
+def commit_changes(repo_path, base_path, repo=None):
+    """Commits changes to the Mercurial repository.
+
+    Args:
+      repo_path: A string, the master repository path.
+      base_path: A string, the working repository path.
+      repo: A punc.rc_hg.MercurialRevisionControl object, an already open
+        repository, or None to open it now.
+    """
+    if repo is None:
+        repo = punc.rc_hg.MercurialRevisionControl(repo_path, base_path)
     repo.addremove()
     repo.commit()
 
@@ -73,17 +84,163 @@ def write_error_report(path, report):
         f.close()
 
 
-def wait_running(nc):
-    """Wait for running eventlet greenthreads.
+def merge_shards(config_dict, sources):
+    """Merges shard output trees and error reports into base_path.
+
+    Args:
+      config_dict: A dict, the PUNC configuration.
+      sources: A list of strings, the shard output base paths.
+    """
+    base_path = config_dict.get('base_path')
+    copied = punc.shard.merge_trees(sources, base_path)
+    logging.info('Merged %d files from %d shards', copied, len(sources))
+
+    error_report_path = config_dict.get('error_report_path')
+    if not error_report_path:
+        return
+    errors = {}
+    for source in sources:
+        path = os.path.join(source, error_report_path)
+        if not os.path.exists(path):
+            continue
+        f = open(path)
+        try:
+            shard_errors = punc.shard.parse_error_report(f.read())
+        finally:
+            f.close()
+        for device, device_errors in shard_errors.iteritems():
+            errors.setdefault(device, set()).update(device_errors)
+    if errors:
+        report = punc.collect.error_report(errors)
+        logging.error(report)
+        write_error_report(os.path.join(base_path, error_report_path), report)
+
+
+def wait_running(nc, scheduler=None, deadlines=None):
+    """Wait for running eventlet greenthreads and scheduled requests.
 
     Eventlet sometimes has running greenthreads after waitall() returns.
     This requires a greened time module (so as not to block the I/O loop).
+
+    With a deadline engine, we poll rather than wait on the Notch client,
+    so that overdue requests can be abandoned. Abandoned requests may
+    still be running when we return.
     """
-    while nc.num_requests_running:
+    if deadlines is not None:
+        while not scheduler.finished():
+            deadlines.check()
+            # Sends requests whose retry backoff has expired.
+            scheduler.dispatch()
+            time.sleep(0.5)
+        return
+    while nc.num_requests_running or (
+        scheduler is not None and not scheduler.finished()):
         nc.wait_all()
+        if scheduler is not None:
+            scheduler.dispatch()
         time.sleep(0.5)
 
 
+def run_collections(config_dict, collections, collator, scheduler, deadlines,
+                    history, fingerprints, nc=None, engine=None,
+                    result_cache=None):
+    """Runs collections to completion and writes their results.
+
+    Args:
+      config_dict: A dict, the PUNC configuration.
+      collections: A list of punc.collect.Collection objects.
+      collator: A punc.collect.Collator object for these collections.
+      scheduler: The punc.schedule.Scheduler of the collections.
+      deadlines: The punc.deadline.DeadlineEngine of the collections.
+      history: The punc.history.DurationHistory of the collections.
+      fingerprints: The punc.fingerprint.FingerprintStore of the
+        collections, or None.
+      nc: The notch.client.Connection of the collections.
+      engine: A punc.collect_async.AsyncEngine, or None to run the
+        collections with eventlet.
+      result_cache: The punc.result_cache.ResultCache of the collections,
+        or None.
+    """
+    for collection in collections:
+        collator.add_collection(collection)
+    if engine is not None:
+        engine.run(collections)
+    else:
+        for collection in collections:
+            collection.start()
+        scheduler.dispatch()
+
+        logging.debug('Collections started; waiting for remaining Notch '
+                      'callbacks.')
+        wait_running(nc, scheduler, deadlines)
+    history.save()
+    if result_cache is not None:
+        logging.info('Result cache: %d unchanged, %d parsed',
+                     result_cache.hits, result_cache.misses)
+        result_cache.hits = result_cache.misses = 0
+        result_cache.save()
+
+    logging.debug('Collating and writing output')
+    collator.collate()
+    if config_dict.get('base_path'):
+        # The files to merge, should this be the run of a shard.
+        punc.shard.save_written(config_dict.get('base_path'),
+                                collator.written)
+    if fingerprints is not None:
+        for collection in collections:
+            collection.update_fingerprints()
+        fingerprints.save()
+    logging.info(punc.collect.summary_report(collections))
+    errors = collator.errors()
+    if errors:
+        report = punc.collect.error_report(errors)
+        logging.error(report)
+        error_report_path = config_dict.get('error_report_path')
+        if error_report_path:
+            error_report_path = os.path.join(config_dict.get('base_path'),
+                                             error_report_path)
+            write_error_report(error_report_path, report)
+
+
+def run_daemon(options, config_dict, nc, build_collections, run):
+    """Runs PUNC as a daemon until it is terminated.
+
+    Args:
+      options: The command line options.
+      config_dict: A dict, the PUNC configuration.
+      nc: A notch.client.Connection object.
+      build_collections: A callable taking a list as returned by
+        punc.util.get_recipe_devices, returning a list of collections.
+      run: A callable taking a list of collections, which runs them and
+        writes their results.
+    """
+    repo = None
+    if options.commit:
+        repo = punc.rc_hg.MercurialRevisionControl(
+            config_dict.get('master_repo_path'), config_dict.get('base_path'))
+
+    def commit():
+        if repo is not None:
+            commit_changes(None, None, repo=repo)
+
+    daemon = punc.util.get_daemon(
+        config_dict,
+        lambda: punc.util.get_recipe_devices(options, config_dict, nc),
+        build_collections, run, commit)
+    signal.signal(signal.SIGTERM, lambda *unused_args: daemon.stop())
+    listener = punc.util.get_trigger(config_dict, daemon)
+    if listener is not None:
+        # Resolve triggering devices from the start.
+        daemon.refresh_inventory()
+        listener.start()
+    try:
+        daemon.run()
+    except KeyboardInterrupt:
+        logging.info('Interrupted')
+    if listener is not None:
+        listener.stop()
+
+
 def main(argv=None):
     start = time.time()
     argv = argv or sys.argv
@@ -105,38 +262,87 @@ def main(argv=None):
         logging.error('%s: %s', e.__class__.__name__, str(e))
         return 2
 
+    if options.base_path:
+        config_dict['base_path'] = options.base_path
+
+    if options.merge:
+        merge_shards(config_dict, options.merge)
+        if options.commit:
+            commit_changes(
+                config_dict.get('master_repo_path'),
+                config_dict.get('base_path'))
+        return 0
+
+    try:
+        punc.shard.parse_shard(options.shard)
+    except ValueError, e:
+        logging.error(str(e))
+        return 2
     else:
+        scheduler = punc.util.get_scheduler(options, config_dict, agents)
+        try:
+            engine = punc.util.get_async_engine(options, config_dict, agents,
+                                                scheduler)
+        except (ImportError, ValueError), e:
+            logging.error('Collector engine unavailable: %s', e)
+            return 2
+        parse_pool = None
+        if engine is None:
+            # Fork the parser processes before connecting to the agents.
+            parse_pool = punc.util.get_parse_pool(options, config_dict)
         nc = punc.util.get_notch_client(agents)
         if nc is None:
+            if parse_pool is not None:
+                parse_pool.close()
             return 3
-        collections = punc.util.build_collections(options, config_dict, nc)
-        collator = punc.collect.Collator()
+        deadlines = punc.deadline.DeadlineEngine()
+        history = punc.util.get_history(config_dict)
+        retry = punc.util.get_retry_policy(config_dict)
+        fingerprints = punc.util.get_fingerprints(options, config_dict)
+        result_cache = punc.util.get_result_cache(options, config_dict)
+        journal = None
+        if not options.daemon:
+            journal = punc.util.get_journal(options, config_dict)
 
-    logging.info('Starting network element backup')
+    def build_collections(recipe_devices=None):
+        return punc.util.build_collections(options, config_dict, nc,
+                                           scheduler=scheduler,
+                                           deadlines=deadlines,
+                                           history=history,
+                                           retry=retry,
+                                           fingerprints=fingerprints,
+                                           parse_pool=parse_pool,
+                                           journal=journal,
+                                           result_cache=result_cache,
+                                           recipe_devices=recipe_devices)
 
-    for collection in collections:
-        collection.start()
+    def run(collections):
+        run_collections(config_dict, collections,
+                        punc.util.get_collator(options, config_dict),
+                        scheduler, deadlines, history, fingerprints,
+                        nc=nc, engine=engine, result_cache=result_cache)
 
-    logging.debug('Collections done; waiting for remaining Notch callbacks.')
-    wait_running(nc)
-    
-    for collection in collections:
-        collator.add_collection(collection)
-    logging.debug('Collating and writing output')
-    collator.collate()
-    errors = collator.errors()
-    if errors:
-        report = punc.collect.error_report(errors)
-        logging.error(report)
-        error_report_path = config_dict.get('error_report_path')
-        if error_report_path:
-            error_report_path = os.path.join(config_dict.get('base_path'),
-                                             error_report_path)
-            write_error_report(error_report_path, report)
-
-    commit_changes(
-        config_dict.get('master_repo_path'),
-        config_dict.get('base_path'))
+    try:
+        if options.daemon:
+            run_daemon(options, config_dict, nc, build_collections, run)
+        else:
+            logging.info('Starting network element backup')
+            run(build_collections())
+            if options.commit:
+                commit_changes(
+                    config_dict.get('master_repo_path'),
+                    config_dict.get('base_path'))
+            if journal is not None:
+                # The run is complete; there is nothing to resume.
+                journal.remove()
+    finally:
+        if engine is not None:
+            engine.close()
+        if parse_pool is not None:
+            parse_pool.close()
+        if journal is not None:
+            # Writes the records still queued, should the run be resumed.
+            journal.close()
 
     logging.info('PUNC finished in %.2f seconds',
                   time.time() - start)
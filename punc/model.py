@@ -73,7 +73,11 @@ class Result(object):
       result: A notch.client.Request object, the Notch request/result object.
       key: Any hashable/sortable object, used to determine the output order.
       output: A string, the result data (or None if the result is not complete).
-      status: An int [0..3], the result status. See STATUS_* class constants.
+      status: An int [0..4], the result status. See STATUS_* class constants.
+      error: A string or None, an error message for results which failed
+        without a Notch error (e.g., timeouts).
+      cached: A boolean, True if the output was taken from the result cache
+        (the raw result being the same as in the last run).
     """
 
     # Integer constants representing the value of the status attribute.
@@ -86,18 +90,24 @@ class Result(object):
     # The result is not an error, but any result should not be
     # included in output.
     STATUS_IGNORE = 3
+    # The request was abandoned after its command or collection timeout.
+    STATUS_TIMEOUT = 4
 
     _STATUSES = {0: 'STATUS_PENDING',
                  1: 'STATUS_OK',
                  2: 'STATUS_ERROR',
-                 3: 'STATUS_IGNORE'}
+                 3: 'STATUS_IGNORE',
+                 4: 'STATUS_TIMEOUT'}
 
-    def __init__(self, rule, result, key, output=None, status=0):
+    def __init__(self, rule, result, key, output=None, status=0, error=None,
+                 cached=False):
         self.rule = rule
         self.result = result
         self.key = key
         self.output = output
         self.status = status
+        self.error = error
+        self.cached = cached
 
     def __repr__(self):
         return ('%s(rule=%r, key=%r, length=%d, status=%s.%s)' %
@@ -112,10 +122,14 @@ class Result(object):
     def device_name(self):
         return self.result.arguments.get('device_name')
 
+    def failed(self):
+        """Returns True if the result is an error or timed out."""
+        return self.status in (self.STATUS_ERROR, self.STATUS_TIMEOUT)
+
     def error_message(self):
         """Returns the error message from the result, or None if no error."""
         if self.result.error is None:
-            return None
+            return self.error
         else:
             try:
                 # ProtocolError can be both a string and a tuple....
@@ -139,6 +153,9 @@ class Rule(object):
       actions: A list of Action objects, the actions in this rule.
       target: A Target object, where to write the results of this Rule.
         If None, the Ruleset Target or finally default Target is used.
+      independent: A boolean. If True, the rule does not depend on the
+        other rules of its ruleset, and may run concurrently with them.
+        Actions within a rule always run in order.
     """
 
     # How a rule's actions results are handled.
@@ -154,11 +171,13 @@ class Rule(object):
                         3: 'HANDLE_FIRST_OR_ALL_OTHERS',
                         }
 
-    def __init__(self, actions=None, handling=None, target=None):
+    def __init__(self, actions=None, handling=None, target=None,
+                 independent=False):
         self.handling = handling or self.HANDLE_ALL_REQUIRED
         self.actions = actions or []
         self._action_status = []
         self.target = target
+        self.independent = independent
 
         # A dictionary of flags, per device, used to serialise
         # requests on an individual device name basis.
@@ -166,12 +185,12 @@ class Rule(object):
         self._stopped = False
 
     def __repr__(self):
-        return ('%s(actions=%r, handling=%s, target=%r)' %
+        return ('%s(actions=%r, handling=%s, target=%r, independent=%r)' %
                 (self.__class__.__name__,
                  self.actions,
                  '%s.%s' % (self.__class__.__name__,
                             self._RESULT_HANDLING[self.handling]),
-                 self.target))
+                 self.target, self.independent))
 
     @property
     def first_action_passed(self):
@@ -232,16 +251,62 @@ class Ruleset(object):
         """Returns a list of rules, over-ridden by concrete subclasses."""
         return []
 
+    def fingerprint(self):
+        """Returns an Action producing a cheap configuration fingerprint.
+
+        Concrete subclasses may over-ride this to return an Action whose
+        (parsed) output changes whenever the device configuration changes,
+        such as the time of the last configuration change or a commit id.
+        If the fingerprint matches the last successful collection, the
+        device's rules are skipped.
+
+        Returns:
+          An Action, or None if the ruleset has no fingerprint.
+        """
+        return None
+
+    def fingerprint_request(self, device):
+        """Returns the fingerprint request for a device, or None."""
+        action = self.fingerprint()
+        if action is None:
+            return None
+        return self._rule_requests(Rule([action]), device)[0]
+
+    def _rule_requests(self, rule, device):
+        """Returns the requests of a rule for an individual device."""
+        req_list = []
+        for request in rule.request_list():
+            r = copy.copy(request)
+            r.arguments['device_name'] = device
+            req_list.append(r)
+        return req_list
+
     def requests(self, device):
         """Returns all requests in the Ruleset for an individual device."""
         req_list = []
         for rule in self.rules():
-            for request in rule.request_list():
-                r = copy.copy(request)
-                r.arguments['device_name'] = device
-                req_list.append(r)
+            req_list.extend(self._rule_requests(rule, device))
         return req_list
 
+    def request_chains(self, device):
+        """Returns a device's requests as chains which may run concurrently.
+
+        The first chain holds the requests of all dependent rules, in order.
+        Each independent rule's requests form a chain of their own. The
+        requests within a chain must be sent one after another.
+
+        Returns:
+          A list of non-empty lists of notch.client.Request objects.
+        """
+        dependent = []
+        chains = [dependent]
+        for rule in self.rules():
+            if rule.independent:
+                chains.append(self._rule_requests(rule, device))
+            else:
+                dependent.extend(self._rule_requests(rule, device))
+        return [chain for chain in chains if chain]
+
 
 class Target(object):
     """A collection target template.
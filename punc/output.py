@@ -0,0 +1,171 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# Copyright 2010 Andrew Fort
+
+"""PUNC's output files, replaced atomically and only when changed."""
+
+
+import errno
+import hashlib
+import os
+
+
+# Size of the pieces existing files are read in.
+READ_SIZE = 65536
+
+
+def make_dirs(path, mode=0777):
+    """Creates a directory and its parents, unless it already exists.
+
+    Unlike os.makedirs, it does not fail if another thread or process
+    creates the directory at the same time.
+    """
+    try:
+        os.makedirs(path, mode)
+    except OSError, e:
+        if e.errno != errno.EEXIST or not os.path.isdir(path):
+            raise
+
+
+class OutputFile(object):
+    """A file object replacing a file's content atomically, if changed.
+
+    Output written is compared with the file's current content as it is
+    written, and nothing is written to disk while the two are the same. If
+    the output turns out to differ, it is written to a temporary dot file
+    beside the file (ignored by the revision control system, should a run
+    be interrupted), which is synced and renamed over the file when closed.
+    An unchanged file is only read, and is left as it is, with its mtime.
+    Readers of the file never see partially written content.
+
+    Attributes:
+      name: A string, the path of the file.
+      mode: A string, the mode the temporary file is opened with.
+      closed: A boolean, True once the file is closed.
+      changed: A boolean or None; once closed, True if the file was
+        replaced, False if its content was unchanged.
+    """
+
+    def __init__(self, name, mode='w', append=False, keep=False):
+        """Initialiser.
+
+        Args:
+          name: A string, the path of the file.
+          mode: A string, 'w' or 'wb'.
+          append: A boolean. If True, start with the file's current content.
+          keep: A boolean. If True, keep the content written in memory, as
+            the data attribute.
+        """
+        self.name = name
+        self.mode = mode
+        self.closed = False
+        self.changed = None
+        self._pieces = None
+        if keep:
+            self._pieces = []
+        dirname, basename = os.path.split(name)
+        self._tmp_path = os.path.join(dirname, '.%s.tmp' % basename)
+        self._digest = hashlib.sha1()
+        self._size = 0
+        # The temporary file, once the output differs from the file.
+        self._file = None
+        # The file's current content, while the output is the same.
+        self._current = None
+        try:
+            self._current = open(name, self._read_mode)
+        except IOError:
+            pass
+        if append and self._current is not None:
+            f = open(name, self._read_mode)
+            try:
+                while True:
+                    data = f.read(READ_SIZE)
+                    if not data:
+                        break
+                    self.write(data)
+            finally:
+                f.close()
+
+    def __repr__(self):
+        return '%s(%r, mode=%r)' % (self.__class__.__name__, self.name,
+                                    self.mode)
+
+    @property
+    def _read_mode(self):
+        return 'r' + self.mode.replace('w', '').replace('a', '')
+
+    @property
+    def digest(self):
+        """The sha1 hex digest of the content written."""
+        return self._digest.hexdigest()
+
+    @property
+    def data(self):
+        """The content written, if kept, else None."""
+        if self._pieces is None:
+            return None
+        return ''.join([str(piece) for piece in self._pieces])
+
+    def _diverge(self):
+        """Starts the temporary file, with the output found to be the same."""
+        self._file = open(self._tmp_path, self.mode)
+        if self._current is None:
+            return
+        try:
+            matched = self._size
+            self._current.seek(0)
+            while matched:
+                data = self._current.read(min(matched, READ_SIZE))
+                if not data:
+                    break
+                self._file.write(data)
+                matched -= len(data)
+        finally:
+            self._current.close()
+            self._current = None
+
+    def write(self, data):
+        if self._pieces is not None:
+            self._pieces.append(data)
+        if self._file is None:
+            if self._current is not None:
+                data = str(data)
+                if self._current.read(len(data)) == data:
+                    self._digest.update(data)
+                    self._size += len(data)
+                    return
+            self._diverge()
+        self._file.write(data)
+        self._digest.update(data)
+        self._size += len(data)
+
+    def close(self):
+        """Replaces the file with the output written, if it has changed."""
+        if self.closed:
+            return
+        self.closed = True
+        if self._file is None:
+            if self._current is not None and not self._current.read(1):
+                # The output is the file's whole content.
+                self._current.close()
+                self._current = None
+                self.changed = False
+                return
+            self._diverge()
+        try:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        finally:
+            self._file.close()
+        os.rename(self._tmp_path, self.name)
+        self.changed = True
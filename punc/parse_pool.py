@@ -0,0 +1,107 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# Copyright 2010 Andrew Fort
+
+"""Parsing of request results, inline or in a pool of processes."""
+
+
+import logging
+import multiprocessing
+
+import eventlet
+import eventlet.tpool
+
+import punc.model
+import punc.parser
+
+
+def parse_result(parser, data):
+    """Parses a request result.
+
+    Args:
+      parser: A punc.parser.Parser subclass, or None to use the data as is.
+      data: A string, the request result.
+
+    Returns:
+      A tuple (status, output); status is a punc.model.Result status.
+    """
+    try:
+        if parser is not None:
+            output = parser(data).parse()
+        else:
+            output = data
+        return punc.model.Result.STATUS_OK, output
+    except punc.parser.SkipResult:
+        return punc.model.Result.STATUS_IGNORE, None
+    except punc.parser.DeviceReportedError:
+        return punc.model.Result.STATUS_ERROR, None
+
+
+class ParsePool(object):
+    """Runs result parsers off the eventlet hub.
+
+    Parsing a large result inline in a Notch callback blocks the I/O of
+    every other request in flight. Results of at least threshold bytes are
+    parsed in a pool of worker processes; a greenthread waits for each,
+    then hands the parsed result back. Smaller results are parsed inline,
+    where parsing is cheaper than the round trip to a worker.
+
+    Attributes:
+      processes: An int, the number of worker processes (0 parses inline).
+      threshold: An int, the result size in bytes from which results are
+        parsed in a worker.
+    """
+
+    def __init__(self, processes=0, threshold=262144):
+        self.processes = processes or 0
+        self.threshold = threshold
+        self._pool = None
+        if self.processes:
+            self._pool = multiprocessing.Pool(self.processes)
+
+    def __repr__(self):
+        return ('%s(processes=%r, threshold=%r)' %
+                (self.__class__.__name__, self.processes, self.threshold))
+
+    def submit(self, parser, data, callback):
+        """Parses a request result, calling back with the parsed result.
+
+        Args:
+          parser: A punc.parser.Parser subclass, or None.
+          data: A string, the request result.
+          callback: A callable, called with (status, output) once parsed.
+            The callback is called with punc.model.Result.STATUS_PENDING if
+            the parser raised an unexpected exception.
+        """
+        if self._pool is None or parser is None or len(data) < self.threshold:
+            self._complete(callback, parse_result, parser, data)
+        else:
+            async_result = self._pool.apply_async(parse_result,
+                                                  (parser, data))
+            eventlet.spawn_n(self._complete, callback,
+                             eventlet.tpool.execute, async_result.get)
+
+    def _complete(self, callback, func, *args):
+        status, output = punc.model.Result.STATUS_PENDING, None
+        try:
+            status, output = func(*args)
+        finally:
+            callback(status, output)
+
+    def close(self):
+        """Waits for outstanding parses and stops the worker processes."""
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+            logging.debug('Parse pool closed')
@@ -14,7 +14,10 @@
 
 """PUNC's library of text parsing routines."""
 
+import hashlib
 import re
+import sre_constants
+import sre_parse
 
 
 BLANK_LINE = re.compile(r'^\s*$')
@@ -32,50 +35,390 @@ class SkipResult(Error):
     """The parser indicates that the result should be ignored."""
 
 
+# Size of the pieces a text string input is split into lines from.
+CHUNK_SIZE = 65536
+
+
+def iter_chunks(input_data, chunk_size=CHUNK_SIZE):
+    """Yields the input as strings of text.
+
+    Args:
+      input_data: A string, or an iterable of strings (e.g., a file object,
+        or arbitrary chunks of the text).
+      chunk_size: An int, the size of the pieces a string is yielded in.
+    """
+    if isinstance(input_data, basestring):
+        for i in xrange(0, len(input_data), chunk_size):
+            yield input_data[i:i + chunk_size]
+    else:
+        for chunk in input_data:
+            yield chunk
+
+
+def iter_line_lists(input_data):
+    """Yields lists of the lines of the input, without their newlines.
+
+    Together, the lists hold the lines of input_data.split('\n'), but
+    only a chunk of the input is split at a time.
+
+    Args:
+      input_data: A string, or an iterable of strings, see iter_chunks.
+    """
+    pending = ''
+    for chunk in iter_chunks(input_data):
+        lines = chunk.split('\n')
+        if pending:
+            lines[0] = pending + lines[0]
+        pending = lines.pop()
+        if lines:
+            yield lines
+    yield [pending]
+
+
+def iter_lines(input_data):
+    """Yields the lines of the input, without their newlines.
+
+    Args:
+      input_data: A string, or an iterable of strings, see iter_chunks.
+    """
+    for lines in iter_line_lists(input_data):
+        for line in lines:
+            yield line
+
+
 class Parser(object):
-    """A PUNC parser."""
+    """A PUNC parser.
+
+    The input is split into lines a chunk at a time as it is parsed, rather
+    than all at once, and may be given as an iterable of strings.
+
+    Attributes:
+      VERSION: An int. Increment it when a parser's behaviour changes, so
+        results cached from the previous version are parsed again.
+    """
+
+    VERSION = 1
 
     def __init__(self, input_data):
         """Parser object.
 
         Args:
-          input_data: The input as a 'text string' (w/embedded newlines).
+          input_data: The input as a 'text string' (w/embedded newlines), or
+            an iterable of strings such as a file object or chunks of the
+            text. An iterable can only be parsed once.
         """
         self._input_data = input_data
-        self.input = input_data.split('\n')
+        self._input = None
+
+    @property
+    def input(self):
+        """A list of the input lines, split from the input when first used."""
+        if self._input is None:
+            self._input = list(self.lines())
+        return self._input
+
+    @input.setter
+    def input(self, value):
+        self._input = value
+
+    def lines(self):
+        """Returns an iterator over the input lines, without newlines."""
+        if self._input is not None:
+            return iter(self._input)
+        return iter_lines(self._input_data)
+
+    def line_lists(self):
+        """Returns an iterator over lists of the input lines, in order."""
+        if self._input is not None:
+            return iter([self._input])
+        return iter_line_lists(self._input_data)
+
+    @classmethod
+    def version(cls):
+        """Returns a string identifying the parser and its version."""
+        return '%s.%s/%d' % (cls.__module__, cls.__name__, cls.VERSION)
 
     def parse(self):
         """Clients should call this method."""
         return self._parse()
 
     def _parse(self):
-        """Subclasses should override this method to parse."""
-        # Return what we were provided.
-        return '\n'.join(self.input)
+        """Subclasses should override this method (or _stream) to parse."""
+        # Return what we were provided, without splitting a string into lines.
+        if self._input is None and isinstance(self._input_data, basestring):
+            return self._input_data
+        return '\n'.join(self.lines())
+
+    def _stream(self):
+        """Returns an iterator over the parsed output, in pieces."""
+        yield self._parse()
 
 
 class NullParser(Parser):
     """A do-nothing parser for binary results."""
 
-    def __init__(self, input_data):
-        self._input_data = input_data
-
     def _parse(self):
-        return self._input_data
+        if isinstance(self._input_data, basestring):
+            return self._input_data
+        return ''.join(self._stream())
+
+    def _stream(self):
+        return iter_chunks(self._input_data)
+
+
+def _anchored(regexp):
+    """Returns the parsed regexp without a leading ^, or None if unanchored.
+
+    Returns:
+      A list of (opcode, argument) tuples from sre_parse, or None.
+    """
+    if not isinstance(regexp.pattern, str):
+        return None
+    try:
+        parsed = list(sre_parse.parse(regexp.pattern, regexp.flags))
+    except (sre_constants.error, TypeError):
+        return None
+    if parsed and (parsed[0] == (sre_constants.AT,
+                                 sre_constants.AT_BEGINNING_STRING) or
+                   (parsed[0] == (sre_constants.AT,
+                                  sre_constants.AT_BEGINNING) and
+                    not regexp.flags & re.MULTILINE)):
+        return parsed[1:]
+    return None
+
+
+def _literal(regexp):
+    """Returns the literal string a compiled regexp searches for, if any.
+
+    Returns:
+      A tuple (anchored, literal), anchored being True if the regexp only
+      matches at the start of the string; or None if the regexp is not a
+      (case sensitive) literal string.
+    """
+    if not isinstance(regexp.pattern, str) or regexp.flags & re.IGNORECASE:
+        return None
+    parsed = _anchored(regexp)
+    anchored = parsed is not None
+    if not anchored:
+        try:
+            parsed = list(sre_parse.parse(regexp.pattern, regexp.flags))
+        except (sre_constants.error, TypeError):
+            return None
+    chars = []
+    for op, av in parsed:
+        if op != sre_constants.LITERAL:
+            return None
+        chars.append(chr(av))
+    return anchored, ''.join(chars)
+
+
+class _Matcher(object):
+    """Tests whether any of a sequence of compiled regexps matches a line.
+
+    Anchored literal patterns are tested with str.startswith and other
+    literal patterns with the in operator. Other anchored patterns are
+    combined into one alternation (per set of regexp flags) tried only at
+    the start of the line. Unanchored patterns are searched for one by one,
+    as an alternation of them would defeat the regexp engine's scan for
+    each pattern's literal prefix.
+    """
+
+    def __init__(self, regexps):
+        self.regexps = tuple(regexps)
+        prefixes = []
+        substrings = []
+        anchored = {}
+        searches = []
+        for regexp in self.regexps:
+            literal = _literal(regexp)
+            if literal is not None:
+                if literal[0]:
+                    prefixes.append(literal[1])
+                else:
+                    substrings.append(literal[1])
+            elif _anchored(regexp) is not None and not regexp.groups:
+                anchored.setdefault(regexp.flags, []).append(regexp)
+            else:
+                searches.append(regexp.search)
+        matches = []
+        for flags in sorted(anchored):
+            matches.extend(_combine(anchored[flags], flags))
+        self._prefixes = tuple(prefixes)
+        self._substrings = tuple(substrings)
+        self._matches = tuple([regexp.match for regexp in matches])
+        self._searches = tuple(searches)
+
+    def __len__(self):
+        return len(self.regexps)
+
+    def search(self, line):
+        """Returns True if any of the regexps matches the line."""
+        if self._prefixes and line.startswith(self._prefixes):
+            return True
+        for substring in self._substrings:
+            if substring in line:
+                return True
+        for match in self._matches:
+            if match(line):
+                return True
+        for search in self._searches:
+            if search(line):
+                return True
+        return False
+
+
+def _combine(regexps, flags):
+    """Returns a list of regexps equivalent to matching with any of them."""
+    if len(regexps) < 2 or flags & re.VERBOSE:
+        return regexps
+    try:
+        return [re.compile('|'.join(['(?:%s)' % r.pattern for r in regexps]),
+                           flags)]
+    except (re.error, AssertionError, OverflowError):
+        return regexps
+
+
+class Block(object):
+    """A section of AddDropParser input handled as a unit.
+
+    A block begins with a line matching start and ends with the next line
+    matching end, which may be the start line itself (after the start
+    match). Lines within a block are not checked against the parser's other
+    regexps; the whole block is passed through, dropped or replaced.
+
+    Attributes:
+      start: A compiled regexp, searched for in each line.
+      end: A compiled regexp, searched for in the lines of the block.
+      policy: A string, one of the class constants PASS (copy the block's
+        lines to the output, as they are), DROP (skip the block) or
+        SUBSTITUTE (output replacement instead of the block).
+      replacement: A string, the output of a SUBSTITUTE block.
+    """
+
+    PASS = 'pass'
+    DROP = 'drop'
+    SUBSTITUTE = 'substitute'
+
+    def __init__(self, start, end, policy=PASS, replacement=''):
+        if policy not in (self.PASS, self.DROP, self.SUBSTITUTE):
+            raise ValueError('Unknown block policy %r' % policy)
+        self.start = start
+        self.end = end
+        self.policy = policy
+        self.replacement = replacement
+
+    def __repr__(self):
+        return ('%s(%r, %r, policy=%r, replacement=%r)' %
+                (self.__class__.__name__, self.start.pattern,
+                 self.end.pattern, self.policy, self.replacement))
+
+    def begin(self, line, match, result, comment=''):
+        """Handles the start line of the block.
+
+        Args:
+          line: A string, the start line.
+          match: The start regexp's match object for the line.
+          result: A list, to which output lines are appended.
+          comment: A string, the prefix of each output line.
+
+        Returns:
+          A boolean, True if the block continues after this line.
+        """
+        if self.policy == self.PASS:
+            result.append(comment + line)
+        elif self.policy == self.SUBSTITUTE:
+            result.extend([comment + l for l in self.replacement.split('\n')])
+        return not self.end.search(line, match.end())
+
+    def copy(self, lines, result, comment=''):
+        """Consumes lines of the block, up to and including its end.
+
+        Args:
+          lines: An iterator over the input lines following those consumed.
+          result: A list, to which output lines are appended.
+          comment: A string, the prefix of each output line.
+
+        Returns:
+          A boolean, True if the lines ran out before the end of the block.
+        """
+        end = self.end.search
+        if self.policy == self.PASS:
+            for line in lines:
+                result.append(comment + line)
+                if end(line):
+                    return False
+        else:
+            for line in lines:
+                if end(line):
+                    return False
+        return True
+
+
+class _AddDropParserType(type):
+    """Compiles the regexps of an AddDropParser class when it is defined."""
+
+    def __init__(cls, name, bases, namespace):
+        super(_AddDropParserType, cls).__init__(name, bases, namespace)
+        cls._inc_matcher = _Matcher(cls.INC_RE)
+        # (flag_ignore, flag_error, flag_drop, flag_blocks) ->
+        #   (screen, raises)
+        cls._screens = {}
+        cls._version = None
+
+    def _screens_for(cls, ignore, error, drop, blocks=()):
+        """Returns _Matchers of the line classifying regexps enabled.
+
+        Returns:
+          A tuple (screen, raises). Lines not matching screen are neither
+          block starts, ignored, errors nor dropped; lines matching screen
+          but neither a block start nor raises are dropped. Either is None
+          if it has no regexps.
+        """
+        key = (bool(ignore), bool(error), bool(drop), bool(blocks))
+        if key not in cls._screens:
+            raises = []
+            if ignore:
+                raises.extend(cls.IGNORE_RE)
+            if error:
+                raises.extend(cls.ERROR_RE)
+            regexps = list(raises)
+            if drop:
+                regexps.extend(cls.DROP_RE)
+            if blocks:
+                regexps.extend([b.start for b in cls.BLOCKS])
+            cls._screens[key] = (regexps and _Matcher(regexps) or None,
+                                 raises and _Matcher(raises) or None)
+        return cls._screens[key]
 
 
 class AddDropParser(Parser):
     """A text parser that has keep to drop lines based on regexps.
 
     Also allows for substitutions for trimming noisy/unwanted output.
+
+    The regexps of each subclass are compiled when it is defined, and only
+    those enabled by the flags are searched for, so most lines are kept
+    after a single pass over them. Lines which match are checked against
+    the individual regexps, in the order given.
+
+    Bulk sections needing no line by line filtering (e.g., certificates or
+    banners) may be declared as BLOCKS, a tuple of Block objects. Only a
+    block's end regexp is searched for within it. Blocks are found before
+    any other regexp is applied to a line.
     """
 
+    __metaclass__ = _AddDropParserType
+
+    VERSION = 2
+
     INC_RE = tuple()
     DROP_RE = tuple()
     IGNORE_RE = tuple()
     ERROR_RE = tuple()
     SUBST_RE = tuple()
+    BLOCKS = tuple()
 
+    flag_blocks = True
     flag_drop = True
     flag_inc = True
     flag_ignore = True
@@ -85,52 +428,113 @@ class AddDropParser(Parser):
     commented = False
     comment = ''
 
+    @classmethod
+    def version(cls):
+        """Returns a string identifying the parser and its version.
+
+        The version includes a digest of the class's regexps and options,
+        so it changes whenever they are edited.
+        """
+        if cls._version is None:
+            definition = [(r.pattern, r.flags) for r in
+                          cls.INC_RE + cls.DROP_RE + cls.IGNORE_RE +
+                          cls.ERROR_RE]
+            definition.extend([(r.pattern, r.flags, repl)
+                               for r, repl in cls.SUBST_RE])
+            definition.extend([repr(b) for b in cls.BLOCKS])
+            definition.extend([cls.flag_blocks, cls.flag_drop, cls.flag_inc,
+                               cls.flag_ignore, cls.flag_error,
+                               cls.flag_trailing_blank, cls.flag_substitute,
+                               cls.commented, cls.comment])
+            cls._version = '%s-%s' % (
+                super(AddDropParser, cls).version(),
+                hashlib.md5(repr(definition)).hexdigest()[:12])
+        return cls._version
+
     def _parse(self):
         """Parses the text block."""
-        result = []
+        return ''.join(self._stream())
+
+    def _stream(self):
+        """Parses the text block, yielding the output as it is kept.
+
+        The output lines kept from each chunk of the input are yielded
+        together, after the newline preceding them.
+        """
         if self.commented:
             comment = self.comment
         else:
             comment = ''
+        # The newline before the next output.
+        sep = ''
+
+        ignore = self.flag_ignore and self.IGNORE_RE
+        error = self.flag_error and self.ERROR_RE
+        inc = self.flag_inc and self.INC_RE
+        # Included lines are kept whether or not they would be dropped.
+        drop = self.flag_drop and not inc and self.DROP_RE
+        substitute = self.flag_substitute and self.SUBST_RE
+        blocks = self.flag_blocks and self.BLOCKS
+        screen, raises = self.__class__._screens_for(ignore, error, drop,
+                                                     blocks)
+        inc_matcher = self._inc_matcher
+        # The block continuing from the previous list of lines, if any.
+        block = None
+
+        for lines in self.line_lists():
+            result = []
+            lines = iter(lines)
+            if block is not None and not block.copy(lines, result, comment):
+                block = None
+            for line in lines:
+                dropped = False
+                if screen is not None and screen.search(line):
+                    if blocks:
+                        for block in blocks:
+                            m = block.start.search(line)
+                            if m:
+                                break
+                        else:
+                            block = None
+                        if block is not None:
+                            if not (block.begin(line, m, result, comment) and
+                                    block.copy(lines, result, comment)):
+                                block = None
+                            continue
+                    if raises is not None and raises.search(line):
+                        if ignore:
+                            for reg in ignore:
+                                m = reg.search(line)
+                                if m:
+                                    raise SkipResult(m.group(0))
+                        if error:
+                            for reg in error:
+                                m = reg.search(line)
+                                if m:
+                                    raise DeviceReportedError(
+                                        'Error from device: %s' % m.group(0))
+                    # Matched a drop line, so just skip it.
+                    dropped = True
 
-        for line in self.input:
-            dropped = False
-            if self.flag_ignore:
-                for reg in self.IGNORE_RE:
-                    m = reg.search(line)
-                    if m:
-                        raise SkipResult(m.group(0))
-            if self.flag_error:
-                for reg in self.ERROR_RE:
-                    m = reg.search(line)
-                    if m:
-                        raise DeviceReportedError('Error from device: %s' %
-                                                  m.group(0))
-            if self.flag_drop:
-                for reg in self.DROP_RE:
-                    if reg.search(line):
-                        # Matched a drop line, so just skip it.
-                        dropped = True
-                        break
-
-            if self.flag_substitute:
-                for (reg, repl) in self.SUBST_RE:
-                    line = reg.sub(repl, line)
-                    
-            if len(self.INC_RE) and self.flag_inc:
-                for reg in self.INC_RE:
-                    m = reg.search(comment + line)
-                    if m:
+                if substitute:
+                    for (reg, repl) in substitute:
+                        line = reg.sub(repl, line)
+
+                if inc:
+                    if inc_matcher.search(comment + line):
+                        # Lines are kept once for each regexp they match.
+                        for reg in inc:
+                            if reg.search(comment + line):
+                                result.append(comment + line)
+                elif not dropped:
+                    if line:
                         result.append(comment + line)
-            elif not dropped:
-                if line:
-                    result.append(comment + line)
+            if result:
+                yield sep + '\n'.join(result)
+                sep = '\n'
 
-        result = '\n'.join(result)
         if self.flag_trailing_blank:
             if self.comment:
-                return result + '\n%s\n' % self.comment
+                yield '\n%s\n' % self.comment
             else:
-                return result + '\n'
-        else:
-            return result
+                yield '\n'
@@ -0,0 +1,211 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# Copyright 2010 Andrew Fort
+
+"""PUNC's cache of parsed results, keyed by the digest of the raw result."""
+
+
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+
+import punc.output
+import punc.state
+
+
+def digest(data):
+    """Returns the hex digest identifying a raw result."""
+    return hashlib.sha1(data).hexdigest()
+
+
+class ResultCache(punc.state.StateFile):
+    """The parsed outputs of the last run's results.
+
+    For each device and action, the index records the digest of the raw
+    result, the version of the parser, the parse status and the name of
+    the parsed output's file. Outputs are kept in files named by the digest
+    of their content, so outputs are not held in memory, and a file is
+    never rewritten while the saved index may refer to it: should a run be
+    interrupted before the index is saved, the previous index still finds
+    the outputs it recorded. Files no longer in the index are removed when
+    it is saved. When a device returns the same raw result to an unchanged
+    parser, the cached output is used rather than parsing the result again.
+
+    Results may be looked up and cached from several threads at once, so
+    the cache's files are read and written off the eventlet hub.
+
+    Attributes:
+      directory: A string or None, the cache directory. If None, nothing
+        is cached.
+      refresh: A boolean. If True, nothing is found in the cache, but new
+        results are still cached.
+      hits: An int, the number of results found in the cache.
+      misses: An int, the number of results not found in the cache.
+    """
+
+    INDEX = 'index'
+
+    def __init__(self, directory=None, refresh=False):
+        path = None
+        if directory:
+            path = os.path.join(directory, self.INDEX)
+        super(ResultCache, self).__init__(path)
+        self.directory = directory
+        self.refresh = refresh
+        self.hits = 0
+        self.misses = 0
+        # Guards the index and the counts.
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return ('%s(directory=%r, refresh=%r)' %
+                (self.__class__.__name__, self.directory, self.refresh))
+
+    def _output_path(self, output_name):
+        return os.path.join(self.directory, output_name)
+
+    def _count(self, hit):
+        self._lock.acquire()
+        try:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        finally:
+            self._lock.release()
+
+    def get(self, device, action_name, parser_version, result_digest):
+        """Returns the cached parse of a raw result, or None.
+
+        Args:
+          device: A string, the device name.
+          action_name: A string, the action's name (see
+            history.DurationHistory.action_name).
+          parser_version: A string, the parser's version().
+          result_digest: A string, the digest() of the raw result.
+
+        Returns:
+          A tuple (status, output), or None if not cached.
+        """
+        self._lock.acquire()
+        try:
+            entry = self._data.get(device, {}).get(action_name)
+        finally:
+            self._lock.release()
+        if (self.refresh or entry is None or
+            entry[:2] != [result_digest, parser_version]):
+            self._count(False)
+            return None
+        status, output_name, output = entry[2], entry[3], None
+        if output_name is not None:
+            if not isinstance(output_name, basestring):
+                # An entry of an older cache format.
+                self._count(False)
+                return None
+            try:
+                f = open(self._output_path(output_name), 'rb')
+                try:
+                    output = f.read()
+                finally:
+                    f.close()
+            except (OSError, IOError), e:
+                logging.warning('Could not read cached result for %s. %s: %s',
+                                device, e.__class__.__name__, str(e))
+                self._count(False)
+                return None
+            if digest(output) != output_name:
+                logging.warning('Ignoring corrupt cached result for %s',
+                                device)
+                self._count(False)
+                return None
+        self._count(True)
+        return status, output
+
+    def put(self, device, action_name, parser_version, result_digest,
+            status, output):
+        """Caches the parse of a raw result.
+
+        Args:
+          device: A string, the device name.
+          action_name: A string, the action's name.
+          parser_version: A string, the parser's version().
+          result_digest: A string, the digest() of the raw result.
+          status: An int, the punc.model.Result status of the parse.
+          output: A string or None, the parsed output.
+        """
+        if not self.directory:
+            return
+        output_name = None
+        if output is not None:
+            output_name = digest(output)
+        entry = [result_digest, parser_version, status, output_name]
+        self._lock.acquire()
+        try:
+            if self._data.get(device, {}).get(action_name) == entry:
+                return
+        finally:
+            self._lock.release()
+        if output_name is not None:
+            path = self._output_path(output_name)
+            try:
+                if not os.path.exists(path):
+                    punc.output.make_dirs(self.directory)
+                    # Each put writes a file of its own; should the same
+                    # output be cached concurrently, the last rename wins.
+                    fd, tmp_path = tempfile.mkstemp(
+                        dir=self.directory, prefix='.%s.' % output_name,
+                        suffix='.tmp')
+                    f = os.fdopen(fd, 'wb')
+                    try:
+                        f.write(output)
+                    finally:
+                        f.close()
+                    os.rename(tmp_path, path)
+            except (OSError, IOError), e:
+                logging.error('Could not cache result for %s. %s: %s',
+                              device, e.__class__.__name__, str(e))
+                self.discard(device, action_name)
+                return
+        self._lock.acquire()
+        try:
+            self._data.setdefault(device, {})[action_name] = entry
+        finally:
+            self._lock.release()
+
+    def discard(self, device, action_name):
+        """Forgets the cached parse of a device's action, if any."""
+        self._lock.acquire()
+        try:
+            self._data.get(device, {}).pop(action_name, None)
+        finally:
+            self._lock.release()
+
+    def save(self):
+        """Saves the index, then removes the outputs it does not refer to."""
+        super(ResultCache, self).save()
+        if not self.directory or not os.path.exists(self.directory):
+            return
+        referenced = set([self.INDEX])
+        for actions in self._data.itervalues():
+            for entry in actions.itervalues():
+                referenced.add(entry[3])
+        for name in os.listdir(self.directory):
+            if name not in referenced:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError, e:
+                    logging.warning('Could not remove cached result %r. '
+                                    '%s: %s', name, e.__class__.__name__,
+                                    str(e))
@@ -0,0 +1,159 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# Copyright 2010 Andrew Fort
+
+"""PUNC's retry policy for failed Notch requests."""
+
+
+import random
+
+import notch.client
+import notch.client.errors
+
+
+# Notch errors which may succeed if the request is sent again.
+TRANSIENT_ERRORS = ('ConnectError',
+                    'DisconnectError',
+                    'EOFError',
+                    'NoSessionCreatedError',
+                    'SessionError',
+                    'TimeoutError',
+                    )
+
+
+def error_name(error):
+    """Returns the Notch error name of a request error, or None.
+
+    Args:
+      error: The error attribute of a notch.client.Request; a Notch API
+        error (notch.client.errors.ApiError), a client error such as
+        notch.client.TimeoutError, or a (code, message) tuple from older
+        clients.
+
+    Returns:
+      A string, the error name, or None if the error carries no Notch error
+      name or code (e.g., the agent could not be reached).
+    """
+    if isinstance(error, (notch.client.errors.ApiError, notch.client.Error)):
+        return getattr(error, 'name', None) or error.__class__.__name__
+    try:
+        # ProtocolError can be both a string and a tuple....
+        if isinstance(error[0], tuple):
+            err_code, _ = error[0]
+            return notch.client.errors.reverse_error_dictionary.get(
+                err_code, 'Unknown error')
+    except (TypeError, IndexError, ValueError):
+        pass
+    return None
+
+
+class RetryBudget(object):
+    """Limits retries across a run to a fraction of the requests sent.
+
+    During an agent outage every request fails; the budget stops retries
+    from multiplying the load on the agents when they recover.
+
+    Attributes:
+      ratio: A float, the retries allowed per request sent.
+      minimum: An int, retries always allowed regardless of the ratio.
+      requests: An int, the number of requests sent.
+      retries: An int, the number of retries spent.
+    """
+
+    def __init__(self, ratio=0.1, minimum=10):
+        self.ratio = ratio
+        self.minimum = minimum
+        self.requests = 0
+        self.retries = 0
+
+    def __repr__(self):
+        return ('%s(ratio=%r, minimum=%r)' %
+                (self.__class__.__name__, self.ratio, self.minimum))
+
+    def request_sent(self):
+        self.requests += 1
+
+    def spend(self):
+        """Spends a retry from the budget.
+
+        Returns:
+          A boolean, True if the retry may go ahead.
+        """
+        if self.retries >= self.minimum + self.ratio * self.requests:
+            return False
+        self.retries += 1
+        return True
+
+
+class RetryPolicy(object):
+    """Decides whether and when failed Notch requests are sent again.
+
+    Transient errors are retried with exponential backoff and jitter, until
+    max_attempts is reached or the run-wide budget is spent. Notch errors
+    are transient if named in transient_errors; errors talking to the Notch
+    agent (socket errors, such as a lost connection) are always transient.
+    Errors which cannot be classified are not retried.
+
+    Attributes:
+      max_attempts: An int, the maximum attempts per request (1 disables
+        retries).
+      base_delay: A float, the delay in seconds before the first retry.
+      max_delay: A float, the maximum delay in seconds before a retry.
+      jitter: A float [0..1], the fraction of the delay which is randomised.
+      transient_errors: A set of strings, the Notch error names to retry.
+      budget: A RetryBudget, shared by all collections in the run.
+    """
+
+    def __init__(self, max_attempts=1, base_delay=2.0, max_delay=60.0,
+                 jitter=0.5, transient_errors=None, budget=None):
+        self.max_attempts = max(max_attempts or 1, 1)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = min(max(jitter, 0.0), 1.0)
+        if transient_errors is None:
+            transient_errors = TRANSIENT_ERRORS
+        self.transient_errors = set(transient_errors)
+        self.budget = budget or RetryBudget()
+        self._random = random.Random()
+
+    def __repr__(self):
+        return ('%s(max_attempts=%r, base_delay=%r, max_delay=%r, jitter=%r, '
+                'budget=%r)' %
+                (self.__class__.__name__,
+                 self.max_attempts, self.base_delay, self.max_delay,
+                 self.jitter, self.budget))
+
+    def is_transient(self, error):
+        """Returns True if a Notch request error is worth retrying."""
+        name = error_name(error)
+        if name is not None:
+            return name in self.transient_errors
+        return isinstance(error, EnvironmentError)
+
+    def delay(self, attempt):
+        """Returns the delay in seconds before retrying a failed attempt.
+
+        Args:
+          attempt: An int, the number of the attempt which failed (from 1).
+        """
+        delay = min(self.base_delay * (2 ** (attempt - 1)), self.max_delay)
+        return delay * (1 - self.jitter * self._random.random())
+
+    def should_retry(self, error, attempt):
+        """Returns True if a failed attempt should be retried.
+
+        Spends from the budget if the retry is allowed.
+        """
+        if attempt >= self.max_attempts or not self.is_transient(error):
+            return False
+        return self.budget.spend()
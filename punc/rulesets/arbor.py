@@ -55,9 +55,11 @@ class ArborRuleset(punc.model.Ruleset):
             punc.model.Rule([punc.model.Action('command',
                                                key=(0, 0),
                                                args=self.cmd_sys_hardware,
-                                               parser=ParseSysHardware)]),
+                                               parser=ParseSysHardware)],
+                            independent=True),
             punc.model.Rule([punc.model.Action('command',
                                                key=(1, 0),
                                                args=self.cmd_sys_config,
-                                               parser=ParseSysConfiguration)]),
+                                               parser=ParseSysConfiguration)],
+                            independent=True),
             ]
@@ -55,6 +55,19 @@ class ParseConfiguration(punc.parser.AddDropParser):
                re.compile('Using [0-9].*'),
                )
     ERROR_RE = ERRORS
+    # Certificate hex dumps are kept as they are, without checking each line.
+    BLOCKS = (punc.parser.Block(re.compile(r'^ certificate '),
+                                re.compile(r'^\s+quit\s*$')),
+              )
+
+
+class ParseFingerprint(punc.parser.AddDropParser):
+    """Parses the last configuration change time from the running-config."""
+
+    DROP_RE = (punc.parser.BLANK_LINE,
+               )
+    ERROR_RE = ERRORS
+    flag_trailing_blank = False
 
 
 class IosRuleset(punc.model.Ruleset):
@@ -64,6 +77,8 @@ class IosRuleset(punc.model.Ruleset):
 
     cmd_show_version = {'command': 'show version'}
     cmd_show_running = {'command': 'show running-config'}
+    cmd_fingerprint = {
+        'command': 'show running-config | include Last configuration change'}
 
     header = '!RANCID-CONTENT-TYPE: cisco\n!\n'
 
@@ -72,9 +87,17 @@ class IosRuleset(punc.model.Ruleset):
             punc.model.Rule([punc.model.Action('command',
                                                key=(0, 0),
                                                args=self.cmd_show_version,
-                                               parser=ParseShowVersion)]),
+                                               parser=ParseShowVersion)],
+                            independent=True),
             punc.model.Rule([punc.model.Action('command',
                                                key=(1, 0),
                                                args=self.cmd_show_running,
-                                               parser=ParseConfiguration)]),
+                                               parser=ParseConfiguration)],
+                            independent=True),
             ]
+
+    def fingerprint(self):
+        return punc.model.Action('command',
+                                 key=(-1, 0),
+                                 args=self.cmd_fingerprint,
+                                 parser=ParseFingerprint)
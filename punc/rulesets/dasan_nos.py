@@ -70,9 +70,11 @@ class NosRuleset(punc.model.Ruleset):
             punc.model.Rule([punc.model.Action('command',
                                                key=(0, 0),
                                                args=self.cmd_show_system,
-                                               parser=ParseShowSystem)]),
+                                               parser=ParseShowSystem)],
+                            independent=True),
             punc.model.Rule([punc.model.Action('command',
                                                key=(1, 0),
                                                args=self.cmd_show_running,
-                                               parser=ParseConfiguration)]),
+                                               parser=ParseConfiguration)],
+                            independent=True),
             ]
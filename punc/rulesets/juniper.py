@@ -49,6 +49,15 @@ class ParseConfiguration(punc.parser.AddDropParser):
     ERROR_RE = ERRORS
 
 
+class ParseFingerprint(punc.parser.AddDropParser):
+    """Parses the most recent commit from "show system commit" output."""
+
+    DROP_RE = (punc.parser.BLANK_LINE,
+               )
+    ERROR_RE = ERRORS
+    flag_trailing_blank = False
+
+
 class JunosRuleset(punc.model.Ruleset):
     """Juniper JunOS ruleset for PUNC."""
 
@@ -56,6 +65,7 @@ class JunosRuleset(punc.model.Ruleset):
 
     cmd_show_version = {'command': 'show version'}
     cmd_show_running = {'command': 'show config'}
+    cmd_fingerprint = {'command': 'show system commit | match "^0 "'}
 
     header = '#RANCID-CONTENT-TYPE: juniper\n#\n'
 
@@ -64,9 +74,17 @@ class JunosRuleset(punc.model.Ruleset):
             punc.model.Rule([punc.model.Action('command',
                                                key=(0, 0),
                                                args=self.cmd_show_version,
-                                               parser=ParseShowVersion)]),
+                                               parser=ParseShowVersion)],
+                            independent=True),
             punc.model.Rule([punc.model.Action('command',
                                                key=(1, 0),
                                                args=self.cmd_show_running,
-                                               parser=ParseConfiguration)]),
+                                               parser=ParseConfiguration)],
+                            independent=True),
             ]
+
+    def fingerprint(self):
+        return punc.model.Action('command',
+                                 key=(-1, 0),
+                                 args=self.cmd_fingerprint,
+                                 parser=ParseFingerprint)
@@ -53,9 +53,11 @@ class OmniswitchRuleset(punc.model.Ruleset):
             punc.model.Rule([punc.model.Action('command',
                                                key=(0, 0),
                                                args=self.cmd_show_hardware,
-                                               parser=ParseShowHardwareInfo)]),
+                                               parser=ParseShowHardwareInfo)],
+                            independent=True),
             punc.model.Rule([punc.model.Action('command',
                                                key=(1, 0),
                                                args=self.cmd_show_running,
-                                               parser=ParseConfiguration)]),
+                                               parser=ParseConfiguration)],
+                            independent=True),
             ]
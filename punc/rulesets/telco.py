@@ -64,9 +64,11 @@ class TelcoRuleset(punc.model.Ruleset):
             punc.model.Rule([punc.model.Action('command',
                                                key=(0, 0),
                                                args=self.cmd_show_version,
-                                               parser=ParseShowVersion)]),
+                                               parser=ParseShowVersion)],
+                            independent=True),
             punc.model.Rule([punc.model.Action('command',
                                                key=(1, 0),
                                                args=self.cmd_show_running,
-                                               parser=ParseConfiguration)]),
+                                               parser=ParseConfiguration)],
+                            independent=True),
             ]
@@ -46,12 +46,22 @@ class ParseConfiguration(punc.parser.AddDropParser):
                )
 
 
+class ParseFingerprint(punc.parser.AddDropParser):
+    """Parses the configuration modification time."""
+
+    DROP_RE = (punc.parser.BLANK_LINE,
+               )
+    flag_trailing_blank = False
+
+
 class TimetraRuleset(punc.model.Ruleset):
 
     name = 'timetra'
 
     cmd_show_version = {'command': 'show version'}
     cmd_show_running = {'command': 'admin display-config'}
+    cmd_fingerprint = {
+        'command': 'show system information | match "Time Last Modified"'}
 
     header = '# RANCID-CONTENT-TYPE: timetra\n#\n'
 
@@ -60,9 +70,17 @@ class TimetraRuleset(punc.model.Ruleset):
             punc.model.Rule([punc.model.Action('command',
                                                key=(0, 0),
                                                args=self.cmd_show_version,
-                                               parser=ParseShowVersion)]),
+                                               parser=ParseShowVersion)],
+                            independent=True),
             punc.model.Rule([punc.model.Action('command',
                                                key=(1, 0),
                                                args=self.cmd_show_running,
-                                               parser=ParseConfiguration)]),
+                                               parser=ParseConfiguration)],
+                            independent=True),
             ]
+
+    def fingerprint(self):
+        return punc.model.Action('command',
+                                 key=(-1, 0),
+                                 args=self.cmd_fingerprint,
+                                 parser=ParseFingerprint)
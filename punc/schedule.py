@@ -0,0 +1,218 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# Copyright 2010 Andrew Fort
+
+"""PUNC's request scheduler."""
+
+
+import collections
+import heapq
+import logging
+import time
+
+
+class Scheduler(object):
+    """Bounds the number of Notch requests in flight during a run.
+
+    A single scheduler is shared by all Collections in a run. Devices are
+    queued with add_device() and are started as request slots become free.
+    Once a device has started, its next request is sent ahead of devices
+    which have not yet started, so devices complete (and release their
+    results) as early as possible.
+
+    The Notch client balances requests over its agents itself, so the
+    per-agent limit is applied as an aggregate limit of
+    max_requests_per_agent * num_agents.
+
+    Attributes:
+      max_requests: An int or None, the global in-flight request limit.
+      max_requests_per_collection: An int or None, the in-flight request
+        limit for each collection name.
+      max_requests_per_agent: An int or None, the in-flight request limit
+        for each Notch agent.
+      num_agents: An int, the number of Notch agents in use.
+      max_requests_per_device: An int, the in-flight request limit for
+        each device. Only rules declared independent run concurrently on
+        a device.
+      in_flight: An int, the number of requests currently in flight.
+    """
+
+    def __init__(self, max_requests=None, max_requests_per_collection=None,
+                 max_requests_per_agent=None, num_agents=1,
+                 max_requests_per_device=1, clock=None):
+        # Zero means unlimited, as it does in the configuration.
+        self.max_requests = max_requests or None
+        self.max_requests_per_collection = max_requests_per_collection or None
+        self.max_requests_per_agent = max_requests_per_agent or None
+        self.num_agents = max(num_agents, 1)
+        self.max_requests_per_device = max(max_requests_per_device or 1, 1)
+        self.in_flight = 0
+        self._in_flight_by_collection = {}
+        # Per collection name heaps of (priority, sequence, collection, device)
+        self._queues = {}
+        # Started devices with another request ready to send.
+        self._ready = collections.deque()
+        # Heap of (time due, sequence, collection, device) for devices
+        # waiting to retry a request.
+        self._delayed = []
+        self._clock = clock or time.time
+        self._seq = 0
+        self._dispatching = False
+
+    def __repr__(self):
+        return ('%s(max_requests=%r, max_requests_per_collection=%r, '
+                'max_requests_per_agent=%r, num_agents=%d, '
+                'max_requests_per_device=%d)' %
+                (self.__class__.__name__,
+                 self.max_requests, self.max_requests_per_collection,
+                 self.max_requests_per_agent, self.num_agents,
+                 self.max_requests_per_device))
+
+    @property
+    def limit(self):
+        """Returns the effective global in-flight limit, or None."""
+        limits = []
+        if self.max_requests:
+            limits.append(self.max_requests)
+        if self.max_requests_per_agent:
+            limits.append(self.max_requests_per_agent * self.num_agents)
+        if limits:
+            return min(limits)
+        return None
+
+    def add_device(self, collection, device, priority=0):
+        """Queues a device of a collection to be started.
+
+        Args:
+          collection: A punc.collect.Collection object.
+          device: A string, the device name.
+          priority: A number. Devices with lower values start first; devices
+            of equal priority start in the order they were added.
+        """
+        self._seq += 1
+        queue = self._queues.setdefault(collection.name, [])
+        heapq.heappush(queue, (priority, self._seq, collection, device))
+
+    def device_ready(self, collection, device, delay=None):
+        """Notes that a started device has another request to send.
+
+        Args:
+          collection: A punc.collect.Collection object.
+          device: A string, the device name.
+          delay: A float or None, seconds to wait before the request is
+            sent. Delayed requests are sent by the first dispatch() after
+            they fall due.
+        """
+        if delay:
+            self._seq += 1
+            heapq.heappush(self._delayed, (self._clock() + delay, self._seq,
+                                           collection, device))
+        else:
+            self._ready.append((collection, device))
+
+    def drop_collection(self, collection):
+        """Forgets a collection's devices waiting to send a request.
+
+        Called when a collection is abandoned, so that its delayed retries
+        and unstarted devices do not hold up the end of the run.
+
+        Args:
+          collection: A punc.collect.Collection object.
+        """
+        self._delayed = [item for item in self._delayed
+                         if item[2] is not collection]
+        heapq.heapify(self._delayed)
+        self._ready = collections.deque(
+            [item for item in self._ready if item[0] is not collection])
+        queue = self._queues.get(collection.name)
+        if queue:
+            self._queues[collection.name] = [item for item in queue
+                                             if item[2] is not collection]
+            heapq.heapify(self._queues[collection.name])
+
+    def request_done(self, collection):
+        """Releases the slot of a completed request and sends more."""
+        self.in_flight -= 1
+        self._in_flight_by_collection[collection.name] -= 1
+        self.dispatch()
+
+    def finished(self):
+        """Returns True if no requests are in flight or waiting to be sent."""
+        if self.in_flight or self._ready or self._delayed:
+            return False
+        for queue in self._queues.itervalues():
+            if queue:
+                return False
+        return True
+
+    def _has_capacity(self):
+        limit = self.limit
+        return limit is None or self.in_flight < limit
+
+    def _collection_has_capacity(self, name):
+        if not self.max_requests_per_collection:
+            return True
+        return bool(self._in_flight_by_collection.get(name, 0) <
+                    self.max_requests_per_collection)
+
+    def _promote_delayed(self):
+        """Moves delayed devices which have fallen due to the ready queue."""
+        now = self._clock()
+        while self._delayed and self._delayed[0][0] <= now:
+            _, _, collection, device = heapq.heappop(self._delayed)
+            self._ready.append((collection, device))
+
+    def _next_ready(self):
+        """Returns the next started (collection, device) to send, or None."""
+        for i, (collection, device) in enumerate(self._ready):
+            if self._collection_has_capacity(collection.name):
+                del self._ready[i]
+                return collection, device
+        return None
+
+    def _next_queued(self):
+        """Returns the next queued (collection, device) to start, or None."""
+        best = None
+        for name, queue in self._queues.iteritems():
+            if not queue or not self._collection_has_capacity(name):
+                continue
+            if best is None or queue[0] < self._queues[best][0]:
+                best = name
+        if best is None:
+            return None
+        _, _, collection, device = heapq.heappop(self._queues[best])
+        return collection, device
+
+    def dispatch(self):
+        """Sends requests while there are free slots and work to send."""
+        # Sending a request may call back into the scheduler.
+        if self._dispatching:
+            return
+        self._dispatching = True
+        try:
+            self._promote_delayed()
+            while self._has_capacity():
+                item = self._next_ready() or self._next_queued()
+                if item is None:
+                    break
+                collection, device = item
+                self.in_flight += 1
+                self._in_flight_by_collection[collection.name] = (
+                    self._in_flight_by_collection.get(collection.name, 0) + 1)
+                if not collection.send_next_request(device):
+                    logging.debug('SCHEDULER_NO_REQUEST %s %s',
+                                  collection.name, device)
+                    self.in_flight -= 1
+                    self._in_flight_by_collection[collection.name] -= 1
+        finally:
+            self._dispatching = False
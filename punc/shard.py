@@ -0,0 +1,181 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# Copyright 2010 Andrew Fort
+
+"""Splitting a PUNC run into shards, and merging their output."""
+
+
+import hashlib
+import logging
+import os
+
+import punc.output
+
+
+# The list of files written by a run, relative to its base path.
+WRITTEN_PATH = '.punc_written'
+
+
+def parse_shard(spec):
+    """Parses a shard specification.
+
+    Args:
+      spec: A string, 'i/N' for shard i (from 1) of N shards, or None.
+
+    Returns:
+      A tuple of ints (i, N), or None if spec is None.
+
+    Raises:
+      ValueError: The specification was invalid.
+    """
+    if spec is None:
+        return None
+    try:
+        index, count = [int(x) for x in spec.split('/')]
+    except ValueError:
+        raise ValueError('Shard %r is not of the form i/N' % spec)
+    if count < 1 or not 1 <= index <= count:
+        raise ValueError('Shard %r must have 1 <= i <= N' % spec)
+    return index, count
+
+
+def in_shard(device, shard):
+    """Returns True if a device belongs to a shard.
+
+    Devices are assigned by a hash of their name, so the assignment is
+    stable between runs and between workers.
+
+    Args:
+      device: A string, the device name.
+      shard: A tuple (i, N) as returned by parse_shard, or None for all
+        devices.
+    """
+    if shard is None:
+        return True
+    index, count = shard
+    digest = hashlib.md5(device).hexdigest()
+    return bool(int(digest[:8], 16) % count == index - 1)
+
+
+def parse_error_report(report):
+    """Parses an error report (see collect.error_report) to a dict.
+
+    Returns:
+      A dict of device name strings to sets of error message strings.
+    """
+    errors = {}
+    device = None
+    for line in report.split('\n'):
+        if line.startswith('    ') and device is not None:
+            errors[device].add(line[4:])
+        elif line.startswith('  ') and line.endswith(':'):
+            device = line[2:-1]
+            errors.setdefault(device, set())
+    return errors
+
+
+def save_written(base_path, paths):
+    """Atomically records the files written by a run.
+
+    Args:
+      base_path: A string, the run's base path.
+      paths: An iterable of strings, the paths of the files written.
+    """
+    path = os.path.join(base_path, WRITTEN_PATH)
+    try:
+        punc.output.make_dirs(base_path)
+        f = open(path + '.tmp', 'w')
+        try:
+            for written in sorted(paths):
+                f.write(os.path.relpath(written, base_path) + '\n')
+        finally:
+            f.close()
+        os.rename(path + '.tmp', path)
+    except (OSError, IOError), e:
+        logging.error('Could not write the list of files written %r. %s: %s',
+                      path, e.__class__.__name__, str(e))
+
+
+def load_written(base_path):
+    """Returns the files written by a run, relative to its base path.
+
+    Returns:
+      A list of strings, or None if the run recorded no list.
+    """
+    path = os.path.join(base_path, WRITTEN_PATH)
+    if not os.path.exists(path):
+        return None
+    f = open(path)
+    try:
+        return [line.rstrip('\n') for line in f if line.rstrip('\n')]
+    finally:
+        f.close()
+
+
+def _tree_files(source):
+    """Returns the paths of the files in a tree, except dot files."""
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(source):
+        dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+        for filename in filenames:
+            if not filename.startswith('.'):
+                paths.append(os.path.relpath(os.path.join(dirpath, filename),
+                                             source))
+    return paths
+
+
+def merge_trees(sources, dest):
+    """Copies the files written by each shard's run into a single tree.
+
+    Only the files a shard's last run wrote (see save_written) are merged,
+    so files left in a shard's tree by earlier runs cannot replace newer
+    output. Without a list of the files written, the shard's whole tree
+    is merged, except dot files and directories (e.g., the revision
+    control metadata and PUNC's state files). Each file is replaced
+    atomically, and only if its content has changed.
+
+    Args:
+      sources: An iterable of strings, the shard output tree paths.
+      dest: A string, the destination base path.
+
+    Returns:
+      An int, the number of files merged.
+    """
+    merged = 0
+    for source in sources:
+        paths = load_written(source)
+        if paths is None:
+            logging.warning('No list of the files written in %s; merging '
+                            'the whole tree', source)
+            paths = _tree_files(source)
+        for path in paths:
+            if not os.path.exists(os.path.join(source, path)):
+                logging.warning('Not merging missing file %s from %s',
+                                path, source)
+                continue
+            dest_path = os.path.join(dest, path)
+            punc.output.make_dirs(os.path.dirname(dest_path), mode=0755)
+            src = open(os.path.join(source, path), 'rb')
+            try:
+                out = punc.output.OutputFile(dest_path, 'wb')
+                while True:
+                    data = src.read(punc.output.READ_SIZE)
+                    if not data:
+                        break
+                    out.write(data)
+                out.close()
+            finally:
+                src.close()
+            merged += 1
+        logging.debug('Merged shard output from %s', source)
+    return merged
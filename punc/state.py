@@ -0,0 +1,72 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# Copyright 2010 Andrew Fort
+
+"""PUNC's small on-disk state files, kept between runs."""
+
+
+import json
+import logging
+import os
+
+
+class StateFile(object):
+    """A dictionary persisted as a JSON file.
+
+    Attributes:
+      path: A string or None, the file path. If None, the state is not
+        loaded or saved.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._data = {}
+        if path:
+            self.load()
+
+    def __repr__(self):
+        return '%s(path=%r)' % (self.__class__.__name__, self.path)
+
+    def load(self):
+        """Loads the state file, if it exists."""
+        if not os.path.exists(self.path):
+            return
+        try:
+            f = open(self.path)
+            try:
+                self._data = json.load(f)
+            finally:
+                f.close()
+        except (OSError, IOError, ValueError), e:
+            logging.warning('Ignoring unreadable state file %r. %s: %s',
+                            self.path, e.__class__.__name__, str(e))
+            self._data = {}
+
+    def save(self):
+        """Atomically writes the state file."""
+        if not self.path:
+            return
+        tmp_path = self.path + '.tmp'
+        try:
+            dirname = os.path.dirname(self.path)
+            if dirname and not os.path.exists(dirname):
+                os.makedirs(dirname)
+            f = open(tmp_path, 'w')
+            try:
+                json.dump(self._data, f)
+            finally:
+                f.close()
+            os.rename(tmp_path, self.path)
+        except (OSError, IOError), e:
+            logging.error('Could not write state file %r. %s: %s',
+                          self.path, e.__class__.__name__, str(e))
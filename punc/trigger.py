@@ -0,0 +1,209 @@
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+#
+# Copyright 2010 Andrew Fort
+
+"""Collection triggered by configuration change syslog messages."""
+
+
+import logging
+import re
+
+import eventlet
+from eventlet.green import socket
+
+
+# Syslog messages reporting a configuration change.
+CONFIG_CHANGE_PATTERNS = (r'%SYS-5-CONFIG',  # Cisco IOS
+                          r'UI_COMMIT',  # Junos
+                          r'CONFIG_CHANGE',
+                          )
+
+# The HOSTNAME of an RFC 5424 or an RFC 3164 message.
+_RFC5424_HOSTNAME = re.compile(r'^<\d+>\d+ \S+ (\S+) ')
+_RFC3164_HOSTNAME = re.compile(
+    r'^<\d+>[A-Z][a-z]{2} [ \d]\d \d\d:\d\d:\d\d (\S+) ')
+# RFC 6587 octet counting framing.
+_OCTET_COUNT = re.compile(r'^\d+ (?=<)')
+
+
+def parse_hostname(message):
+    """Returns the HOSTNAME field of a syslog message, or None."""
+    for regexp in (_RFC5424_HOSTNAME, _RFC3164_HOSTNAME):
+        match = regexp.match(message)
+        if match:
+            hostname = match.group(1)
+            if hostname != '-':
+                return hostname
+    return None
+
+
+class DeviceResolver(object):
+    """Maps the sender of a syslog message to a Notch device name.
+
+    The sender is looked up in order by: the configured address map, the
+    message's HOSTNAME field and the reverse DNS name of its address. Names
+    match a device exactly or by their first label.
+    """
+
+    def __init__(self, devices, hosts=None):
+        """Initialiser.
+
+        Args:
+          devices: A callable returning a set of the device names.
+          hosts: A dict of address strings to device names.
+        """
+        self._devices = devices
+        self.hosts = hosts or {}
+        # Address -> reverse DNS name or None
+        self._dns = {}
+
+    def _reverse_dns(self, address):
+        if address not in self._dns:
+            try:
+                self._dns[address] = socket.gethostbyaddr(address)[0]
+            except (socket.error, socket.herror), e:
+                logging.debug('No reverse DNS for %s: %s', address, e)
+                self._dns[address] = None
+        return self._dns[address]
+
+    def resolve(self, address, hostname=None):
+        """Returns the device name of a message sender, or None.
+
+        Args:
+          address: A string, the sender's IP address.
+          hostname: A string or None, the HOSTNAME field of the message.
+        """
+        if address in self.hosts:
+            return self.hosts[address]
+        devices = self._devices()
+        by_label = {}
+        for device in devices:
+            by_label.setdefault(device.split('.')[0].lower(), device)
+        for name in (hostname, self._reverse_dns(address)):
+            if not name:
+                continue
+            if name in devices:
+                return name
+            device = by_label.get(name.split('.')[0].lower())
+            if device is not None:
+                return device
+        return None
+
+
+class SyslogListener(object):
+    """Listens for configuration change syslog messages over UDP and TCP.
+
+    TCP messages are newline delimited, optionally with octet counts.
+
+    Attributes:
+      address: A string, the address to listen on.
+      port: An int, the port to listen on.
+      udp: A boolean, True to listen for UDP messages.
+      tcp: A boolean, True to listen for TCP messages.
+    """
+
+    MAX_MESSAGE = 65535
+
+    def __init__(self, resolver, callback, address='0.0.0.0', port=514,
+                 udp=True, tcp=True, patterns=None):
+        """Initialiser.
+
+        Args:
+          resolver: A DeviceResolver object.
+          callback: A callable, called with the device name of each
+            configuration change message.
+          address: A string, see Attributes.
+          port: An int, see Attributes.
+          udp: A boolean, see Attributes.
+          tcp: A boolean, see Attributes.
+          patterns: An iterable of regular expression strings matching
+            configuration change messages. Defaults to
+            CONFIG_CHANGE_PATTERNS.
+        """
+        self.address = address
+        self.port = port
+        self.udp = udp
+        self.tcp = tcp
+        self._resolver = resolver
+        self._callback = callback
+        self._pattern = re.compile(
+            '|'.join(patterns or CONFIG_CHANGE_PATTERNS))
+        self._sockets = []
+
+    def __repr__(self):
+        return ('%s(address=%r, port=%r, udp=%r, tcp=%r)' %
+                (self.__class__.__name__, self.address, self.port,
+                 self.udp, self.tcp))
+
+    def start(self):
+        """Binds the listening sockets and starts serving them."""
+        if self.udp:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind((self.address, self.port))
+            self._sockets.append(sock)
+            eventlet.spawn_n(self._serve_udp, sock)
+        if self.tcp:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.bind((self.address, self.port))
+            sock.listen(50)
+            self._sockets.append(sock)
+            eventlet.spawn_n(self._serve_tcp, sock)
+        logging.info('Listening for configuration changes: %r', self)
+
+    def stop(self):
+        """Closes the listening sockets."""
+        for sock in self._sockets:
+            sock.close()
+        self._sockets = []
+
+    def _serve_udp(self, sock):
+        while True:
+            try:
+                data, (address, _) = sock.recvfrom(self.MAX_MESSAGE)
+            except socket.error:
+                return
+            self.handle(data, address)
+
+    def _serve_tcp(self, sock):
+        while True:
+            try:
+                conn, (address, _) = sock.accept()
+            except socket.error:
+                return
+            eventlet.spawn_n(self._serve_connection, conn, address)
+
+    def _serve_connection(self, conn, address):
+        try:
+            for line in conn.makefile('r'):
+                self.handle(_OCTET_COUNT.sub('', line, 1), address)
+        finally:
+            conn.close()
+
+    def handle(self, message, address):
+        """Handles a syslog message from an address.
+
+        Returns:
+          A string, the name of the changed device, or None.
+        """
+        if not self._pattern.search(message):
+            return None
+        device = self._resolver.resolve(address, parse_hostname(message))
+        if device is None:
+            logging.warning('Configuration change from unknown device %s: %s',
+                            address, message.strip())
+            return None
+        logging.debug('CONFIG_CHANGE %s %s', device, message.strip())
+        self._callback(device)
+        return device
@@ -27,12 +27,61 @@ import traceback
 
 import notch.client
 
+import punc.archive
+import punc.blob_store
+import punc.collect
+import punc.daemon
+import punc.fingerprint
+import punc.history
+import punc.inventory
+import punc.journal
 import punc.model
+import punc.parse_pool
+import punc.result_cache
+import punc.retry
+import punc.schedule
+import punc.shard
+import punc.trigger
 
 
 # Constants
 DEFAULT_COLLECT_TIMEOUT_S = 1750.0
 DEFAULT_COMMAND_TIMEOUT_S = 180.0
+# In-flight Notch request limits; zero means unlimited.
+DEFAULT_MAX_REQUESTS = 500
+DEFAULT_MAX_REQUESTS_PER_AGENT = 0
+DEFAULT_MAX_REQUESTS_PER_COLLECTION = 0
+DEFAULT_MAX_REQUESTS_PER_DEVICE = 1
+DEFAULT_RETRY_ATTEMPTS = 3
+DEFAULT_RETRY_DELAY_S = 2.0
+DEFAULT_RETRY_MAX_DELAY_S = 60.0
+DEFAULT_RETRY_JITTER = 0.5
+DEFAULT_RETRY_BUDGET_RATIO = 0.1
+DEFAULT_RETRY_BUDGET_MINIMUM = 10
+# Relative to base_path. Dot files are ignored by the revision control.
+DEFAULT_HISTORY_PATH = '.punc_history'
+DEFAULT_FINGERPRINT_PATH = '.punc_fingerprints'
+DEFAULT_RESULT_CACHE_PATH = '.punc_results'
+DEFAULT_BLOB_STORE_PATH = '.punc_blobs'
+DEFAULT_ARCHIVE_PATH = '.punc_archive'
+DEFAULT_ARCHIVE_KEYFRAME_INTERVAL = 10
+DEFAULT_INVENTORY_CACHE_PATH = '.punc_inventory'
+# Seconds a cached inventory is used for; zero disables the cache.
+DEFAULT_INVENTORY_CACHE_TTL_S = 0
+# Output files are written serially unless this is more than one.
+DEFAULT_COLLATE_THREADS = 0
+# Results of at least this many bytes are parsed in a worker process.
+DEFAULT_PARSE_PROCESSES = 0
+DEFAULT_PARSE_THRESHOLD = 262144
+DEFAULT_ENGINE = 'eventlet'
+DEFAULT_DAEMON_INTERVAL_S = 86400.0
+DEFAULT_DAEMON_JITTER = 0.1
+DEFAULT_DAEMON_INVENTORY_INTERVAL_S = 3600.0
+DEFAULT_DAEMON_MAX_SLEEP_S = 60.0
+DEFAULT_TRIGGER_PORT = 514
+DEFAULT_TRIGGER_DELAY_S = 30.0
+DEFAULT_TRIGGER_MAX_DELAY_S = 300.0
+ENGINES = ('eventlet', 'asyncio')
 
 
 # A modified (output) version of the formatter from Tornado.
@@ -96,32 +145,55 @@ def get_options():
                  help='Collect a specific device name only', default=None)
     p.add_option('-r', '--regexp', dest='regexp',
                  help='Collect a regexp of devices', default=None)
+    p.add_option('--max-requests', dest='max_requests', type='int',
+                 help='Maximum Notch requests in flight (0 is unlimited)',
+                 default=None)
+    p.add_option('--max-requests-per-agent', dest='max_requests_per_agent',
+                 type='int', default=None,
+                 help='Maximum Notch requests in flight per Notch agent')
+    p.add_option('--max-requests-per-collection',
+                 dest='max_requests_per_collection', type='int', default=None,
+                 help='Maximum Notch requests in flight per collection')
+    p.add_option('--max-requests-per-device', dest='max_requests_per_device',
+                 type='int', default=None,
+                 help='Maximum Notch requests in flight per device')
+    p.add_option('--stream', action='store_true', dest='stream',
+                 default=None,
+                 help='Write each device as it completes (streaming)')
+    p.add_option('--collate-threads', dest='collate_threads', type='int',
+                 default=None,
+                 help='Write output files in this many threads')
+    p.add_option('--full', action='store_true', dest='full', default=False,
+                 help='Collect all devices, even if unchanged')
+    p.add_option('--parse-processes', dest='parse_processes', type='int',
+                 default=None,
+                 help='Parse large results in this many processes')
+    p.add_option('--engine', dest='engine', type='choice', choices=ENGINES,
+                 default=None,
+                 help='Collector engine: eventlet (default) or asyncio')
+    p.add_option('--async-threads', dest='async_threads', type='int',
+                 default=None,
+                 help='Execute asyncio engine requests in this many threads '
+                 '(default: twice the request limit)')
+    p.add_option('--daemon', action='store_true', dest='daemon',
+                 default=False,
+                 help='Run continuously, collecting each device periodically')
+    p.add_option('--resume', action='store_true', dest='resume',
+                 default=False,
+                 help='Resume an interrupted run from its journal')
+    p.add_option('--shard', dest='shard', default=None,
+                 help='Collect only shard i/N of the devices')
+    p.add_option('--base-path', dest='base_path', default=None,
+                 help='Write output here instead of the configured base_path')
+    p.add_option('--no-commit', action='store_false', dest='commit',
+                 default=True,
+                 help='Do not commit changes (e.g., when running a shard)')
+    p.add_option('--merge', dest='merge', action='append', default=[],
+                 help='Merge a shard output path into base_path and commit')
     p.add_option('-d', '--debug', action='store_true', dest='debug')
     return p.parse_args()
 
 
-def filter_devices(devices, vendor=None):
-    """Returns a set of the keys of the dict devices, filtered by vendor.
-
-    Args:
-      devices: A dictionary as retrieved from Notch's devices_info method.
-      vendor: A string or None. If a string, return only devices matching
-        this vendor. If None, perform no filtering.
-
-    Returns:
-      A set of strings, hostnames matching the vendor provided.
-    """
-    result = set()
-    for d in devices.iterkeys():
-        if devices[d] is None or d is None:
-            logging.warning('filter_devices skipping bad device %r=%r',
-                            d, devices[d])
-            continue
-        if not vendor or devices[d].get('device_type') == vendor:
-            result.add(d)
-    return result
-
-
 def get_devices(notch_client, device_regexp):
     try:
         return notch_client.devices_info(device_regexp)
@@ -132,49 +204,468 @@ def get_devices(notch_client, device_regexp):
         return None
 
 
-def build_collections(options, config, notch_client):
+def _option_or_config(options, config, name, default):
+    """Returns a command line option value, else the config value."""
+    value = getattr(options, name, None)
+    if value is None:
+        value = config.get(name, default)
+    return value
+
+
+def count_agents(agents):
+    """Returns the number of Notch agents in a list or string of agents."""
+    if not agents:
+        return 1
+    if isinstance(agents, basestring):
+        agents = agents.replace(',', ' ').split()
+    return max(len(agents), 1)
+
+
+def get_scheduler(options, config, agents):
+    """Returns the schedule.Scheduler shared by the run's collections.
+
+    Command line options take precedence over the configuration.
+    """
+    scheduler = punc.schedule.Scheduler(
+        max_requests=_option_or_config(
+            options, config, 'max_requests', DEFAULT_MAX_REQUESTS),
+        max_requests_per_collection=_option_or_config(
+            options, config, 'max_requests_per_collection',
+            DEFAULT_MAX_REQUESTS_PER_COLLECTION),
+        max_requests_per_agent=_option_or_config(
+            options, config, 'max_requests_per_agent',
+            DEFAULT_MAX_REQUESTS_PER_AGENT),
+        num_agents=count_agents(agents),
+        max_requests_per_device=_option_or_config(
+            options, config, 'max_requests_per_device',
+            DEFAULT_MAX_REQUESTS_PER_DEVICE))
+    logging.debug('Using %r', scheduler)
+    return scheduler
+
+
+def get_timeouts(config, recipe):
+    """Returns the command and collection timeouts for a recipe.
+
+    The most specific setting wins: the recipe's own command_timeout and
+    collect_timeout, then the recipe's ruleset and vendor entries in the
+    top-level timeouts section, e.g.,
+
+      timeouts:
+        rulesets:
+          timetra: {command_timeout: 600}
+        vendors:
+          nortel: {command_timeout: 300, collect_timeout: 3600}
+
+    and finally the top-level command_timeout and collect_timeout.
+
+    Args:
+      config: A dict, the PUNC configuration.
+      recipe: A dict, the recipe configuration.
+
+    Returns:
+      A tuple of floats, (command timeout, collection timeout) in seconds.
+    """
+    timeouts = config.get('timeouts') or {}
+    ruleset_timeouts = timeouts.get('rulesets') or {}
+    vendor_timeouts = timeouts.get('vendors') or {}
+    sources = (recipe,
+               ruleset_timeouts.get(recipe.get('ruleset')) or {},
+               vendor_timeouts.get(recipe.get('vendor')) or {},
+               config)
+
+    def lookup(key, default):
+        for source in sources:
+            if source.get(key) is not None:
+                return float(source[key])
+        return default
+
+    return (lookup('command_timeout', DEFAULT_COMMAND_TIMEOUT_S),
+            lookup('collect_timeout', DEFAULT_COLLECT_TIMEOUT_S))
+
+
+def get_blob_store(config):
+    """Returns a blob_store.BlobStore for a run, or None.
+
+    The store of output snapshots is enabled with 'blob_store: true' in the
+    configuration.
+    """
+    if not config.get('blob_store'):
+        return None
+    base_path = config.get('base_path')
+    path = os.path.join(base_path,
+                        config.get('blob_store_path', DEFAULT_BLOB_STORE_PATH))
+    blob_store = punc.blob_store.BlobStore(path, base_path)
+    logging.debug('Using %r', blob_store)
+    return blob_store
+
+
+def get_archive(config):
+    """Returns an archive.Archive for a run, or None.
+
+    The archive of every version of each target is enabled with
+    'archive: true' in the configuration.
+    """
+    if not config.get('archive'):
+        return None
     base_path = config.get('base_path')
-    master_repo_path = config.get('master_repo_path')
+    path = os.path.join(base_path,
+                        config.get('archive_path', DEFAULT_ARCHIVE_PATH))
+    archive = punc.archive.Archive(
+        path, base_path,
+        keyframe_interval=config.get('archive_keyframe_interval',
+                                     DEFAULT_ARCHIVE_KEYFRAME_INTERVAL))
+    logging.debug('Using %r', archive)
+    return archive
+
+
+def get_collator(options, config):
+    """Returns the collect.Collator for the run."""
+    stream = _option_or_config(options, config, 'stream', False)
+    threads = _option_or_config(options, config, 'collate_threads',
+                                DEFAULT_COLLATE_THREADS)
+    return punc.collect.Collator(stream=bool(stream),
+                                 blob_store=get_blob_store(config),
+                                 archive=get_archive(config),
+                                 threads=int(threads))
+
+
+def get_history(config):
+    """Returns the history.DurationHistory of previous run durations."""
+    path = config.get('history_path', DEFAULT_HISTORY_PATH)
+    if path:
+        path = os.path.join(config.get('base_path'), path)
+    return punc.history.DurationHistory(path or None)
+
+
+def get_retry_policy(config):
+    """Returns the retry.RetryPolicy for the run.
+
+    Retries are configured in the top-level retry section, e.g.,
+
+      retry:
+        max_attempts: 3
+        base_delay: 2.0
+        max_delay: 60.0
+        jitter: 0.5
+        budget_ratio: 0.1
+        budget_minimum: 10
+        transient_errors: [ConnectError, TimeoutError]
+    """
+    retry = config.get('retry') or {}
+    budget = punc.retry.RetryBudget(
+        ratio=float(retry.get('budget_ratio', DEFAULT_RETRY_BUDGET_RATIO)),
+        minimum=int(retry.get('budget_minimum', DEFAULT_RETRY_BUDGET_MINIMUM)))
+    policy = punc.retry.RetryPolicy(
+        max_attempts=int(retry.get('max_attempts', DEFAULT_RETRY_ATTEMPTS)),
+        base_delay=float(retry.get('base_delay', DEFAULT_RETRY_DELAY_S)),
+        max_delay=float(retry.get('max_delay', DEFAULT_RETRY_MAX_DELAY_S)),
+        jitter=float(retry.get('jitter', DEFAULT_RETRY_JITTER)),
+        transient_errors=retry.get('transient_errors'),
+        budget=budget)
+    logging.debug('Using %r', policy)
+    return policy
+
+
+def get_fingerprints(options, config):
+    """Returns the fingerprint.FingerprintStore, or None.
+
+    Change detection is enabled with 'change_detection: true' in the
+    configuration.
+    """
+    if not config.get('change_detection'):
+        return None
+    path = os.path.join(
+        config.get('base_path'),
+        config.get('fingerprint_path', DEFAULT_FINGERPRINT_PATH))
+    return punc.fingerprint.FingerprintStore(path, refresh=options.full)
+
+
+def get_result_cache(options, config):
+    """Returns the result_cache.ResultCache, or None.
+
+    The cache of parsed results is enabled with 'result_cache: true' in the
+    configuration. --full parses every result again.
+    """
+    if not config.get('result_cache'):
+        return None
+    path = os.path.join(config.get('base_path'),
+                        config.get('result_cache_path',
+                                   DEFAULT_RESULT_CACHE_PATH))
+    result_cache = punc.result_cache.ResultCache(path, refresh=options.full)
+    logging.debug('Using %r', result_cache)
+    return result_cache
+
+
+def get_journal(options, config):
+    """Returns the opened journal.Journal for the run, or None.
+
+    The journal is enabled by setting journal_path (relative to base_path,
+    e.g., '.punc_journal') in the configuration. With --resume, the
+    journal of the previous (interrupted) run is loaded and appended to;
+    otherwise a new journal is started, and any left by an interrupted run
+    is kept aside rather than overwritten.
+    """
+    path = config.get('journal_path')
+    if not path:
+        if options.resume:
+            logging.warning('No journal_path is configured; '
+                            'not resuming the previous run')
+        return None
+    journal = punc.journal.Journal(os.path.join(config.get('base_path'), path))
+    if options.resume:
+        journal.load()
+    journal.open(resume=options.resume)
+    return journal
+
+
+def get_parse_pool(options, config):
+    """Returns the parse_pool.ParsePool for the run.
+
+    Results of at least parse_threshold bytes are parsed in a pool of
+    parse_processes worker processes. With no processes (the default),
+    results are parsed inline.
+    """
+    pool = punc.parse_pool.ParsePool(
+        processes=int(_option_or_config(options, config, 'parse_processes',
+                                        DEFAULT_PARSE_PROCESSES)),
+        threshold=int(config.get('parse_threshold', DEFAULT_PARSE_THRESHOLD)))
+    logging.debug('Using %r', pool)
+    return pool
+
+
+def get_async_engine(options, config, agents, scheduler):
+    """Returns the collect_async.AsyncEngine, or None.
+
+    The asyncio engine is used with 'engine: asyncio' in the configuration
+    or --engine=asyncio. It uses the same request limits as the scheduler.
+    Its requests are executed in async_threads threads, by default twice
+    the global request limit.
+
+    Returns:
+      A collect_async.AsyncEngine, or None if the eventlet engine is used.
+
+    Raises:
+      ImportError: The asyncio engine's dependencies are not installed.
+      ValueError: The configured engine is unknown.
+    """
+    engine = _option_or_config(options, config, 'engine', DEFAULT_ENGINE)
+    if engine == 'eventlet':
+        return None
+    elif engine != 'asyncio':
+        raise ValueError('Unknown engine %r' % engine)
+    # Optional dependency (trollius); only required by this engine.
+    import punc.collect_async
+    async_engine = punc.collect_async.AsyncEngine(
+        punc.collect_async.NotchExecutor(agents),
+        max_requests=scheduler.limit,
+        max_requests_per_collection=scheduler.max_requests_per_collection,
+        max_requests_per_device=scheduler.max_requests_per_device,
+        threads=_option_or_config(options, config, 'async_threads', None),
+        parse_processes=int(_option_or_config(options, config,
+                                              'parse_processes',
+                                              DEFAULT_PARSE_PROCESSES)),
+        parse_threshold=int(config.get('parse_threshold',
+                                       DEFAULT_PARSE_THRESHOLD)))
+    logging.debug('Using %r', async_engine)
+    return async_engine
+
+
+def get_daemon(config, recipe_devices, build_collections, run_collections,
+               commit):
+    """Returns the daemon.Daemon for --daemon mode.
+
+    The daemon is configured in the top-level daemon section, e.g.,
+
+      daemon:
+        interval: 86400
+        jitter: 0.1
+        inventory_interval: 3600
+        max_sleep: 60
+
+    Recipes may set their own collection interval with 'interval'. See
+    daemon.Daemon for the other arguments.
+    """
+    settings = config.get('daemon') or {}
+    trigger = config.get('trigger') or {}
+    return punc.daemon.Daemon(
+        recipe_devices, build_collections, run_collections, commit,
+        interval=float(settings.get('interval', DEFAULT_DAEMON_INTERVAL_S)),
+        jitter=float(settings.get('jitter', DEFAULT_DAEMON_JITTER)),
+        inventory_interval=float(settings.get(
+            'inventory_interval', DEFAULT_DAEMON_INVENTORY_INTERVAL_S)),
+        max_sleep=float(settings.get('max_sleep',
+                                     DEFAULT_DAEMON_MAX_SLEEP_S)),
+        trigger_delay=float(trigger.get('delay', DEFAULT_TRIGGER_DELAY_S)),
+        trigger_max_delay=float(trigger.get('max_delay',
+                                            DEFAULT_TRIGGER_MAX_DELAY_S)))
+
+
+def get_trigger(config, daemon):
+    """Returns a trigger.SyslogListener triggering the daemon, or None.
+
+    Collection on configuration change is enabled by the top-level trigger
+    section, e.g.,
+
+      trigger:
+        address: 0.0.0.0
+        port: 514
+        udp: true
+        tcp: true
+        delay: 30
+        max_delay: 300
+        patterns: ['%SYS-5-CONFIG', 'UI_COMMIT']
+        hosts: {192.0.2.1: router1.example.net}
+
+    Messages from hosts not listed are matched to devices by name.
+    """
+    trigger = config.get('trigger')
+    if not trigger:
+        return None
+    resolver = punc.trigger.DeviceResolver(daemon.devices,
+                                           hosts=trigger.get('hosts'))
+    return punc.trigger.SyslogListener(
+        resolver, daemon.trigger,
+        address=trigger.get('address', '0.0.0.0'),
+        port=int(trigger.get('port', DEFAULT_TRIGGER_PORT)),
+        udp=bool(trigger.get('udp', True)),
+        tcp=bool(trigger.get('tcp', True)),
+        patterns=trigger.get('patterns'))
+
+
+def get_inventory(config, notch_client):
+    """Returns the inventory.Inventory of all Notch devices, or None.
+
+    The inventory is fetched from Notch once. If inventory_cache_ttl is
+    set, it is also cached on disk, and a cached inventory younger than
+    that many seconds is used instead of querying Notch.
+    """
+    ttl = float(config.get('inventory_cache_ttl',
+                           DEFAULT_INVENTORY_CACHE_TTL_S) or 0)
+    path = os.path.join(config.get('base_path'),
+                        config.get('inventory_cache_path',
+                                   DEFAULT_INVENTORY_CACHE_PATH))
+    if ttl > 0:
+        inventory = punc.inventory.Inventory.load(path, ttl)
+        if inventory is not None:
+            logging.debug('Using %r', inventory)
+            return inventory
+    devices = get_devices(notch_client, r'^.*$')
+    if not devices:
+        logging.error('No devices found in the Notch inventory')
+        return None
+    inventory = punc.inventory.Inventory(devices)
+    if ttl > 0:
+        inventory.save(path)
+    logging.debug('Using %r', inventory)
+    return inventory
+
+
+def get_recipes(collection):
+    """Returns the list of recipe dicts of a configured collection.
+
+    A collection is either a list of recipes, or a dict with the list of
+    recipes under 'recipes'.
+    """
+    if isinstance(collection, dict):
+        collection = collection.get('recipes')
+    return collection or []
+
+
+def get_recipe_devices(options, config, notch_client, inventory=None):
+    """Returns the devices to collect for each recipe in the configuration.
+
+    Every recipe of a collection is collected. Their collections share the
+    collection name, so they are scheduled together, under the same
+    per-collection request limit.
+
+    Args:
+      inventory: An inventory.Inventory, or None to fetch the inventory now.
+
+    Returns:
+      A list of tuples (collection name, recipe dict, set of device names).
+    """
     _collections = config.get('collections')
-    command_timeout = config.get('command_timeout', DEFAULT_COMMAND_TIMEOUT_S)
-    collect_timeout = config.get('collect_timeout', DEFAULT_COLLECT_TIMEOUT_S)
-    collections = []
+    shard = punc.shard.parse_shard(getattr(options, 'shard', None))
+    recipe_devices = []
+
+    if inventory is None:
+        inventory = get_inventory(config, notch_client)
+    if inventory is None:
+        return recipe_devices
+    # Command line device selection applies to every recipe.
+    selected = None
+    if options.device is not None or options.regexp is not None:
+        selected = inventory.match(options.regexp)
+        if options.device is not None:
+            selected &= set([options.device])
 
     for name, recipes in _collections.iteritems():
         logging.debug('Found collection %r', name)
-        if len(recipes) > 1:
-            logging.error('Collection %r has more than one recipe')
-
-        recipe = recipes[0]
 
         if options.collection is not None and name != options.collection:
             logging.debug('Collection name mismatch. Config: %s Found: %s',
                           name, options.collection)
             continue
 
-        device_regexp = recipe.get('regexp', r'^.*$')
-        _devices = get_devices(notch_client, device_regexp)
-        if not _devices:
-            logging.error('No devices found for recipe %r', name)
-            continue
-        else:
-            vendor = recipe.get('vendor')
-            ruleset = recipe.get('ruleset')
-            path = recipe.get('path') or ''
-
-            final_path = os.path.join(base_path, path)
-
-            devices = filter_devices(_devices, vendor=vendor)
-            recipe = punc.model.Recipe(
-                name=name, devices=devices, ruleset=ruleset)
-            collection = punc.collect.Collection(
-                recipe,
-                final_path,
-                notch_client,
-                command_timeout,
-                collect_timeout)
-            logging.debug('Adding %r', collection)
-            collections.append(collection)
+        for recipe in get_recipes(recipes):
+            devices = inventory.match(recipe.get('regexp', r'^.*$'),
+                                      vendor=recipe.get('vendor'))
+            if not devices:
+                logging.error('No devices found for collection %r recipe %r',
+                              name, recipe.get('ruleset'))
+                continue
+            if selected is not None:
+                devices &= selected
+                if not devices:
+                    continue
+            if shard is not None:
+                devices = set([d for d in devices
+                               if punc.shard.in_shard(d, shard)])
+            recipe_devices.append((name, recipe, devices))
+
+    return recipe_devices
+
+
+def build_collections(options, config, notch_client, scheduler=None,
+                      deadlines=None, history=None, retry=None,
+                      fingerprints=None, parse_pool=None, journal=None,
+                      result_cache=None, recipe_devices=None):
+    """Returns the collect.Collection objects for a run.
+
+    Args:
+      recipe_devices: A list as returned by get_recipe_devices, or None to
+        look up the devices of every recipe now.
+    """
+    base_path = config.get('base_path')
+    if recipe_devices is None:
+        recipe_devices = get_recipe_devices(options, config, notch_client)
+    collections = []
+
+    for name, recipe, devices in recipe_devices:
+        ruleset = recipe.get('ruleset')
+        path = recipe.get('path') or ''
+
+        final_path = os.path.join(base_path, path)
+        command_timeout, collect_timeout = get_timeouts(config, recipe)
+
+        recipe = punc.model.Recipe(
+            name=name, devices=devices, ruleset=ruleset)
+        collection = punc.collect.Collection(
+            recipe,
+            final_path,
+            notch_client,
+            command_timeout,
+            collect_timeout,
+            scheduler=scheduler,
+            deadlines=deadlines,
+            history=history,
+            retry=retry,
+            fingerprints=fingerprints,
+            parse_pool=parse_pool,
+            journal=journal,
+            result_cache=result_cache)
+        logging.debug('Adding %r', collection)
+        collections.append(collection)
 
     return collections
 
@@ -24,7 +24,8 @@ setuptools.setup(
 
     entry_points = {
         'console_scripts': [
-            'punc = punc.main:main'
+            'punc = punc.main:main',
+            'punc-benchmark = punc.benchmark:main',
             ]
         },
 
@@ -33,6 +34,8 @@ setuptools.setup(
                       'PyYAML',
                       ],
 
+    extras_require={'asyncio': ['trollius', 'futures']},
+
     url='http://code.google.com/p/punc/',
     author='Andrew Fort',
     author_email='notch-dev@googlegroups.com',
@@ -0,0 +1,102 @@
+#!/bin/env python
+
+# Copyright 2010 Andrew Fort
+
+
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import punc.archive
+import punc.output
+
+
+def config(rnd, version):
+    lines = ['hostname r1', 'version %d' % version]
+    for i in xrange(50):
+        lines.append('interface Gi0/%d' % i)
+        lines.append(' description %d' % i)
+    lines[rnd.randint(2, len(lines) - 1)] = ' shutdown'
+    return '\n'.join(lines) + '\n'
+
+
+class DeltaTest(unittest.TestCase):
+
+    def testRoundTrip(self):
+        rnd = random.Random(1)
+        for old, new in (('', 'a\n'), ('a\n', ''), ('a\nb', 'a\nb\nc'),
+                         ('\x00\xff\n\x01', '\x00\xff\n\x02\n'),
+                         (config(rnd, 1), config(rnd, 2))):
+            self.assertEqual(new, punc.archive.apply_delta(
+                old, punc.archive.encode_delta(old, new)))
+
+
+class ArchiveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.base_path = tempfile.mkdtemp()
+        self.path = os.path.join(self.base_path, 'router.db', 'r1')
+        os.makedirs(os.path.dirname(self.path))
+
+    def tearDown(self):
+        shutil.rmtree(self.base_path)
+
+    def add(self, data, when, keyframe_interval=3):
+        archive = punc.archive.Archive(
+            os.path.join(self.base_path, '.punc_archive'), self.base_path,
+            keyframe_interval=keyframe_interval, when=when)
+        f = punc.output.OutputFile(self.path, keep=True)
+        f.write(data)
+        f.close()
+        return archive, archive.add(f.name, f.digest, f.data)
+
+    def testVersions(self):
+        rnd = random.Random(2)
+        versions = [config(rnd, v) for v in xrange(8)]
+        for i, data in enumerate(versions):
+            archive, added = self.add(data, 100.0 + i)
+            self.assert_(added)
+        name = os.path.join('router.db', 'r1')
+        self.assertEqual(['K', 'D', 'D', 'K', 'D', 'D', 'K', 'D'],
+                         [e[1] for e in archive.index(name)])
+        for i, data in enumerate(versions):
+            self.assertEqual(data, archive.get(name, 100.0 + i))
+            self.assertEqual(data, archive.get(name, 100.5 + i))
+        self.assertEqual(versions[-1], archive.get(name))
+        self.assertEqual(None, archive.get(name, 99.0))
+        self.assertEqual(None, archive.get('router.db/r2'))
+
+    def testLargeChange(self):
+        # Versions too different to diff cheaply are keyframes.
+        self.add('hostname r1\n', 100.0)
+        archive, _ = self.add(''.join(['line %d\n' % i for i in xrange(
+            punc.archive.MAX_DIFF_LINES + 1)]), 200.0)
+        name = os.path.join('router.db', 'r1')
+        self.assertEqual(['K', 'K'], [e[1] for e in archive.index(name)])
+        self.assertEqual('line 0\n', archive.get(name)[:7])
+
+    def testMissingLatest(self):
+        name = os.path.join('router.db', 'r1')
+        rnd = random.Random(3)
+        versions = [config(rnd, v) for v in xrange(3)]
+        for i, data in enumerate(versions[:2]):
+            archive, _ = self.add(data, 100.0 + i)
+        os.remove(os.path.join(archive.directory, name) +
+                  archive.LATEST_SUFFIX)
+        archive, _ = self.add(versions[2], 102.0)
+        self.assertEqual('D', archive.index(name)[-1][1])
+        for i, data in enumerate(versions):
+            self.assertEqual(data, archive.get(name, 100.0 + i))
+
+    def testUnchanged(self):
+        self.add('hostname r1\n', 100.0)
+        archive, added = self.add('hostname r1\n', 200.0)
+        self.assertFalse(added)
+        self.assertEqual(1, len(archive.index(os.path.join('router.db',
+                                                           'r1'))))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+#!/bin/env python
+
+# Copyright 2010 Andrew Fort
+
+
+import unittest
+
+import punc.benchmark
+import punc.ruleset_factory
+
+
+class BenchmarkTest(unittest.TestCase):
+
+    def testCorpus(self):
+        for ruleset_class in punc.ruleset_factory.RULESETS:
+            data = punc.benchmark.corpus(ruleset_class.name, 500)
+            self.assertEqual(500, data.count('\n'))
+            self.assertEqual(data, punc.benchmark.corpus(ruleset_class.name,
+                                                         500))
+            # The corpus is parsed without errors.
+            for parser in punc.benchmark.parsers(ruleset_class):
+                parser(data).parse()
+
+    def testRun(self):
+        results = punc.benchmark.run(['cisco'], sizes=[100], repeat=1,
+                                     isolate=False)
+        self.assertEqual(['punc.rulesets.cisco.ParseShowVersion',
+                          'punc.rulesets.cisco.ParseConfiguration',
+                          'punc.rulesets.cisco.ParseFingerprint'],
+                         [r['parser'] for r in results])
+        for result in results:
+            self.assertEqual(100, result['lines'])
+            self.assert_(result['lines_per_second'] > 0)
+
+    def testCompare(self):
+        baseline = [{'parser': 'p', 'lines': 10, 'lines_per_second': 100.0},
+                    {'parser': 'q', 'lines': 10, 'lines_per_second': 100.0}]
+        results = [{'parser': 'p', 'lines': 10, 'lines_per_second': 85.0},
+                   {'parser': 'q', 'lines': 10, 'lines_per_second': 75.0},
+                   {'parser': 'r', 'lines': 10, 'lines_per_second': 1.0}]
+        regressions = punc.benchmark.compare(results, baseline, 0.2)
+        self.assertEqual([('q', 'q')],
+                         [(r['parser'], b['parser']) for r, b in regressions])
+
+
+if __name__ == '__main__':
+    unittest.main()
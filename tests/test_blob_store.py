@@ -0,0 +1,128 @@
+#!/bin/env python
+
+# Copyright 2010 Andrew Fort
+
+
+import hashlib
+import multiprocessing.pool
+import os
+import shutil
+import tempfile
+import unittest
+
+import punc.blob_store
+import punc.output
+
+
+class BlobStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.base_path = tempfile.mkdtemp()
+        self.store = punc.blob_store.BlobStore(
+            os.path.join(self.base_path, '.punc_blobs'), self.base_path)
+
+    def tearDown(self):
+        for root, dirs, files in os.walk(self.base_path):
+            for name in files:
+                os.chmod(os.path.join(root, name), 0644)
+        shutil.rmtree(self.base_path)
+
+    def write(self, name, data):
+        path = os.path.join(self.base_path, name)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        f = punc.output.OutputFile(path)
+        f.write(data)
+        f.close()
+        self.store.add(path, f.digest)
+
+    def testDedupe(self):
+        self.write('router.db/ar1', 'hostname x\n')
+        self.write('router.db/ar2', 'hostname x\n')
+        self.write('router.db/cr1', 'hostname y\n')
+        self.assertEqual(2, self.store.added)
+        self.assertEqual(3, len(self.store.manifest))
+        self.assertEqual(self.store.manifest[os.path.join('router.db', 'ar1')],
+                         self.store.manifest[os.path.join('router.db', 'ar2')])
+
+    def testMaterialize(self):
+        self.write('router.db/ar1', 'hostname x\n')
+        first = self.store.save_manifest('1')
+        self.write('router.db/ar1', 'hostname z\n')
+        self.assertEqual('2', self.store.save_manifest('2'))
+        self.assertEqual(['1', '2'], self.store.manifests())
+
+        dest = os.path.join(self.base_path, 'view')
+        self.assertEqual(1, self.store.materialize(first, dest))
+        f = open(os.path.join(dest, 'router.db', 'ar1'))
+        try:
+            self.assertEqual('hostname x\n', f.read())
+        finally:
+            f.close()
+
+    def testCarriedForward(self):
+        self.write('router.db/ar1', 'hostname x\n')
+        self.write('router.db/ar2', 'hostname y\n')
+        self.write('router.db/ar3', 'hostname z\n')
+        self.store.save_manifest()
+        os.remove(os.path.join(self.base_path, 'router.db', 'ar3'))
+        # The next run writes only ar1.
+        self.store = punc.blob_store.BlobStore(self.store.directory,
+                                               self.base_path)
+        self.write('router.db/ar1', 'hostname w\n')
+        second = self.store.save_manifest()
+        self.assertEqual(2, len(self.store.manifests()))
+        self.assertEqual(
+            [os.path.join('router.db', 'ar1'),
+             os.path.join('router.db', 'ar2')],
+            sorted(self.store.load_manifest(second).keys()))
+
+    def testPreviousDigest(self):
+        path = os.path.join(self.base_path, 'router.db', 'ar1')
+        self.assert_(self.store.previous_digest(path) is None)
+        self.write('router.db/ar1', 'hostname x\n')
+        self.store.save_manifest()
+        self.store = punc.blob_store.BlobStore(self.store.directory,
+                                               self.base_path)
+        self.assertEqual(hashlib.sha1('hostname x\n').hexdigest(),
+                         self.store.previous_digest(path))
+        self.assert_(self.store.previous_digest(
+            os.path.join(self.base_path, 'router.db', 'ar2')) is None)
+
+    def testConcurrentAdds(self):
+        paths = []
+        for i in xrange(40):
+            path = os.path.join(self.base_path, 'router.db', 'ar%d' % i)
+            if not paths:
+                os.makedirs(os.path.dirname(path))
+            f = punc.output.OutputFile(path)
+            f.write('hostname %d\n' % (i % 2) * 10000)
+            f.close()
+            paths.append((path, f.digest))
+        pool = multiprocessing.pool.ThreadPool(8)
+        try:
+            pool.map(lambda args: self.store.add(*args), paths)
+        finally:
+            pool.close()
+            pool.join()
+        self.assertEqual(40, len(self.store.manifest))
+        objects = []
+        for root, _, files in os.walk(os.path.join(self.store.directory,
+                                                   self.store.OBJECTS)):
+            objects.extend(files)
+        # No temporary files were left behind.
+        self.assertEqual(2, len(objects))
+        for i, (_, digest) in enumerate(paths[:2]):
+            f = open(self.store.object_path(digest))
+            try:
+                self.assertEqual('hostname %d\n' % i * 10000, f.read())
+            finally:
+                f.close()
+
+    def testEmptyManifest(self):
+        self.assertEqual(None, self.store.save_manifest())
+        self.assertEqual([], self.store.manifests())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,154 @@
+#!/bin/env python
+
+# Copyright 2010 Andrew Fort
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import punc.blob_store
+import punc.collect
+import punc.model
+
+
+class FakeResult(object):
+
+    def __init__(self, device_name, key, output, failed=False, cached=False):
+        self.key = key
+        self.output = output
+        self.cached = cached
+        self._device_name = device_name
+        self._failed = failed
+
+    def failed(self):
+        return self._failed
+
+    def device_name(self):
+        return self._device_name
+
+    def error_message(self):
+        return 'failed'
+
+
+class FakeCollection(object):
+
+    def __init__(self):
+        self.results = {}
+        self.target_listeners = []
+        self.released = []
+
+    def complete(self, target, results):
+        """Adds a target's final results, as a collection does."""
+        self.results[target] = results
+        for listener in self.target_listeners:
+            listener(self, target)
+
+    def release(self, target):
+        self.released.append(target)
+        self.results.pop(target, None)
+
+
+class CollatorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.base_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.base_path)
+
+    def target(self, device_name, header=''):
+        target = punc.model.Target(device_name=device_name, header=header)
+        target.base_path = os.path.join(self.base_path,
+                                        device_name[-1], 'configs')
+        return target
+
+    def collections(self, num_devices):
+        show, config = FakeCollection(), FakeCollection()
+        for i in xrange(num_devices):
+            name = 'r%d' % i
+            show.results[self.target(name, header='!%s\n' % name)] = [
+                FakeResult(name, (0, 1), 'version %d\n' % i),
+                FakeResult(name, (0, 0), 'show %d\n' % i)]
+            config.results[self.target(name, header='!ignored\n')] = [
+                FakeResult(name, (1, 0), 'hostname %s\n' % name)]
+        config.results[self.target('bad')] = [
+            FakeResult('bad', (0, 0), 'x', failed=True)]
+        return show, config
+
+    def collate(self, threads, num_devices=20):
+        collator = punc.collect.Collator(threads=threads)
+        for c in self.collections(num_devices):
+            collator.add_collection(c)
+        collator.collate()
+        return collator
+
+    def read(self, device_name):
+        f = open(self.target(device_name).name)
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+    def testThreads(self):
+        for threads in (0, 4):
+            collator = self.collate(threads)
+            for i in xrange(20):
+                self.assertEqual(
+                    '!r%d\nshow %d\nversion %d\nhostname r%d\n' % (i, i, i, i),
+                    self.read('r%d' % i))
+            self.assertFalse(os.path.exists(self.target('bad').name))
+            self.assertEqual({'bad': set(['failed'])}, collator.errors())
+        # The second run left every file as it was.
+        self.assertEqual(20, collator.unchanged)
+
+    def testStream(self):
+        collator = punc.collect.Collator(stream=True)
+        c = FakeCollection()
+        collator.add_collection(c)
+        for i in xrange(3):
+            name = 'r%d' % i
+            c.complete(self.target(name, header='!%s\n' % name),
+                       [FakeResult(name, (0, 1), 'version %d\n' % i),
+                        FakeResult(name, (0, 0), 'show %d\n' % i)])
+            # Written, closed and released as soon as the target completed.
+            self.assertEqual('!%s\nshow %d\nversion %d\n' % (name, i, i),
+                             self.read(name))
+            self.assertEqual([self.target(name).name], collator.written[i:])
+            self.assertEqual({}, c.results)
+            self.assertEqual({}, collator._file_objects)
+        bad = self.target('bad')
+        c.complete(bad, [FakeResult('bad', (0, 0), 'x', failed=True)])
+        # Failed results are kept for the error report.
+        self.assertEqual([bad], c.results.keys())
+        self.assertEqual(3, len(c.released))
+        collator.collate()
+        self.assertEqual(3, len(collator.written))
+        self.assertFalse(os.path.exists(bad.name))
+        self.assertEqual({'bad': set(['failed'])}, collator.errors())
+
+    def testCached(self):
+        directory = os.path.join(self.base_path, '.punc_blobs')
+        c = FakeCollection()
+        target = self.target('r1', header='!r1\n')
+        c.results[target] = [FakeResult('r1', (0, 0), 'show\n', cached=True)]
+
+        def collate():
+            store = punc.blob_store.BlobStore(directory, self.base_path)
+            collator = punc.collect.Collator(blob_store=store)
+            collator.add_collection(c)
+            collator.collate()
+            self.assertEqual([target.name], collator.written)
+            self.assertEqual('!r1\nshow\n', self.read('r1'))
+            return store
+
+        # Written, as the file does not exist.
+        self.assertEqual(1, len(collate().manifest))
+        # Left as it is, as the blob store has its digest.
+        self.assertEqual(0, len(collate().manifest))
+        shutil.rmtree(directory)
+        self.assertEqual(1, len(collate().manifest))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,518 @@
+#!/bin/env python
+
+# Copyright 2010 Andrew Fort
+
+
+import optparse
+import os
+import shutil
+import socket
+import tempfile
+import unittest
+
+import eventlet
+import notch.client
+import notch.client.errors
+
+import punc.collect
+import punc.fingerprint
+import punc.model
+import punc.output
+import punc.parser
+import punc.result_cache
+import punc.retry
+import punc.ruleset_factory
+import punc.rulesets.cisco
+import punc.rulesets.juniper
+import punc.rulesets.timetra
+import punc.schedule
+import punc.util
+
+
+class FakeNotchClient(object):
+    """Answers the requests sent to it when run() is called."""
+
+    def __init__(self, respond):
+        """Initialiser.
+
+        Args:
+          respond: A callable, called with each request to set its result
+            or error.
+        """
+        self.respond = respond
+        self.sent = []
+        # Tuples ('sent' or 'done', device name, command), in order.
+        self.events = []
+        # Device name -> most requests in flight at once.
+        self.max_in_flight = {}
+        self._pending = []
+
+    def exec_request(self, request, callback=None):
+        request.callback = callback
+        self.sent.append(request)
+        self._pending.append(request)
+        device_name = request.arguments['device_name']
+        self.events.append(('sent', device_name,
+                            request.arguments['command']))
+        in_flight = len([r for r in self._pending
+                         if r.arguments['device_name'] == device_name])
+        self.max_in_flight[device_name] = max(
+            self.max_in_flight.get(device_name, 0), in_flight)
+
+    def run(self):
+        while self._pending:
+            request = self._pending.pop(0)
+            self.respond(request)
+            self.events.append(('done', request.arguments['device_name'],
+                                request.arguments['command']))
+            request.callback(request, *request.callback_args)
+
+
+def action(command, key):
+    return punc.model.Action('command', {'command': command}, key=key)
+
+
+class FakeRuleset(punc.model.Ruleset):
+
+    name = 'test_collect'
+
+    def rules(self):
+        return [punc.model.Rule([action('show version', (0, 0))])]
+
+
+class ChainsRuleset(punc.model.Ruleset):
+
+    name = 'test_collect_chains'
+
+    def rules(self):
+        return [punc.model.Rule([action('a1', (0, 0)), action('a2', (0, 1))]),
+                punc.model.Rule([action('b1', (1, 0)), action('b2', (1, 1))],
+                                independent=True),
+                punc.model.Rule([action('c1', (2, 0))], independent=True),
+                punc.model.Rule([action('d1', (3, 0))])]
+
+
+class ParsedRuleset(punc.model.Ruleset):
+
+    name = 'test_collect_parsed'
+
+    def rules(self):
+        return [punc.model.Rule([
+            punc.model.Action('command', {'command': command}, key=key,
+                              parser=punc.parser.Parser)
+            for command, key in (('show version', (0, 0)),
+                                 ('show config', (0, 1)))])]
+
+
+def answer(request):
+    request.result = '%s\n' % request.arguments['command']
+
+
+# Rulesets with fingerprints, and sample fingerprint command output.
+FINGERPRINTS = (
+    (punc.rulesets.cisco.IosRuleset,
+     '! Last configuration change at 10:00:00 UTC Mon Jan 4 2010 by %s\n'),
+    (punc.rulesets.juniper.JunosRuleset,
+     '0   2010-01-04 10:00:00 UTC by %s via cli\n'),
+    (punc.rulesets.timetra.TimetraRuleset,
+     'Time Last Modified     : 2010/01/04 10:00:00 %s\n'),
+    )
+
+
+class DeviceRequestsTest(unittest.TestCase):
+
+    def requests(self, *chains):
+        return [[notch.client.Request('command', {'command': c})
+                 for c in chain] for chain in chains]
+
+    def commands(self, requests):
+        return [r.arguments['command'] for r in requests]
+
+    def testChainsConcurrent(self):
+        d = punc.collect.DeviceRequests(
+            self.requests(['a1', 'a2'], ['b1'], ['c1']), max_in_flight=2)
+        self.assertEqual(4, len(d))
+        sent = [d.next_request(), d.next_request()]
+        self.assertEqual(['a1', 'b1'], self.commands(sent))
+        # At the limit.
+        self.failIf(d.ready())
+        self.assertEqual(None, d.next_request())
+        d.done(sent[1])
+        # The next chain with nothing in flight.
+        self.assertEqual(['c1'], self.commands([d.next_request()]))
+        d.done(sent[0])
+        self.assertEqual(['a2'], self.commands([d.next_request()]))
+        self.failIf(d.ready())
+
+    def testChainSerial(self):
+        d = punc.collect.DeviceRequests(self.requests(['a1', 'a2', 'a3']),
+                                        max_in_flight=3)
+        first = d.next_request()
+        # The chain's next request waits for the first.
+        self.failIf(d.ready())
+        self.assertEqual(None, d.next_request())
+        d.done(first)
+        self.assertEqual(['a2'], self.commands([d.next_request()]))
+
+    def testProbeFirst(self):
+        probe = notch.client.Request('command', {'command': 'probe'})
+        d = punc.collect.DeviceRequests(self.requests(['a1'], ['b1']),
+                                        max_in_flight=2, probe=probe)
+        self.assertEqual(2, len(d))
+        self.assert_(d.next_request() is probe)
+        self.failIf(d.ready())
+        d.done(probe)
+        self.assertEqual(['a1', 'b1'],
+                         self.commands([d.next_request(), d.next_request()]))
+
+    def testClear(self):
+        d = punc.collect.DeviceRequests(self.requests(['a1', 'a2'], ['b1']),
+                                        max_in_flight=2)
+        sent = d.next_request()
+        self.assertEqual(['a2', 'b1'], self.commands(d.clear()))
+        self.assertEqual(0, len(d))
+        d.done(sent)
+        self.failIf(d.ready())
+
+
+class CollectionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.base_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.base_path)
+
+    def collect(self, respond, devices=('r1',), ruleset=FakeRuleset,
+                scheduler=None, collator=None, finish=True, **kwargs):
+        registered = ruleset.name not in punc.ruleset_factory.rulesets
+        if registered:
+            punc.ruleset_factory.rulesets[ruleset.name] = ruleset
+        try:
+            nc = FakeNotchClient(respond)
+            recipe = punc.model.Recipe('test', devices=set(devices),
+                                       ruleset=ruleset.name)
+            c = punc.collect.Collection(recipe, self.base_path, nc, 0, 0,
+                                        scheduler=scheduler, **kwargs)
+            if collator is not None:
+                collator.add_collection(c)
+            c.start()
+            if scheduler is not None:
+                scheduler.dispatch()
+            for _ in xrange(500):
+                nc.run()
+                if c.finished() or not finish:
+                    break
+                # Results are looked up in the result cache off the hub.
+                eventlet.sleep(0.01)
+        finally:
+            if registered:
+                del punc.ruleset_factory.rulesets[ruleset.name]
+        if finish:
+            self.assert_(c.finished())
+        return c, nc
+
+    def sent_after_done(self, events, device_name, first, second):
+        """Returns True if a command was sent after another completed."""
+        return (events.index(('sent', device_name, second)) >
+                events.index(('done', device_name, first)))
+
+    def outputs(self, c):
+        outputs = []
+        for results in c.results.itervalues():
+            outputs.extend([r.output for r in results])
+        return sorted(outputs)
+
+    def retry_policy(self):
+        return punc.retry.RetryPolicy(max_attempts=3, base_delay=0.0,
+                                      jitter=0.0)
+
+    def testPermanentErrorNotRetried(self):
+
+        def respond(request):
+            request.error = notch.client.errors.AuthenticationError()
+
+        c, nc = self.collect(respond, retry=self.retry_policy())
+        self.assertEqual(1, len(nc.sent))
+        self.assertEqual(['r1'], c.devices_with_errors())
+
+    def testTimeoutRetried(self):
+        attempts = []
+
+        def respond(request):
+            attempts.append(request)
+            if len(attempts) < 3:
+                request.error = notch.client.TimeoutError()
+            else:
+                request.result = 'version 1\n'
+
+        c, nc = self.collect(respond, retry=self.retry_policy())
+        self.assertEqual(3, len(nc.sent))
+        self.assertEqual([], c.devices_with_errors())
+        self.assertEqual(['version 1\n'],
+                         [r.output for r in c.results.values()[0]])
+
+    def testRetriesExhausted(self):
+
+        def respond(request):
+            request.error = socket.error('agent went away')
+
+        c, nc = self.collect(respond, retry=self.retry_policy())
+        self.assertEqual(3, len(nc.sent))
+        self.assertEqual(['r1'], c.devices_with_errors())
+
+    def testTimedOutRetriesDropped(self):
+        scheduler = punc.schedule.Scheduler()
+
+        def respond(request):
+            request.error = notch.client.TimeoutError()
+
+        c, nc = self.collect(
+            respond, devices=('r1', 'r2'), scheduler=scheduler, finish=False,
+            retry=punc.retry.RetryPolicy(max_attempts=3, base_delay=60.0,
+                                         jitter=0.0))
+        # Both devices wait a minute to retry.
+        self.assertEqual(2, len(nc.sent))
+        self.assertFalse(scheduler.finished())
+        c.timed_out()
+        self.assert_(c.finished())
+        self.assert_(scheduler.finished())
+        self.assertEqual(['r1', 'r2'], c.devices_with_errors())
+
+    def testIndependentRulesConcurrent(self):
+        for limit in (2, 3):
+            c, nc = self.collect(
+                answer, devices=('r1', 'r2'), ruleset=ChainsRuleset,
+                scheduler=punc.schedule.Scheduler(
+                    max_requests_per_device=limit))
+            self.assertEqual({'r1': limit, 'r2': limit}, nc.max_in_flight)
+            self.assertEqual(sorted(['a1\n', 'a2\n', 'b1\n', 'b2\n',
+                                     'c1\n', 'd1\n'] * 2), self.outputs(c))
+            for device_name in ('r1', 'r2'):
+                # Each rule's actions, and the dependent rules, stay serial.
+                for first, second in (('a1', 'a2'), ('a2', 'd1'),
+                                      ('b1', 'b2')):
+                    self.assert_(self.sent_after_done(
+                        nc.events, device_name, first, second),
+                        (first, second, nc.events))
+
+    def testDeviceLimitRespectsGlobalLimit(self):
+        c, nc = self.collect(
+            answer, ruleset=ChainsRuleset,
+            scheduler=punc.schedule.Scheduler(max_requests=1,
+                                              max_requests_per_device=3))
+        self.assertEqual({'r1': 1}, nc.max_in_flight)
+        self.assertEqual(6, len(self.outputs(c)))
+
+    def testOneRequestPerDeviceByDefault(self):
+        options = optparse.Values()
+        scheduler = punc.util.get_scheduler(options, {}, None)
+        self.assertEqual(1, scheduler.max_requests_per_device)
+        c, nc = self.collect(answer, devices=('r1', 'r2'),
+                             ruleset=ChainsRuleset, scheduler=scheduler)
+        self.assertEqual({'r1': 1, 'r2': 1}, nc.max_in_flight)
+        # Without a scheduler, the collection's own has the same default.
+        c, nc = self.collect(answer, ruleset=ChainsRuleset)
+        self.assertEqual({'r1': 1}, nc.max_in_flight)
+        self.assertEqual(6, len(self.outputs(c)))
+
+    def testStreamedTargetsReleased(self):
+        collator = punc.collect.Collator(stream=True)
+        written = []
+
+        def respond(request):
+            written.append(len(collator.written))
+            answer(request)
+
+        c, nc = self.collect(respond, devices=('r1', 'r2', 'r3'),
+                             collator=collator)
+        # Each device was written as it completed, before the next answer.
+        self.assertEqual([0, 1, 2], written)
+        self.assertEqual({}, c.results)
+        for name in collator.written:
+            f = open(name)
+            try:
+                self.assertEqual('show version\n', f.read())
+            finally:
+                f.close()
+        collator.collate()
+        self.assertEqual(3, len(collator.written))
+
+    def collect_cached(self, respond, result_cache, opened=None):
+        """Collects and collates ParsedRuleset, counting files opened."""
+        collator = punc.collect.Collator()
+        c, nc = self.collect(respond, ruleset=ParsedRuleset,
+                             collator=collator, result_cache=result_cache)
+        output_file = punc.output.OutputFile
+
+        def open_output(*args, **kwargs):
+            opened.append(args[0])
+            return output_file(*args, **kwargs)
+
+        if opened is not None:
+            punc.output.OutputFile = open_output
+        try:
+            collator.collate()
+        finally:
+            punc.output.OutputFile = output_file
+        return c, collator
+
+    def testResultCache(self):
+        result_cache = punc.result_cache.ResultCache(
+            os.path.join(self.base_path, 'cache'))
+        c, collator = self.collect_cached(answer, result_cache)
+        self.assertEqual([False, False],
+                         [r.cached for r in c.results.values()[0]])
+        self.assertEqual(0, collator.unchanged)
+        opened = []
+        c, collator = self.collect_cached(answer, result_cache, opened)
+        self.assertEqual([True, True],
+                         [r.cached for r in c.results.values()[0]])
+        # The file of cached results was left as it is, unread.
+        self.assertEqual([], opened)
+        self.assertEqual(1, collator.unchanged)
+        self.assertEqual(c.results.keys()[0].name, collator.written[0])
+        f = open(collator.written[0])
+        try:
+            self.assertEqual('show version\nshow config\n', f.read())
+        finally:
+            f.close()
+        self.assertEqual(2, result_cache.hits)
+
+    def testResultCacheFileChanged(self):
+        result_cache = punc.result_cache.ResultCache(
+            os.path.join(self.base_path, 'cache'))
+        c, collator = self.collect_cached(answer, result_cache)
+        f = open(collator.written[0], 'w')
+        f.write('edited\n')
+        f.close()
+        opened = []
+        c, collator = self.collect_cached(answer, result_cache, opened)
+        # The file's size differs from the cached output's; it is rewritten.
+        self.assertEqual(collator.written, opened)
+        f = open(collator.written[0])
+        try:
+            self.assertEqual('show version\nshow config\n', f.read())
+        finally:
+            f.close()
+
+    def testResultCacheForgetsUnwrittenTargets(self):
+        result_cache = punc.result_cache.ResultCache(
+            os.path.join(self.base_path, 'cache'))
+        self.collect_cached(answer, result_cache)
+
+        def respond(request, error=False):
+            if request.arguments['command'] == 'show config':
+                if error:
+                    request.error = notch.client.errors.AuthenticationError()
+                else:
+                    answer(request)
+            else:
+                # A change of the same size.
+                request.result = 'show VERSION\n'
+
+        c, collator = self.collect_cached(
+            lambda request: respond(request, error=True), result_cache)
+        self.assertEqual([], collator.written)
+        # The device's results are parsed again, and its file rewritten.
+        opened = []
+        c, collator = self.collect_cached(respond, result_cache, opened)
+        self.assertEqual([False, False],
+                         [r.cached for r in c.results.values()[0]])
+        self.assertEqual(collator.written, opened)
+        f = open(collator.written[0])
+        try:
+            self.assertEqual('show VERSION\nshow config\n', f.read())
+        finally:
+            f.close()
+
+    def collect_fingerprinted(self, ruleset, fingerprints, fingerprint):
+        """Collects and writes a device, which has a fingerprint (or None)."""
+
+        def respond(request):
+            if (request.arguments['command'] ==
+                ruleset.cmd_fingerprint['command']):
+                if fingerprint is None:
+                    request.error = notch.client.errors.CommandError()
+                else:
+                    request.result = fingerprint
+            else:
+                answer(request)
+
+        collator = punc.collect.Collator()
+        c, nc = self.collect(respond, ruleset=ruleset,
+                             fingerprints=fingerprints, collator=collator)
+        collator.collate()
+        c.update_fingerprints()
+        return c, nc
+
+    def testFingerprintUnchanged(self):
+        for ruleset, output in FINGERPRINTS:
+            fingerprints = punc.fingerprint.FingerprintStore()
+            self.collect_fingerprinted(ruleset, fingerprints, output % 'a')
+            c, nc = self.collect_fingerprinted(ruleset, fingerprints,
+                                               output % 'a')
+            # Only the fingerprint was requested.
+            self.assertEqual([ruleset.cmd_fingerprint['command']],
+                             [r.arguments['command'] for r in nc.sent])
+            self.assertEqual(set(['r1']), c.skipped)
+            self.assertEqual({}, c.results)
+            self.assert_('1 unchanged (skipped)' in
+                         punc.collect.summary_report([c]))
+            self.assertEqual((output % 'a').strip(),
+                             fingerprints.get('r1', ruleset.name))
+
+    def testFingerprintChanged(self):
+        for ruleset, output in FINGERPRINTS:
+            fingerprints = punc.fingerprint.FingerprintStore()
+            self.collect_fingerprinted(ruleset, fingerprints, output % 'a')
+            c, nc = self.collect_fingerprinted(ruleset, fingerprints,
+                                               output % 'b')
+            self.assertEqual(3, len(nc.sent))
+            self.assertEqual(set(), c.skipped)
+            self.assert_('0 unchanged (skipped)' in
+                         punc.collect.summary_report([c]))
+            self.assertEqual((output % 'b').strip(),
+                             fingerprints.get('r1', ruleset.name))
+
+    def testFingerprintMissing(self):
+        for ruleset, output in FINGERPRINTS:
+            fingerprints = punc.fingerprint.FingerprintStore()
+            # Nothing stored yet.
+            c, nc = self.collect_fingerprinted(ruleset, fingerprints,
+                                               output % 'a')
+            self.assertEqual(3, len(nc.sent))
+            self.assertEqual(set(), c.skipped)
+            # The fingerprint command failed.
+            c, nc = self.collect_fingerprinted(ruleset, fingerprints, None)
+            self.assertEqual(3, len(nc.sent))
+            self.assertEqual(set(), c.skipped)
+            self.assertEqual([], c.devices_with_errors())
+            # The fingerprint of the last successful collection is kept.
+            self.assertEqual((output % 'a').strip(),
+                             fingerprints.get('r1', ruleset.name))
+
+    def testFingerprintDeviceError(self):
+        errors = ("% Invalid input detected at '^' marker.\n",
+                  'error: syntax error, expecting <command>\n')
+        for (ruleset, output), error in zip(FINGERPRINTS, errors):
+            fingerprints = punc.fingerprint.FingerprintStore()
+            self.collect_fingerprinted(ruleset, fingerprints, output % 'a')
+            # The device could not report its fingerprint.
+            c, nc = self.collect_fingerprinted(ruleset, fingerprints, error)
+            self.assertEqual(3, len(nc.sent))
+            self.assertEqual(set(), c.skipped)
+
+    def testFingerprintTargetsMissing(self):
+        ruleset, output = FINGERPRINTS[0]
+        fingerprints = punc.fingerprint.FingerprintStore()
+        self.collect_fingerprinted(ruleset, fingerprints, output % 'a')
+        shutil.rmtree(self.base_path)
+        c, nc = self.collect_fingerprinted(ruleset, fingerprints,
+                                           output % 'a')
+        self.assertEqual(3, len(nc.sent))
+        self.assertEqual(set(), c.skipped)
+
+
+if __name__ == '__main__':
+    unittest.main()
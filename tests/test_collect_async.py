@@ -0,0 +1,94 @@
+#!/bin/env python
+
+# Copyright 2010 Andrew Fort
+
+
+import time
+import unittest
+
+import trollius as asyncio
+
+import punc.collect
+import punc.collect_async
+import punc.model
+
+
+CONFIG = 'hostname r1\n!\ninterface Gi0\n'
+
+
+def execute(request):
+    if request.arguments['device_name'].startswith('slow'):
+        time.sleep(0.5)
+    if request.arguments.get('command') == 'show version':
+        request.result = 'Cisco IOS Software, Version 12.2\n'
+    else:
+        request.result = CONFIG
+    return request
+
+
+class AsyncEngineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        # Let abandoned requests return before closing the loop.
+        self.loop.run_until_complete(asyncio.sleep(0.5, loop=self.loop))
+        self.loop.close()
+
+    def collect(self, devices, command_timeout=10.0):
+        recipe = punc.model.Recipe('test', set(devices), 'cisco')
+        collection = punc.collect.Collection(recipe, '/nonexistent', None,
+                                             command_timeout, 60.0)
+        engine = punc.collect_async.AsyncEngine(
+            execute, max_requests=2, max_requests_per_device=2,
+            loop=self.loop)
+        try:
+            engine.run([collection])
+        finally:
+            engine.close()
+        return collection
+
+    def testCollect(self):
+        c = self.collect(['r1', 'r2', 'r3'])
+        self.assert_(c.finished())
+        self.assertEqual(c.num_resp_received, 6)
+        self.assertEqual(c.errors(), {})
+        self.assertEqual(len(c.results), 3)
+
+    def testThreads(self):
+        for max_requests, threads, expected in ((None, None, 64),
+                                                (2, None, 4),
+                                                (500, None, 1000),
+                                                (500, 8, 8)):
+            engine = punc.collect_async.AsyncEngine(
+                execute, max_requests=max_requests, threads=threads,
+                loop=self.loop)
+            try:
+                self.assertEqual(expected, engine.threads)
+                self.assert_('threads=%d' % expected in repr(engine))
+            finally:
+                engine.close()
+
+    def testPeakInFlight(self):
+        recipe = punc.model.Recipe('test', set(['slow%d' % i
+                                                for i in xrange(6)]), 'cisco')
+        collection = punc.collect.Collection(recipe, '/nonexistent', None,
+                                             10.0, 60.0)
+        engine = punc.collect_async.AsyncEngine(execute, max_requests=4,
+                                                loop=self.loop)
+        try:
+            engine.run([collection])
+        finally:
+            engine.close()
+        # Limited by max_requests, not by the thread pool.
+        self.assertEqual(4, engine.peak_in_flight)
+
+    def testCommandTimeout(self):
+        c = self.collect(['r1', 'slow'], command_timeout=0.1)
+        self.assert_(c.finished())
+        self.assertEqual(c.devices_with_errors(), ['slow'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,177 @@
+#!/bin/env python
+
+# Copyright 2010 Andrew Fort
+
+
+import unittest
+
+import punc.daemon
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class DeviceScheduleTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.schedule = punc.daemon.DeviceSchedule(jitter=0.1,
+                                                   clock=self.clock)
+
+    def testFirstCollectionWithinInterval(self):
+        self.schedule.update(dict([(('c', 'r%d' % i), 100.0)
+                                   for i in xrange(50)]))
+        self.assertEqual(len(self.schedule), 50)
+        self.clock.now += 100.0
+        self.assertEqual(len(self.schedule.due()), 50)
+
+    def testCollectedWithJitter(self):
+        self.schedule.update({('c', 'r1'): 100.0})
+        self.clock.now += 100.0
+        self.schedule.collected(('c', 'r1'))
+        self.failIf(self.schedule.due())
+        next_due = self.schedule.next_due() - self.clock.now
+        self.assert_(90.0 <= next_due <= 110.0, next_due)
+
+    def testTriggerMaxDelay(self):
+        self.schedule.update({('c', 'r1'): 1000.0})
+        self.schedule.collected(('c', 'r1'))
+        for _ in xrange(10):
+            self.schedule.trigger(('c', 'r1'), 30.0, max_delay=100.0)
+            self.clock.now += 20.0
+        self.assertEqual(self.schedule.due(), set([('c', 'r1')]))
+
+    def testRemovedDevices(self):
+        self.schedule.update({('c', 'r1'): 100.0, ('c', 'r2'): 100.0})
+        self.schedule.update({('c', 'r2'): 100.0})
+        self.assertEqual(len(self.schedule), 1)
+        self.schedule.collected(('c', 'r1'))
+        self.assertEqual(len(self.schedule), 1)
+
+
+class DaemonTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.inventory_queries = 0
+        self.built = []
+        self.commits = 0
+        self.daemon = punc.daemon.Daemon(
+            self.recipe_devices, self.build_collections, self.run_collections,
+            self.commit, interval=100.0, inventory_interval=1000.0,
+            clock=self.clock)
+
+    def recipe_devices(self):
+        self.inventory_queries += 1
+        return [('default', {'ruleset': 'cisco'}, set(['r1', 'r2'])),
+                ('core', {'ruleset': 'juniper', 'interval': 10},
+                 set(['r3']))]
+
+    def build_collections(self, recipe_devices):
+        self.built.append(recipe_devices)
+        return []
+
+    def run_collections(self, collections):
+        pass
+
+    def commit(self):
+        self.commits += 1
+
+    def testRunOnce(self):
+        self.daemon.refresh_inventory()
+        self.clock.now += 100.0
+        self.assertEqual(self.daemon.run_once(), 3)
+        self.assertEqual(self.commits, 1)
+        self.assertEqual(len(self.built[0]), 2)
+        # Only the core device's (shorter) interval has passed.
+        self.clock.now += 20.0
+        self.assertEqual(self.daemon.run_once(), 1)
+        self.assertEqual(self.built[1], [('core', {'ruleset': 'juniper',
+                                                   'interval': 10},
+                                          set(['r3']))])
+        self.assertEqual(self.inventory_queries, 1)
+
+    def testTrigger(self):
+        daemon = punc.daemon.Daemon(
+            lambda: self.recipe_devices()[:1], self.build_collections,
+            self.run_collections, self.commit, interval=1000.0,
+            inventory_interval=10000.0, trigger_delay=30.0, clock=self.clock)
+        daemon.refresh_inventory()
+        self.assertEqual(daemon.devices(), set(['r1', 'r2']))
+        self.clock.now += 1000.0
+        self.assertEqual(daemon.run_once(), 2)
+        self.failIf(daemon.trigger('r9'))
+        self.assert_(daemon.trigger('r1'))
+        # A burst of changes is collected once, after the trigger delay.
+        self.clock.now += 20.0
+        daemon.trigger('r1')
+        self.clock.now += 20.0
+        self.assertEqual(daemon.run_once(), 0)
+        self.clock.now += 10.0
+        self.assertEqual(daemon.run_once(), 1)
+        self.assertEqual(self.built[-1], [('default', {'ruleset': 'cisco'},
+                                           set(['r1']))])
+
+    def testInventoryFailure(self):
+        inventories = [self.recipe_devices(), [], None]
+
+        def recipe_devices():
+            inventory = inventories.pop(0)
+            if inventory is None:
+                raise IOError('Notch is down')
+            return inventory
+
+        daemon = punc.daemon.Daemon(
+            recipe_devices, self.build_collections, self.run_collections,
+            self.commit, interval=100.0, clock=self.clock)
+        for _ in xrange(3):
+            daemon.refresh_inventory()
+            self.assertEqual(daemon.devices(), set(['r1', 'r2', 'r3']))
+        self.clock.now += 100.0
+        self.assertEqual(daemon.run_once(), 3)
+
+    def testRunSurvivesFailure(self):
+        runs = []
+        sleeps = []
+
+        def run_collections(collections):
+            runs.append(self.clock.now)
+            if len(runs) == 1:
+                raise ValueError('bad collection')
+            daemon.stop()
+
+        def sleep(seconds):
+            sleeps.append(seconds)
+            self.clock.now += seconds
+
+        daemon = punc.daemon.Daemon(
+            lambda: self.recipe_devices()[:1], self.build_collections,
+            run_collections, self.commit, interval=100.0, max_sleep=1000.0,
+            clock=self.clock)
+        daemon._sleep = sleep
+        daemon.refresh_inventory()
+        self.clock.now += 100.0
+        daemon.run()
+        self.assertEqual(2, len(runs))
+        self.assertEqual(1, self.commits)
+        # The failed devices were rescheduled, not collected again at once.
+        self.assert_(runs[1] - runs[0] >= 90.0, runs)
+        self.assertEqual(1, len(sleeps))
+
+    def testNothingDue(self):
+        self.daemon.run_once()
+        self.clock.now += 200.0
+        self.daemon.run_once()
+        commits = self.commits
+        self.assertEqual(self.daemon.run_once(), 0)
+        self.assertEqual(self.commits, commits)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+#!/bin/env python
+
+# Copyright 2010 Andrew Fort
+
+
+import unittest
+
+import punc.deadline
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeCollection(object):
+
+    name = 'fake'
+
+    def __init__(self):
+        self.timed_out_requests = []
+        self.collection_timed_out = False
+
+    def request_timed_out(self, request):
+        self.timed_out_requests.append(request)
+
+    def timed_out(self):
+        self.collection_timed_out = True
+
+
+class DeadlineEngineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.engine = punc.deadline.DeadlineEngine(clock=self.clock)
+        self.collection = FakeCollection()
+
+    def testRequestCompletesInTime(self):
+        self.engine.start_request(self.collection, 'req', 10)
+        self.clock.now += 5
+        self.engine.check()
+        self.assert_(self.engine.end_request('req'))
+        self.assertEqual(self.collection.timed_out_requests, [])
+
+    def testRequestTimesOut(self):
+        self.engine.start_request(self.collection, 'req', 10)
+        self.clock.now += 11
+        self.engine.check()
+        self.assertEqual(self.collection.timed_out_requests, ['req'])
+        # A late response is reported as already abandoned.
+        self.failIf(self.engine.end_request('req'))
+
+    def testNoTimeout(self):
+        self.engine.start_request(self.collection, 'req', None)
+        self.clock.now += 1e6
+        self.engine.check()
+        self.assertEqual(self.collection.timed_out_requests, [])
+
+    def testCollectionTimesOut(self):
+        self.engine.start_collection(self.collection, 60)
+        self.engine.start_request(self.collection, 'req', 600)
+        self.assertEqual(self.engine.outstanding(self.collection), ['req'])
+        self.clock.now += 61
+        self.engine.check()
+        self.assert_(self.collection.collection_timed_out)
+
+    def testCollectionEnded(self):
+        self.engine.start_collection(self.collection, 60)
+        self.engine.end_collection(self.collection)
+        self.clock.now += 61
+        self.engine.check()
+        self.failIf(self.collection.collection_timed_out)
+
+
+if __name__ == '__main__':
+    unittest.main()
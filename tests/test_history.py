@@ -0,0 +1,57 @@
+#!/bin/env python
+
+# Copyright 2010 Andrew Fort
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import punc.history
+
+
+class HistoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'sub', '.punc_history')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def testUnknownDevice(self):
+        h = punc.history.DurationHistory()
+        self.assertEqual(h.expected('r1', ['cisco:(0, 0)']), None)
+
+    def testExpected(self):
+        h = punc.history.DurationHistory()
+        h.record('r1', 'a', 10.0)
+        h.record('r1', 'b', 2.0)
+        self.assertEqual(h.expected('r1', ['a', 'b', 'c']), 12.0)
+        self.assertEqual(h.expected('r1', ['c']), None)
+
+    def testMovingAverage(self):
+        h = punc.history.DurationHistory()
+        h.record('r1', 'a', 10.0)
+        h.record('r1', 'a', 20.0)
+        self.assertEqual(h.expected('r1', ['a']), 15.0)
+
+    def testSaveAndLoad(self):
+        h = punc.history.DurationHistory(self.path)
+        h.record('r1', 'a', 3.0)
+        h.save()
+        self.assertEqual(
+            punc.history.DurationHistory(self.path).expected('r1', ['a']), 3.0)
+
+    def testCorruptFile(self):
+        os.makedirs(os.path.dirname(self.path))
+        f = open(self.path, 'w')
+        f.write('{not json')
+        f.close()
+        h = punc.history.DurationHistory(self.path)
+        self.assertEqual(h.expected('r1', ['a']), None)
+
+
+if __name__ == '__main__':
+    unittest.main()
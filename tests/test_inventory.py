@@ -0,0 +1,74 @@
+#!/bin/env python
+
+# Copyright 2010 Andrew Fort
+
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import punc.inventory
+
+
+DEVICES = {'ar1.syd': {'device_type': 'cisco'},
+           'ar2.syd': {'device_type': 'cisco'},
+           'cr1.syd': {'device_type': 'juniper'},
+           'xr1.mel': {'device_type': 'juniper'},
+           'bad': None,
+           }
+
+
+class InventoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, '.punc_inventory')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def testMatch(self):
+        inventory = punc.inventory.Inventory(DEVICES)
+        self.assertEqual(4, len(inventory))
+        self.assertEqual(set(['ar1.syd', 'ar2.syd', 'cr1.syd', 'xr1.mel']),
+                         inventory.match())
+        self.assertEqual(set(['ar1.syd', 'ar2.syd']),
+                         inventory.match(r'^.*$', vendor='cisco'))
+        self.assertEqual(set(['cr1.syd']),
+                         inventory.match(r'.*\.syd', vendor='juniper'))
+        # Regexps match from the start of the name, as Notch does.
+        self.assertEqual(set(), inventory.match(r'syd'))
+        self.assertEqual(set(), inventory.match(r'.*', vendor='unknown'))
+
+    def testCache(self):
+        inventory = punc.inventory.Inventory(DEVICES)
+        inventory.save(self.path)
+        loaded = punc.inventory.Inventory.load(self.path, 60)
+        self.assert_(loaded is not None)
+        self.assertEqual(inventory.devices, loaded.devices)
+        self.assertEqual(inventory.fetched, loaded.fetched)
+        self.assertEqual(set(['xr1.mel']),
+                         loaded.match(r'xr', vendor='juniper'))
+        for name in loaded.devices:
+            self.assert_(isinstance(name, str))
+
+    def testCacheExpired(self):
+        inventory = punc.inventory.Inventory(DEVICES,
+                                             fetched=time.time() - 120)
+        inventory.save(self.path)
+        self.assert_(punc.inventory.Inventory.load(self.path, 60) is None)
+        self.assert_(punc.inventory.Inventory.load(self.path, 600)
+                     is not None)
+
+    def testCacheMissingOrCorrupt(self):
+        self.assert_(punc.inventory.Inventory.load(self.path, 60) is None)
+        f = open(self.path, 'w')
+        f.write('{"fetched": ')
+        f.close()
+        self.assert_(punc.inventory.Inventory.load(self.path, 60) is None)
+
+
+if __name__ == '__main__':
+    unittest.main()
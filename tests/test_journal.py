@@ -0,0 +1,116 @@
+#!/bin/env python
+
+# Copyright 2010 Andrew Fort
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import punc.journal
+
+
+class FakeResult(object):
+
+    def __init__(self, key, output, status=1):
+        self.key = key
+        self.output = output
+        self.status = status
+
+    def error_message(self):
+        return None
+
+
+class JournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'sub', '.punc_journal')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def testRoundTrip(self):
+        j = punc.journal.Journal(self.path)
+        j.open()
+        j.record('default', 'r1', '/out/r1',
+                 [FakeResult((0, 0), 'version\n'),
+                  FakeResult((1, 0), '\xff\x00binary')])
+        j.close()
+        j = punc.journal.Journal(self.path)
+        j.load()
+        self.assertEqual(len(j), 1)
+        self.assertEqual(j.results('/out/r2'), None)
+        results = j.results('/out/r1')
+        self.assertEqual([r['key'] for r in results], [(0, 0), (1, 0)])
+        self.assertEqual(results[1]['output'], '\xff\x00binary')
+        self.assertEqual(type(results[1]['output']), str)
+
+    def testTornRecord(self):
+        j = punc.journal.Journal(self.path)
+        j.open()
+        j.record('default', 'r1', '/out/r1', [FakeResult((0, 0), 'x')])
+        j.close()
+        f = open(self.path, 'a')
+        f.write('{"collection": "default", "dev')
+        f.close()
+        j.load()
+        self.assertEqual(len(j), 1)
+
+    def testResumeAfterTornRecord(self):
+        j = punc.journal.Journal(self.path)
+        j.open()
+        j.record('default', 'r1', '/out/r1', [FakeResult((0, 0), 'x')])
+        j.close()
+        f = open(self.path, 'a')
+        f.write('{"collection": "default", "dev')
+        f.close()
+        j.load()
+        j.open(resume=True)
+        j.record('default', 'r2', '/out/r2', [FakeResult((0, 0), 'y')])
+        j.close()
+        j.load()
+        self.assertEqual(len(j), 2)
+        self.assertEqual('y', j.results('/out/r2')[0]['output'])
+
+    def testOutputsNotInJournal(self):
+        j = punc.journal.Journal(self.path)
+        j.open()
+        j.record('default', 'r1', '/out/r1', [FakeResult((0, 0), 'x' * 1000)])
+        j.close()
+        self.assert_(os.path.getsize(self.path) < 1000)
+        for name in os.listdir(j.outputs_path):
+            os.remove(os.path.join(j.outputs_path, name))
+        j.load()
+        self.assertEqual(None, j.results('/out/r1'))
+
+    def testNewRunKeepsPrevious(self):
+        for output in ('x', 'y'):
+            j = punc.journal.Journal(self.path)
+            j.open()
+            j.record('default', 'r1', '/out/r1', [FakeResult((0, 0), output)])
+            j.close()
+        j.load()
+        self.assertEqual('y', j.results('/out/r1')[0]['output'])
+        # The interrupted run's journal was kept, with its outputs.
+        previous = punc.journal.Journal(self.path + '.previous')
+        previous.load()
+        self.assertEqual('x', previous.results('/out/r1')[0]['output'])
+        j.open(resume=False)
+        j.close()
+        j.load()
+        self.assertEqual(len(j), 0)
+        previous.load()
+        self.assertEqual('y', previous.results('/out/r1')[0]['output'])
+
+    def testRemove(self):
+        j = punc.journal.Journal(self.path)
+        j.open()
+        j.remove()
+        self.failIf(os.path.exists(self.path))
+        self.failIf(os.path.exists(j.outputs_path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+#!/bin/env python
+
+# Copyright 2010 Andrew Fort
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import punc.output
+
+
+class OutputFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'r1')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def write(self, *pieces, **kwargs):
+        f = punc.output.OutputFile(self.path, **kwargs)
+        for piece in pieces:
+            f.write(piece)
+        f.close()
+        return f
+
+    def read(self):
+        f = open(self.path, 'rb')
+        try:
+            return f.read()
+        finally:
+            f.close()
+
+    def testNew(self):
+        f = self.write('hostname r1\n', 'end\n')
+        self.assert_(f.changed)
+        self.assert_(f.closed)
+        self.assertEqual('hostname r1\nend\n', self.read())
+        self.assertEqual(['r1'], os.listdir(self.dir))
+
+    def testUnchanged(self):
+        self.write('hostname r1\n')
+        os.utime(self.path, (1, 1))
+        f = self.write('hostname ', 'r1\n')
+        self.assertFalse(f.changed)
+        self.assertEqual(1, os.stat(self.path).st_mtime)
+        self.assertEqual(['r1'], os.listdir(self.dir))
+
+    def testChanged(self):
+        self.write('hostname r1\n')
+        self.assert_(self.write('hostname r2\n').changed)
+        self.assertEqual('hostname r2\n', self.read())
+        self.assert_(self.write('hostname r\n').changed)
+        self.assertEqual('hostname r\n', self.read())
+
+    def testNotVisibleUntilClosed(self):
+        self.write('old\n')
+        f = punc.output.OutputFile(self.path)
+        f.write('new\n')
+        self.assertEqual('old\n', self.read())
+        f.close()
+        self.assertEqual('new\n', self.read())
+
+    def testUnchangedNotWritten(self):
+        self.write('hostname r1\n')
+        f = punc.output.OutputFile(self.path)
+        f.write('hostname r1\n')
+        self.assertEqual(['r1'], os.listdir(self.dir))
+        f.close()
+        self.assertFalse(f.changed)
+
+    def testPrefix(self):
+        self.write('hostname r1\nend\n')
+        self.assert_(self.write('hostname r1\n').changed)
+        self.assertEqual('hostname r1\n', self.read())
+        self.assert_(self.write('hostname r1\n', 'end\n', 'x').changed)
+        self.assertEqual('hostname r1\nend\nx', self.read())
+        self.assert_(self.write('hostname r1\n', 'exit\n').changed)
+        self.assertEqual('hostname r1\nexit\n', self.read())
+
+    def testAppend(self):
+        self.write('a\n')
+        f = self.write('b\n', append=True)
+        self.assert_(f.changed)
+        self.assertEqual('a\nb\n', self.read())
+
+    def testBinary(self):
+        data = '\x00\xff' * 10
+        self.write(buffer(data, 0, 7), buffer(data, 7), mode='wb')
+        self.assertEqual(data, self.read())
+        self.assertFalse(self.write(data, mode='wb').changed)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+#!/bin/env python
+
+# Copyright 2010 Andrew Fort
+
+
+import unittest
+
+import eventlet
+
+import punc.model
+import punc.parse_pool
+import punc.parser
+
+
+class ParsePoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = None
+        self.results = []
+
+    def tearDown(self):
+        if self.pool is not None:
+            self.pool.close()
+
+    def callback(self, status, output):
+        self.results.append((status, output))
+
+    def wait(self):
+        for _ in xrange(500):
+            if self.results:
+                return
+            eventlet.sleep(0.01)
+
+    def testParseResult(self):
+        self.assertEqual(
+            punc.parse_pool.parse_result(punc.parser.Parser, 'a\nb'),
+            (punc.model.Result.STATUS_OK, 'a\nb'))
+        self.assertEqual(punc.parse_pool.parse_result(None, 'a'),
+                         (punc.model.Result.STATUS_OK, 'a'))
+
+    def testInline(self):
+        self.pool = punc.parse_pool.ParsePool()
+        self.pool.submit(punc.parser.Parser, 'x' * 10, self.callback)
+        self.assertEqual(self.results,
+                         [(punc.model.Result.STATUS_OK, 'x' * 10)])
+
+    def testBelowThresholdIsInline(self):
+        self.pool = punc.parse_pool.ParsePool(processes=1, threshold=100)
+        self.pool.submit(punc.parser.Parser, 'small', self.callback)
+        self.assertEqual(self.results,
+                         [(punc.model.Result.STATUS_OK, 'small')])
+
+    def testWorker(self):
+        self.pool = punc.parse_pool.ParsePool(processes=1, threshold=100)
+        data = 'line\n' * 100
+        self.pool.submit(punc.parser.Parser, data, self.callback)
+        self.wait()
+        self.assertEqual(self.results, [(punc.model.Result.STATUS_OK, data)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,282 @@
+#!/bin/env python
+
+# Copyright 2010 Andrew Fort
+
+
+import cStringIO
+import re
+import unittest
+
+import punc.parser
+import punc.rulesets.cisco
+import punc.rulesets.juniper
+import punc.rulesets.telco
+import punc.rulesets.timetra
+
+
+def reference_parse(parser):
+    """The line by line AddDropParser algorithm, one regexp at a time."""
+    result = []
+    if parser.commented:
+        comment = parser.comment
+    else:
+        comment = ''
+    for line in parser.input:
+        dropped = False
+        if parser.flag_ignore:
+            for reg in parser.IGNORE_RE:
+                m = reg.search(line)
+                if m:
+                    raise punc.parser.SkipResult(m.group(0))
+        if parser.flag_error:
+            for reg in parser.ERROR_RE:
+                m = reg.search(line)
+                if m:
+                    raise punc.parser.DeviceReportedError(
+                        'Error from device: %s' % m.group(0))
+        if parser.flag_drop:
+            for reg in parser.DROP_RE:
+                if reg.search(line):
+                    dropped = True
+                    break
+        if parser.flag_substitute:
+            for (reg, repl) in parser.SUBST_RE:
+                line = reg.sub(repl, line)
+        if len(parser.INC_RE) and parser.flag_inc:
+            for reg in parser.INC_RE:
+                if reg.search(comment + line):
+                    result.append(comment + line)
+        elif not dropped:
+            if line:
+                result.append(comment + line)
+    result = '\n'.join(result)
+    if parser.flag_trailing_blank:
+        if parser.comment:
+            return result + '\n%s\n' % parser.comment
+        return result + '\n'
+    return result
+
+
+def outcome(parse):
+    try:
+        return parse()
+    except punc.parser.Error, e:
+        return (e.__class__, str(e))
+
+
+class MixedParser(punc.parser.AddDropParser):
+
+    commented = True
+    comment = '#'
+    IGNORE_RE = (re.compile(r'^SKIP'),
+                 re.compile(r'skip(\d+)'),
+                 )
+    ERROR_RE = (re.compile(r'% Invalid'),
+                re.compile(r'error', re.I),
+                )
+    DROP_RE = (punc.parser.BLANK_LINE,
+               re.compile(r'^Building configuration\.'),
+               re.compile(r'\Aclock'),
+               re.compile(r'^multi', re.M),
+               re.compile(r'(ab)\1'),
+               re.compile(r'secret', re.I),
+               re.compile(r'uptime is'),
+               )
+    SUBST_RE = ((re.compile(r'password \S+'), 'password <removed>'),
+                (re.compile(r'^x'), 'multi'),
+                )
+
+
+class IncParser(MixedParser):
+
+    INC_RE = (re.compile('version', re.I),
+              re.compile('Version'),
+              re.compile('^#multi'),
+              )
+
+
+LINES = ['Building configuration...', '', '   ', 'hostname r1',
+         'clock-period 5', ' clock', 'multiline', 'xyz', 'abab', 'aba',
+         'enable SECRET 5 x', 'password foo', 'uptime is 5 days',
+         'IOS Version 12.4', 'version 15', '% Invalid input', 'no Error',
+         'SKIP me', 'please skip42', 'Building configuration']
+
+
+class AddDropParserTest(unittest.TestCase):
+
+    def testLiterals(self):
+        regexps = [re.compile(r'^Building configuration\.'),
+                   re.compile(r'\Aclock'),
+                   re.compile(r'uptime is'),
+                   re.compile(r'^multi', re.M),
+                   re.compile(r'secret', re.I),
+                   punc.parser.BLANK_LINE]
+        self.assertEqual([(True, 'Building configuration.'),
+                          (True, 'clock'), (False, 'uptime is'),
+                          None, None, None],
+                         [punc.parser._literal(r) for r in regexps])
+
+    def testFlags(self):
+        data = '\n'.join(LINES[:15])
+        for flags in ('flag_ignore', 'flag_error', 'flag_drop',
+                      'flag_substitute', 'flag_inc', 'flag_trailing_blank',
+                      'commented'):
+            for parser_class in (MixedParser, IncParser):
+                for value in (True, False):
+                    parser = parser_class(data)
+                    setattr(parser, flags, value)
+                    expected = parser_class(data)
+                    setattr(expected, flags, value)
+                    self.assertEqual(
+                        outcome(lambda: reference_parse(expected)),
+                        outcome(parser.parse))
+
+    def testEveryLine(self):
+        for parser_class in (MixedParser, IncParser):
+            for line in LINES:
+                for data in (line, 'hostname r1\n' + line + '\nend'):
+                    self.assertEqual(
+                        outcome(lambda: reference_parse(parser_class(data))),
+                        outcome(parser_class(data).parse))
+
+    def testPrecedence(self):
+        # The first matching regexp reports, not the leftmost match.
+        self.assertEqual(
+            (punc.parser.SkipResult, 'skip1'),
+            outcome(MixedParser('error skip1 % Invalid').parse))
+        self.assertEqual(
+            (punc.parser.DeviceReportedError, 'Error from device: % Invalid'),
+            outcome(MixedParser('error % Invalid').parse))
+
+    def testRulesets(self):
+        data = '\n'.join(LINES[:15] + [
+            'Last configuration change at 10:00', 'Using 1234 out of 5678',
+            'ntp clock-period 17', 'Cisco IOS Software, Version 12.2'])
+        for parser_class in (punc.rulesets.cisco.ParseShowVersion,
+                             punc.rulesets.cisco.ParseConfiguration,
+                             punc.rulesets.cisco.ParseFingerprint,
+                             punc.rulesets.juniper.ParseConfiguration,
+                             punc.rulesets.telco.ParseShowVersion,
+                             punc.rulesets.timetra.ParseConfiguration):
+            self.assertEqual(
+                outcome(lambda: reference_parse(parser_class(data))),
+                outcome(parser_class(data).parse))
+
+
+class BlockParser(MixedParser):
+
+    commented = False
+    flag_trailing_blank = False
+    BLOCKS = (punc.parser.Block(re.compile(r'^banner motd (.)'),
+                                re.compile(r'\^C')),
+              punc.parser.Block(re.compile(r'^ certificate '),
+                                re.compile(r'^\s+quit$'),
+                                policy=punc.parser.Block.DROP),
+              punc.parser.Block(re.compile(r'^key-chain'),
+                                re.compile(r'^exit'),
+                                policy=punc.parser.Block.SUBSTITUTE,
+                                replacement='key-chain <removed>'),
+              )
+
+
+BLOCK_LINES = ['hostname r1', 'banner motd ^C', 'Building configuration.',
+               '', 'error in banner', '^C', 'password foo',
+               ' certificate self-signed 01', '  3082024D 308201B6', '',
+               '  SKIP 0D06092A', '  quit', 'key-chain k1', ' key 1 secret',
+               'exit', 'banner motd ^C one line ^C', 'end']
+
+
+class BlockTest(unittest.TestCase):
+
+    def testPolicies(self):
+        self.assertEqual(
+            '\n'.join(['hostname r1', 'banner motd ^C',
+                       'Building configuration.', '', 'error in banner', '^C',
+                       'password <removed>', 'key-chain <removed>',
+                       'banner motd ^C one line ^C', 'end']),
+            BlockParser('\n'.join(BLOCK_LINES)).parse())
+
+    def testChunkedInput(self):
+        data = '\n'.join(BLOCK_LINES * 2)
+        expected = BlockParser(data).parse()
+        for size in (1, 5, 64):
+            chunks = [data[i:i + size] for i in xrange(0, len(data), size)]
+            self.assertEqual(expected, BlockParser(chunks).parse())
+
+    def testUnterminated(self):
+        self.assertEqual('hostname r1\nbanner motd ^C\n\nerror',
+                         BlockParser('hostname r1\nbanner motd ^C\n\nerror')
+                         .parse())
+
+    def testDisabled(self):
+        parser = BlockParser('\n'.join(BLOCK_LINES))
+        parser.flag_blocks = False
+        self.assertRaises(punc.parser.DeviceReportedError, parser.parse)
+
+    def testVersion(self):
+        self.assertNotEqual(MixedParser.version(), BlockParser.version())
+
+    def testCiscoCertificate(self):
+        data = '\n'.join([
+            'crypto pki certificate chain TP-self-signed-1',
+            ' certificate self-signed 01', '  3082024D 308201B6 A0030201',
+            '  Using 1234', '  \tquit', 'Using 1234 out of 5678', 'end'])
+        self.assertEqual(
+            '\n'.join(['crypto pki certificate chain TP-self-signed-1',
+                       ' certificate self-signed 01',
+                       '  3082024D 308201B6 A0030201', '  Using 1234',
+                       '  \tquit', 'end']) + '\n',
+            punc.rulesets.cisco.ParseConfiguration(data).parse())
+
+    def testCiscoCertificateCrlf(self):
+        data = '\r\n'.join([
+            ' certificate self-signed 01', '  3082024D 308201B6 A0030201',
+            '  \tquit', 'Using 1234 out of 5678', 'end'])
+        self.assertEqual(
+            '\r\n'.join([' certificate self-signed 01',
+                          '  3082024D 308201B6 A0030201', '  \tquit',
+                          'end']) + '\n',
+            punc.rulesets.cisco.ParseConfiguration(data).parse())
+
+
+class ChunkedInputTest(unittest.TestCase):
+
+    def testIterLines(self):
+        for data in ('', 'a', 'a\n', '\n\nb\n\n', 'ab\ncd\n\nef'):
+            self.assertEqual(data.split('\n'),
+                             list(punc.parser.iter_lines(data)))
+            for size in (1, 2, 3):
+                chunks = [data[i:i + size]
+                          for i in xrange(0, len(data), size)]
+                self.assertEqual(data.split('\n'),
+                                 list(punc.parser.iter_lines(chunks)))
+
+    def testChunkedInput(self):
+        data = '\n'.join(LINES[:15] * 3)
+        expected = IncParser(data).parse()
+        for size in (1, 7, 64):
+            chunks = [data[i:i + size] for i in xrange(0, len(data), size)]
+            self.assertEqual(expected, IncParser(chunks).parse())
+            self.assertEqual(expected, IncParser(iter(chunks)).parse())
+        self.assertEqual(MixedParser(data).parse(),
+                         MixedParser(cStringIO.StringIO(data)).parse())
+
+    def testChunkedError(self):
+        self.assertRaises(punc.parser.SkipResult,
+                          MixedParser(['hostname r1\n', 'SKIP\nend']).parse)
+
+    def testPassThrough(self):
+        data = 'a\n\nb\n'
+        # A string is not split into lines and joined again.
+        self.assert_(punc.parser.Parser(data).parse() is data)
+        self.assertEqual(data,
+                         punc.parser.Parser(['a\n', '\nb', '\n']).parse())
+        self.assertEqual(['a', '', 'b', ''], punc.parser.Parser(data).input)
+        binary = '\x00\xff' * 10
+        self.assert_(punc.parser.NullParser(binary).parse() is binary)
+        self.assertEqual(binary, punc.parser.NullParser(
+            [binary[:5], binary[5:]]).parse())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+#!/bin/env python
+
+# Copyright 2010 Andrew Fort
+
+
+import os
+import re
+import shutil
+import tempfile
+import unittest
+
+import punc.parser
+import punc.result_cache
+
+
+class ParseA(punc.parser.AddDropParser):
+
+    DROP_RE = (re.compile('^a'),)
+
+
+class ParseB(punc.parser.AddDropParser):
+
+    DROP_RE = (re.compile('^b'),)
+
+
+class ResultCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, '.punc_results')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def testRoundTrip(self):
+        cache = punc.result_cache.ResultCache(self.path)
+        digest = punc.result_cache.digest('raw\n')
+        self.assert_(cache.get('r1', 'cisco/show', 'p/1', digest) is None)
+        cache.put('r1', 'cisco/show', 'p/1', digest, 1, 'parsed\xff\n')
+        cache.put('r1', 'cisco/skip', 'p/1', digest, 3, None)
+        cache.save()
+
+        cache = punc.result_cache.ResultCache(self.path)
+        self.assertEqual((1, 'parsed\xff\n'),
+                         cache.get('r1', 'cisco/show', 'p/1', digest))
+        self.assertEqual((3, None),
+                         cache.get('r1', 'cisco/skip', 'p/1', digest))
+        # A different result, parser version or device is not cached.
+        self.assert_(cache.get('r1', 'cisco/show', 'p/1',
+                               punc.result_cache.digest('new\n')) is None)
+        self.assert_(cache.get('r1', 'cisco/show', 'p/2', digest) is None)
+        self.assert_(cache.get('r2', 'cisco/show', 'p/1', digest) is None)
+        self.assertEqual(2, cache.hits)
+        self.assertEqual(3, cache.misses)
+
+    def testRefresh(self):
+        cache = punc.result_cache.ResultCache(self.path)
+        cache.put('r1', 'show', 'p/1', 'd', 1, 'out')
+        cache.save()
+        cache = punc.result_cache.ResultCache(self.path, refresh=True)
+        self.assert_(cache.get('r1', 'show', 'p/1', 'd') is None)
+
+    def testMissingOutput(self):
+        cache = punc.result_cache.ResultCache(self.path)
+        cache.put('r1', 'show', 'p/1', 'd', 1, 'out')
+        for name in os.listdir(self.path):
+            os.remove(os.path.join(self.path, name))
+        self.assert_(cache.get('r1', 'show', 'p/1', 'd') is None)
+
+    def testInterrupted(self):
+        cache = punc.result_cache.ResultCache(self.path)
+        cache.put('r1', 'show', 'p/1', 'd1', 1, 'old')
+        cache.save()
+        # A run which is interrupted before it saves the index.
+        cache = punc.result_cache.ResultCache(self.path)
+        cache.put('r1', 'show', 'p/1', 'd2', 1, 'new')
+        cache = punc.result_cache.ResultCache(self.path)
+        self.assertEqual((1, 'old'), cache.get('r1', 'show', 'p/1', 'd1'))
+
+    def testUnreferencedOutputsRemoved(self):
+        cache = punc.result_cache.ResultCache(self.path)
+        cache.put('r1', 'show', 'p/1', 'd1', 1, 'old')
+        cache.put('r2', 'show', 'p/1', 'd1', 1, 'old')
+        cache.save()
+        cache.put('r1', 'show', 'p/1', 'd2', 1, 'new')
+        cache.put('r2', 'show', 'p/1', 'd2', 1, 'new')
+        cache.save()
+        self.assertEqual(
+            sorted(['index', punc.result_cache.digest('new')]),
+            sorted(os.listdir(self.path)))
+
+    def testDiscard(self):
+        cache = punc.result_cache.ResultCache(self.path)
+        cache.put('r1', 'show', 'p/1', 'd', 1, 'out')
+        cache.discard('r1', 'show')
+        cache.discard('r2', 'show')
+        self.assert_(cache.get('r1', 'show', 'p/1', 'd') is None)
+
+    def testParserVersion(self):
+        self.assertNotEqual(ParseA.version(), ParseB.version())
+        self.assertEqual(ParseA.version(), ParseA.version())
+        self.assert_(ParseA.version().startswith(
+            '%s.ParseA/%d-' % (__name__, ParseA.VERSION)))
+        self.assertEqual('punc.parser.Parser/1',
+                         punc.parser.Parser.version())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+#!/bin/env python
+
+# Copyright 2010 Andrew Fort
+
+
+import socket
+import unittest
+
+import notch.client
+import notch.client.errors
+
+import punc.retry
+
+
+class RetryBudgetTest(unittest.TestCase):
+
+    def testMinimum(self):
+        b = punc.retry.RetryBudget(ratio=0.0, minimum=2)
+        self.assert_(b.spend())
+        self.assert_(b.spend())
+        self.failIf(b.spend())
+
+    def testRatio(self):
+        b = punc.retry.RetryBudget(ratio=0.5, minimum=0)
+        self.failIf(b.spend())
+        for _ in range(4):
+            b.request_sent()
+        self.assert_(b.spend())
+        self.assert_(b.spend())
+        self.failIf(b.spend())
+
+
+class RetryPolicyTest(unittest.TestCase):
+
+    def testDisabledByDefault(self):
+        p = punc.retry.RetryPolicy()
+        self.failIf(p.should_retry(socket.error('agent went away'), 1))
+
+    def testAttempts(self):
+        p = punc.retry.RetryPolicy(max_attempts=2)
+        self.assert_(p.should_retry(socket.error('agent went away'), 1))
+        self.failIf(p.should_retry(socket.error('agent went away'), 2))
+
+    def testPermanentError(self):
+        p = punc.retry.RetryPolicy(max_attempts=3, transient_errors=[])
+        self.assert_(p.is_transient(socket.error('agent went away')))
+        self.failIf(p.is_transient(notch.client.errors.ConnectError()))
+        self.failIf(p.is_transient([(-1, 'no such error code')]))
+
+    def testClassification(self):
+        p = punc.retry.RetryPolicy(max_attempts=3)
+        self.assert_(p.is_transient(notch.client.errors.ConnectError()))
+        self.assert_(p.is_transient(notch.client.errors.EOFError()))
+        self.assert_(p.is_transient(notch.client.TimeoutError()))
+        self.assert_(p.is_transient([(1, 'connect failed')]))
+        self.failIf(p.is_transient(
+            notch.client.errors.AuthenticationError()))
+        self.failIf(p.is_transient(notch.client.errors.CommandError()))
+        self.failIf(p.is_transient([(9, 'login failed')]))
+        self.failIf(p.is_transient(ValueError('unexpected')))
+        self.failIf(p.is_transient('unexpected'))
+
+    def testBackoff(self):
+        p = punc.retry.RetryPolicy(base_delay=1.0, max_delay=5.0, jitter=0.0)
+        self.assertEqual([p.delay(a) for a in (1, 2, 3, 4)], [1, 2, 4, 5])
+
+    def testJitter(self):
+        p = punc.retry.RetryPolicy(base_delay=4.0, jitter=0.5)
+        for _ in range(100):
+            self.assert_(2.0 <= p.delay(1) <= 4.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,153 @@
+#!/bin/env python
+
+# Copyright 2010 Andrew Fort
+
+
+import unittest
+
+import punc.schedule
+
+
+class FakeCollection(object):
+    """A collection which records requests sent and completes on demand."""
+
+    def __init__(self, name, scheduler, requests_per_device=1):
+        self.name = name
+        self.scheduler = scheduler
+        self.requests_per_device = requests_per_device
+        self.remaining = {}
+        self.sent = []
+
+    def add(self, device, priority=0):
+        self.remaining[device] = self.requests_per_device
+        self.scheduler.add_device(self, device, priority=priority)
+
+    def send_next_request(self, device):
+        if not self.remaining[device]:
+            return False
+        self.remaining[device] -= 1
+        self.sent.append(device)
+        return True
+
+    def complete(self, device):
+        if self.remaining[device]:
+            self.scheduler.device_ready(self, device)
+        self.scheduler.request_done(self)
+
+
+class SchedulerTest(unittest.TestCase):
+
+    def testUnlimited(self):
+        s = punc.schedule.Scheduler()
+        c = FakeCollection('c', s)
+        for d in ('r1', 'r2', 'r3'):
+            c.add(d)
+        s.dispatch()
+        self.assertEqual(c.sent, ['r1', 'r2', 'r3'])
+        self.assertEqual(s.in_flight, 3)
+        self.assertFalse(s.finished())
+        for d in ('r1', 'r2', 'r3'):
+            c.complete(d)
+        self.assert_(s.finished())
+
+    def testGlobalLimit(self):
+        s = punc.schedule.Scheduler(max_requests=2)
+        c = FakeCollection('c', s)
+        for d in ('r1', 'r2', 'r3'):
+            c.add(d)
+        s.dispatch()
+        self.assertEqual(c.sent, ['r1', 'r2'])
+        c.complete('r1')
+        self.assertEqual(c.sent, ['r1', 'r2', 'r3'])
+        self.assertEqual(s.in_flight, 2)
+
+    def testAgentLimit(self):
+        s = punc.schedule.Scheduler(max_requests=10, max_requests_per_agent=2,
+                                    num_agents=2)
+        self.assertEqual(s.limit, 4)
+
+    def testCollectionLimit(self):
+        s = punc.schedule.Scheduler(max_requests_per_collection=1)
+        a = FakeCollection('a', s)
+        b = FakeCollection('b', s)
+        a.add('a1')
+        a.add('a2')
+        b.add('b1')
+        s.dispatch()
+        self.assertEqual(a.sent, ['a1'])
+        self.assertEqual(b.sent, ['b1'])
+        a.complete('a1')
+        self.assertEqual(a.sent, ['a1', 'a2'])
+
+    def testRecipesShareCollection(self):
+        # The recipes of a collection share its limit and priority order.
+        s = punc.schedule.Scheduler(max_requests_per_collection=1)
+        cisco = FakeCollection('default', s)
+        juniper = FakeCollection('default', s)
+        cisco.add('ar1', priority=-1)
+        juniper.add('cr1', priority=-5)
+        cisco.add('ar2', priority=-3)
+        s.dispatch()
+        self.assertEqual(juniper.sent, ['cr1'])
+        self.assertEqual(cisco.sent, [])
+        juniper.complete('cr1')
+        self.assertEqual(cisco.sent, ['ar2'])
+        cisco.complete('ar2')
+        self.assertEqual(cisco.sent, ['ar2', 'ar1'])
+
+    def testStartedDevicesFirst(self):
+        s = punc.schedule.Scheduler(max_requests=1)
+        c = FakeCollection('c', s, requests_per_device=2)
+        c.add('r1')
+        c.add('r2')
+        s.dispatch()
+        c.complete('r1')
+        self.assertEqual(c.sent, ['r1', 'r1'])
+
+    def testPriority(self):
+        s = punc.schedule.Scheduler(max_requests=1)
+        c = FakeCollection('c', s)
+        c.add('fast', priority=0)
+        c.add('slow', priority=-10)
+        s.dispatch()
+        self.assertEqual(c.sent, ['slow'])
+
+    def testDelayed(self):
+        now = [100.0]
+        s = punc.schedule.Scheduler(clock=lambda: now[0])
+        c = FakeCollection('c', s, requests_per_device=2)
+        c.add('r1')
+        s.dispatch()
+        c.scheduler.device_ready(c, 'r1', delay=5)
+        s.request_done(c)
+        self.assertEqual(c.sent, ['r1'])
+        self.assertFalse(s.finished())
+        now[0] += 5
+        s.dispatch()
+        self.assertEqual(c.sent, ['r1', 'r1'])
+
+    def testDropCollection(self):
+        now = [100.0]
+        s = punc.schedule.Scheduler(clock=lambda: now[0])
+        c1 = FakeCollection('c', s, requests_per_device=2)
+        c2 = FakeCollection('c', s, requests_per_device=2)
+        c1.add('r1')
+        c2.add('r2')
+        s.dispatch()
+        s.device_ready(c1, 'r1', delay=5)
+        s.request_done(c1)
+        s.device_ready(c2, 'r2', delay=5)
+        s.request_done(c2)
+        c1.add('r3')
+        s.drop_collection(c1)
+        now[0] += 5
+        s.dispatch()
+        # c1's delayed and unstarted devices were dropped; c2's were not.
+        self.assertEqual(['r1'], c1.sent)
+        self.assertEqual(['r2', 'r2'], c2.sent)
+        c2.complete('r2')
+        self.assert_(s.finished())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+#!/bin/env python
+
+# Copyright 2010 Andrew Fort
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import punc.shard
+
+
+REPORT = """PUNC Collection Errors:
+
+  r1:
+    cisco:show version TimeoutError
+    cisco:show running-config TimeoutError
+
+  r2:
+    juniper:show configuration AuthenticationError
+"""
+
+
+class ShardTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def testParseShard(self):
+        self.assertEqual(punc.shard.parse_shard(None), None)
+        self.assertEqual(punc.shard.parse_shard('2/4'), (2, 4))
+        for spec in ('0/4', '5/4', '1/0', 'a/b', '1', '1/2/3'):
+            self.assertRaises(ValueError, punc.shard.parse_shard, spec)
+
+    def testEveryDeviceInOneShard(self):
+        devices = ['r%d.example.net' % i for i in xrange(200)]
+        counts = dict([(d, 0) for d in devices])
+        for i in (1, 2, 3):
+            for d in devices:
+                if punc.shard.in_shard(d, (i, 3)):
+                    counts[d] += 1
+        self.assertEqual(set(counts.values()), set([1]))
+        self.assert_(punc.shard.in_shard('r1', None))
+
+    def testParseErrorReport(self):
+        errors = punc.shard.parse_error_report(REPORT)
+        self.assertEqual(sorted(errors.keys()), ['r1', 'r2'])
+        self.assertEqual(len(errors['r1']), 2)
+        self.assertEqual(errors['r2'],
+                         set(['juniper:show configuration '
+                              'AuthenticationError']))
+
+    def testMergeTrees(self):
+        sources = []
+        for i in (1, 2):
+            source = os.path.join(self.tmpdir, 'shard%d' % i)
+            os.makedirs(os.path.join(source, 'router', '.hg'))
+            open(os.path.join(source, 'router', 'r%d' % i), 'w').write('x')
+            open(os.path.join(source, '.punc_history'), 'w').write('{}')
+            open(os.path.join(source, 'router', '.hg', 'f'), 'w').write('')
+            sources.append(source)
+        dest = os.path.join(self.tmpdir, 'dest')
+        self.assertEqual(punc.shard.merge_trees(sources, dest), 2)
+        self.assertEqual(sorted(os.listdir(os.path.join(dest, 'router'))),
+                         ['r1', 'r2'])
+        self.failIf(os.path.exists(os.path.join(dest, '.punc_history')))
+
+    def testMergeWritten(self):
+        dest = os.path.join(self.tmpdir, 'dest')
+        os.makedirs(os.path.join(dest, 'router'))
+        open(os.path.join(dest, 'router', 'r1'), 'w').write('new')
+        sources = []
+        for i, written in ((1, ['r2']), (2, ['r3'])):
+            source = os.path.join(self.tmpdir, 'shard%d' % i)
+            os.makedirs(os.path.join(source, 'router'))
+            # A file left by an earlier run of the shard.
+            open(os.path.join(source, 'router', 'r1'), 'w').write('stale')
+            for name in written:
+                open(os.path.join(source, 'router', name), 'w').write(name)
+            punc.shard.save_written(
+                source, [os.path.join(source, 'router', n) for n in written])
+            sources.append(source)
+        self.assertEqual(punc.shard.merge_trees(sources, dest), 2)
+        self.assertEqual(sorted(os.listdir(os.path.join(dest, 'router'))),
+                         ['r1', 'r2', 'r3'])
+        self.assertEqual('new',
+                         open(os.path.join(dest, 'router', 'r1')).read())
+
+
+if __name__ == '__main__':
+    unittest.main()
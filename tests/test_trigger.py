@@ -0,0 +1,56 @@
+#!/bin/env python
+
+# Copyright 2010 Andrew Fort
+
+
+import unittest
+
+import punc.trigger
+
+
+DEVICES = set(['r1.example.net', 'core2.example.net'])
+
+IOS = ('<189>123: r1: *Mar  1 00:10:00: %SYS-5-CONFIG_I: Configured from '
+       'console by vty0')
+JUNOS = ('<189>Mar  1 00:10:00 core2 mgd[1234]: UI_COMMIT: User \'x\' '
+         'requested \'commit\' operation')
+RFC5424 = ('<189>1 2010-03-01T00:10:00Z core2.example.net mgd 1234 '
+           'UI_COMMIT - commit')
+
+
+class TriggerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.triggered = []
+        self.resolver = punc.trigger.DeviceResolver(
+            lambda: DEVICES, hosts={'192.0.2.1': 'r1.example.net'})
+        # No reverse DNS in tests.
+        self.resolver._dns['192.0.2.2'] = None
+        self.listener = punc.trigger.SyslogListener(self.resolver,
+                                                    self.triggered.append)
+
+    def testParseHostname(self):
+        self.assertEqual(punc.trigger.parse_hostname(IOS), None)
+        self.assertEqual(punc.trigger.parse_hostname(JUNOS), 'core2')
+        self.assertEqual(punc.trigger.parse_hostname(RFC5424),
+                         'core2.example.net')
+
+    def testResolve(self):
+        self.assertEqual(self.resolver.resolve('192.0.2.1'), 'r1.example.net')
+        self.assertEqual(self.resolver.resolve('192.0.2.2', 'CORE2'),
+                         'core2.example.net')
+        self.assertEqual(self.resolver.resolve('192.0.2.2', 'r9'), None)
+
+    def testHandle(self):
+        self.assertEqual(self.listener.handle(IOS, '192.0.2.1'),
+                         'r1.example.net')
+        self.assertEqual(self.listener.handle(JUNOS, '192.0.2.2'),
+                         'core2.example.net')
+        self.assertEqual(self.listener.handle('<189>hello', '192.0.2.1'),
+                         None)
+        self.assertEqual(self.triggered,
+                         ['r1.example.net', 'core2.example.net'])
+
+
+if __name__ == '__main__':
+    unittest.main()